@@ -0,0 +1,241 @@
+"""
+Per-user read markers for channels.
+
+A marker is the ``(timestamp, id)`` of the last message a user has read in a
+channel. Markers only move forward, so marking a channel read is a single
+row write no matter how many messages it covers, and the unread count is a
+seek on the ``messages(channel_id, timestamp, id)`` index starting just past
+the marker.
+
+Each marker row also carries the user's unread and mention counters for the
+channel, so the sidebar badges for every channel are one read of this table.
+The counters are kept in step on the same session as the write that changes
+them:
+
+- ``record_message_sent``    - after a new channel message is flushed
+- ``record_message_deleted`` - before a channel message is deleted
+- ``record_mentions_changed`` - when an edit changes who a message mentions
+- ``advance_channel_marker`` - when the user reads up to a message
+- ``start_channel_marker``   - when the user joins a channel
+"""
+
+import json
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from sqlalchemy import and_, case, literal, or_, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from .models import ChannelReadState, Message, channel_members
+
+
+def read_position(state) -> Optional[tuple]:
+    """The (timestamp, id) a marker row points at, or None if nothing was read yet"""
+    if state is None or state.last_read_at is None:
+        return None
+    return (state.last_read_at, state.last_read_message_id)
+
+
+def message_mentions(message: Message) -> List[int]:
+    """User ids a channel message mentions (stored as a JSON array on the message)"""
+    if not message.mentions:
+        return []
+    try:
+        return [int(user_id) for user_id in json.loads(message.mentions)]
+    except (TypeError, ValueError):
+        return []
+
+
+def _get_or_create(db: Session, user_id: int, channel_id: int) -> ChannelReadState:
+    state = db.get(ChannelReadState, (user_id, channel_id))
+    if state is None:
+        state = ChannelReadState(user_id=user_id, channel_id=channel_id, unread_count=0, mention_count=0)
+        db.add(state)
+    return state
+
+
+def advance_channel_marker(db: Session, user_id: int, channel_id: int, message: Message) -> ChannelReadState:
+    """Move a user's marker in a channel up to ``message`` (never backwards) and recount its badges"""
+    state = _get_or_create(db, user_id, channel_id)
+
+    current = read_position(state)
+    if current is None or (message.timestamp, message.id) > current:
+        state.last_read_message_id = message.id
+        state.last_read_at = message.timestamp
+        newer = db.query(Message.id).filter(
+            Message.channel_id == channel_id,
+            tuple_(Message.timestamp, Message.id) > (message.timestamp, message.id)
+        ).first()
+        if newer is None:
+            # Read up to the newest message: nothing left to count
+            state.unread_count = 0
+            state.mention_count = 0
+        else:
+            state.unread_count = channel_unread_count(db, user_id, channel_id, state)
+            state.mention_count = channel_mention_count(db, user_id, channel_id, state)
+    db.flush()
+    return state
+
+
+def start_channel_marker(db: Session, user_id: int, channel_id: int) -> ChannelReadState:
+    """Place a new member's marker at the channel's newest message, so its history starts out read"""
+    state = _get_or_create(db, user_id, channel_id)
+    latest = db.query(Message.id, Message.timestamp).filter(
+        Message.channel_id == channel_id
+    ).order_by(Message.timestamp.desc(), Message.id.desc()).first()
+    if latest is not None:
+        state.last_read_message_id, state.last_read_at = latest.id, latest.timestamp
+    state.unread_count = 0
+    state.mention_count = 0
+    db.flush()
+    return state
+
+
+def forget_channel_markers(db: Session, channel_id: int, user_id: Optional[int] = None):
+    """Drop the markers of a channel (or of one member leaving it)"""
+    query = db.query(ChannelReadState).filter(ChannelReadState.channel_id == channel_id)
+    if user_id is not None:
+        query = query.filter(ChannelReadState.user_id == user_id)
+    query.delete(synchronize_session=False)
+
+
+def record_message_sent(db: Session, message: Message, mentioned_user_ids: Iterable[int] = ()):
+    """
+    Bump the unread counter of every other member of the message's channel,
+    and the mention counter of those it mentions (all of them for ``@channel``):
+    one INSERT ... SELECT over ``channel_members`` that creates missing marker
+    rows on the way.
+    """
+    table = ChannelReadState.__table__
+    members = channel_members.c
+    mentioned = sorted(set(mentioned_user_ids) - {message.user_id})
+    if message.mentions_channel:
+        mention = literal(1)
+    elif mentioned:
+        mention = case((members.user_id.in_(mentioned), 1), else_=0)
+    else:
+        mention = literal(0)
+    recipients = select(
+        members.user_id,
+        members.channel_id,
+        literal(1),
+        mention,
+        literal(datetime.utcnow())
+    ).where(
+        members.channel_id == message.channel_id,
+        members.user_id != message.user_id
+    )
+
+    dialect = db.get_bind().dialect.name
+    if dialect not in ("sqlite", "postgresql"):
+        for user_id, _, _, mentions, _ in db.execute(recipients).all():
+            state = _get_or_create(db, user_id, message.channel_id)
+            state.unread_count = (state.unread_count or 0) + 1
+            state.mention_count = (state.mention_count or 0) + mentions
+        db.flush()
+        return
+
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    stmt = insert(table).from_select(
+        ["user_id", "channel_id", "unread_count", "mention_count", "updated_at"],
+        recipients
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.channel_id],
+        set_={
+            "unread_count": table.c.unread_count + 1,
+            "mention_count": table.c.mention_count + stmt.excluded.mention_count
+        }
+    )
+    db.execute(stmt)
+
+
+def _not_yet_read(table, message: Message):
+    """Marker rows whose position is before ``message``"""
+    return or_(
+        table.c.last_read_at.is_(None),
+        tuple_(table.c.last_read_at, table.c.last_read_message_id) < (message.timestamp, message.id)
+    )
+
+
+def record_mentions_changed(db: Session, message: Message, previous_user_ids: Iterable[int]):
+    """
+    Apply an edit's mention changes to the mention counters of members who had
+    not read the message yet: +1 for users it now mentions, -1 for users it no
+    longer does. Call after ``message.mentions`` holds the new list.
+    """
+    if message.mentions_channel:
+        # Every member was counted already, whoever the edit names
+        return
+    table = ChannelReadState.__table__
+    previous = set(previous_user_ids) - {message.user_id}
+    current = set(message_mentions(message)) - {message.user_id}
+    for user_ids, delta in ((current - previous, 1), (previous - current, -1)):
+        if not user_ids:
+            continue
+        mention_count = table.c.mention_count + 1 if delta > 0 else case(
+            (table.c.mention_count > 0, table.c.mention_count - 1), else_=0
+        )
+        db.execute(
+            update(table).where(
+                table.c.channel_id == message.channel_id,
+                table.c.user_id.in_(sorted(user_ids)),
+                _not_yet_read(table, message)
+            ).values(mention_count=mention_count)
+        )
+
+
+def record_message_deleted(db: Session, message: Message):
+    """Take a message back out of the counters of members who had not read it yet"""
+    table = ChannelReadState.__table__
+    mentioned = sorted(set(message_mentions(message)) - {message.user_id})
+    if message.mentions_channel:
+        mentioned_here = literal(True)
+    elif mentioned:
+        mentioned_here = table.c.user_id.in_(mentioned)
+    else:
+        mentioned_here = literal(False)
+    db.execute(
+        update(table).where(
+            table.c.channel_id == message.channel_id,
+            table.c.user_id != message.user_id,
+            _not_yet_read(table, message)
+        ).values(
+            unread_count=case((table.c.unread_count > 0, table.c.unread_count - 1), else_=0),
+            mention_count=case(
+                (and_(mentioned_here, table.c.mention_count > 0), table.c.mention_count - 1),
+                else_=table.c.mention_count
+            )
+        )
+    )
+
+
+def channel_unread_count(db: Session, user_id: int, channel_id: int, state: Optional[ChannelReadState] = None) -> int:
+    """Messages by other people in a channel after the user's read marker"""
+    query = db.query(Message).filter(
+        Message.channel_id == channel_id,
+        Message.user_id != user_id
+    )
+    position = read_position(state)
+    if position is not None:
+        query = query.filter(tuple_(Message.timestamp, Message.id) > position)
+    return query.count()
+
+
+def channel_mention_count(db: Session, user_id: int, channel_id: int, state: Optional[ChannelReadState] = None) -> int:
+    """Messages in a channel after the user's read marker that mention them"""
+    # Read from the messages themselves: the mention Activity rows are written
+    # asynchronously by the notification fan-out and may not exist yet
+    query = db.query(Message).filter(
+        Message.channel_id == channel_id,
+        Message.user_id != user_id,
+        or_(Message.mentions.isnot(None), Message.mentions_channel == True)
+    )
+    position = read_position(state)
+    if position is not None:
+        query = query.filter(tuple_(Message.timestamp, Message.id) > position)
+    return sum(1 for message in query if message.mentions_channel or user_id in message_mentions(message))
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -17,17 +18,108 @@ class Settings:
         f"sqlite:///{os.path.join(os.path.dirname(__file__), '..', 'data', 'slack_rl.db')}"
     )
     
+    # SQLite connection profile: "production" applies the pragmas below to
+    # every connection, "default" leaves SQLite's stock settings alone
+    SQLITE_PROFILE: str = os.getenv("SQLITE_PROFILE", "production")
+    SQLITE_JOURNAL_MODE: str = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    SQLITE_SYNCHRONOUS: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_MMAP_SIZE: int = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    # Negative values are KiB (SQLite convention): -65536 is a 64 MiB page cache
+    SQLITE_CACHE_SIZE: int = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))
+    SQLITE_TEMP_STORE: str = os.getenv("SQLITE_TEMP_STORE", "MEMORY")
+    SQLITE_BUSY_TIMEOUT_MS: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    
+    # Retries for statements that still fail with SQLITE_BUSY after busy_timeout
+    SQLITE_BUSY_RETRIES: int = int(os.getenv("SQLITE_BUSY_RETRIES", "5"))
+    SQLITE_BUSY_BACKOFF_MS: int = int(os.getenv("SQLITE_BUSY_BACKOFF_MS", "25"))
+    SQLITE_BUSY_BACKOFF_MAX_MS: int = int(os.getenv("SQLITE_BUSY_BACKOFF_MAX_MS", "1000"))
+    
+    # Group commit: queue message/reaction/activity/notification inserts and
+    # commit them together every few milliseconds (opt-in)
+    WRITE_BATCHING: bool = os.getenv("WRITE_BATCHING", "False").lower() == "true"
+    WRITE_BATCH_WINDOW_MS: int = int(os.getenv("WRITE_BATCH_WINDOW_MS", "4"))
+    WRITE_BATCH_MAX_SIZE: int = int(os.getenv("WRITE_BATCH_MAX_SIZE", "256"))
+    
+    # Schema migrations: rows per backfill transaction and pause between chunks
+    MIGRATION_CHUNK_SIZE: int = int(os.getenv("MIGRATION_CHUNK_SIZE", "1000"))
+    MIGRATION_CHUNK_PAUSE_MS: int = int(os.getenv("MIGRATION_CHUNK_PAUSE_MS", "10"))
+    
+    # Full-text search backend: auto (FTS5 on SQLite, tsvector on PostgreSQL), fts5, postgres or like
+    SEARCH_BACKEND: str = os.getenv("SEARCH_BACKEND", "auto")
+    
+    # Universal search: worker threads shared by the per-category queries, and
+    # each category's time budget and result cap (users/channels when mixed with messages)
+    SEARCH_FANOUT_THREADS: int = int(os.getenv("SEARCH_FANOUT_THREADS", "8"))
+    SEARCH_DIRECTORY_TIMEOUT_MS: int = int(os.getenv("SEARCH_DIRECTORY_TIMEOUT_MS", "500"))
+    SEARCH_MESSAGES_TIMEOUT_MS: int = int(os.getenv("SEARCH_MESSAGES_TIMEOUT_MS", "3000"))
+    SEARCH_USERS_LIMIT: int = int(os.getenv("SEARCH_USERS_LIMIT", "10"))
+    SEARCH_CHANNELS_LIMIT: int = int(os.getenv("SEARCH_CHANNELS_LIMIT", "10"))
+    
+    # Message search result cache (0 disables); entries are also dropped as soon as a covered channel changes
+    SEARCH_CACHE_SIZE: int = int(os.getenv("SEARCH_CACHE_SIZE", "1000"))
+    SEARCH_CACHE_TTL_SECONDS: int = int(os.getenv("SEARCH_CACHE_TTL_SECONDS", "300"))
+    
+    # Channels whose member-id sets are kept in memory for access checks
+    MEMBERSHIP_CACHE_CHANNELS: int = int(os.getenv("MEMBERSHIP_CACHE_CHANNELS", "2000"))
+    
+    # Mention/reply/invite/reaction notifications are written by a background
+    # worker; events arriving within the window share one transaction
+    NOTIFICATION_FANOUT: bool = os.getenv("NOTIFICATION_FANOUT", "True").lower() == "true"
+    NOTIFICATION_FANOUT_WINDOW_MS: int = int(os.getenv("NOTIFICATION_FANOUT_WINDOW_MS", "20"))
+    NOTIFICATION_FANOUT_MAX_BATCH: int = int(os.getenv("NOTIFICATION_FANOUT_MAX_BATCH", "200"))
+    
+    # An unread notification absorbs later events with the same (recipient, type,
+    # source) for this long after its last one (0 disables), remembering the most
+    # recent actors; digest-mode users get one reaction/reply digest per period
+    NOTIFICATION_COALESCE_WINDOW_SECONDS: int = int(os.getenv("NOTIFICATION_COALESCE_WINDOW_SECONDS", "3600"))
+    NOTIFICATION_RECENT_ACTORS: int = int(os.getenv("NOTIFICATION_RECENT_ACTORS", "5"))
+    NOTIFICATION_DIGEST_PERIOD_SECONDS: int = int(os.getenv("NOTIFICATION_DIGEST_PERIOD_SECONDS", "3600"))
+    
+    # Retention: read notifications and activities older than these many days
+    # are deleted in the background (0 keeps them), a small chunk at a time (opt-in)
+    RETENTION_ENABLED: bool = os.getenv("RETENTION_ENABLED", "False").lower() == "true"
+    NOTIFICATION_RETENTION_DAYS: int = int(os.getenv("NOTIFICATION_RETENTION_DAYS", "30"))
+    ACTIVITY_RETENTION_DAYS: int = int(os.getenv("ACTIVITY_RETENTION_DAYS", "90"))
+    RETENTION_INTERVAL_SECONDS: int = int(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+    RETENTION_CHUNK_SIZE: int = int(os.getenv("RETENTION_CHUNK_SIZE", "500"))
+    RETENTION_CHUNK_PAUSE_MS: int = int(os.getenv("RETENTION_CHUNK_PAUSE_MS", "50"))
+    
     # Security settings
     SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key-change-this-in-production")
     SESSION_COOKIE_NAME: str = "session_id"
     SESSION_EXPIRY_HOURS: int = int(os.getenv("SESSION_EXPIRY_HOURS", "24"))
     
+    # Validated-session cache (shared by the auth middleware and get_current_user)
+    SESSION_CACHE_SIZE: int = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+    SESSION_CACHE_TTL_SECONDS: int = int(os.getenv("SESSION_CACHE_TTL_SECONDS", "300"))
+    
+    # Worker threads the auth middleware may use for session lookups on a cache miss
+    AUTH_LOOKUP_THREADS: int = int(os.getenv("AUTH_LOOKUP_THREADS", "8"))
+    
+    # Seconds a cached user profile (author name/avatar) may be served without re-reading it
+    PROFILE_CACHE_TTL_SECONDS: int = int(os.getenv("PROFILE_CACHE_TTL_SECONDS", "60"))
+    
+    # GET /api/diagnostics/database reports pragmas, queues and worker stats (opt-in)
+    DIAGNOSTICS_ENABLED: bool = os.getenv("DIAGNOSTICS_ENABLED", "False").lower() == "true"
+    
     # Password hashing
     BCRYPT_ROUNDS: int = 12
     
     # CORS settings
     CORS_ORIGINS: list = os.getenv("CORS_ORIGINS", "*").split(",")
     
+    # Real-time (WebSocket) delivery
+    WS_SEND_QUEUE_SIZE: int = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+    WS_SEND_TIMEOUT_SECONDS: float = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "5"))
+    
+    # Cross-worker event bus: local (single worker), unix or redis
+    EVENT_BROKER: str = os.getenv("EVENT_BROKER", "local")
+    EVENT_BROKER_SOCKET: str = os.getenv(
+        "EVENT_BROKER_SOCKET",
+        os.path.join(tempfile.gettempdir(), "slack-clone-events.sock")
+    )
+    EVENT_BROKER_URL: str = os.getenv("EVENT_BROKER_URL", "redis://localhost:6379/0")
+    
     # Server settings
     HOST: str = os.getenv("HOST", "0.0.0.0")
     PORT: int = int(os.getenv("PORT", "8000"))
@@ -1,6 +1,16 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, declarative_base
 import os
+import random
+import sqlite3
+import threading
+import time
+
+try:
+    from .config import settings
+except ImportError:
+    from backend.config import settings
 
 # Allow overriding the database via environment variables. This makes it
 # easy to mount a persistent disk (set DATABASE_FILE to the mounted path) or
@@ -8,13 +18,114 @@ import os
 DATABASE_URL = os.getenv('DATABASE_URL')
 DATABASE_FILE = os.getenv('DATABASE_FILE') or os.path.join(os.path.dirname(__file__), '..', 'data', 'slack_rl.db')
 
-if DATABASE_URL:
-    # e.g. postgres or another SQLAlchemy-compatible URL
-    engine = create_engine(DATABASE_URL)
+
+# ----- SQLite: busy retry -----
+#
+# busy_timeout makes SQLite wait for a competing writer, but a statement can
+# still come back with SQLITE_BUSY once that wait runs out. The sqlite3 driver
+# only opens a transaction at the first write, so the statement that hits
+# BUSY (the first INSERT/UPDATE/DELETE, or the COMMIT) can simply be re-run.
+# Doing that here, under every Session, keeps the ORM unit of work intact; a
+# retry above the Session would happen after it had already rolled back.
+
+busy_stats = {"retries": 0, "gave_up": 0}
+_busy_stats_lock = threading.Lock()
+
+
+def _is_busy(exc: sqlite3.OperationalError) -> bool:
+    code = getattr(exc, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    message = str(exc).lower()
+    return "database is locked" in message or "database is busy" in message
+
+
+def _count(key: str):
+    with _busy_stats_lock:
+        busy_stats[key] += 1
+
+
+def _retry_busy(operation, *args):
+    """Run a DBAPI call, retrying SQLITE_BUSY with full-jitter exponential backoff"""
+    attempt = 0
+    while True:
+        try:
+            return operation(*args)
+        except sqlite3.OperationalError as exc:
+            if not _is_busy(exc):
+                raise
+            if attempt >= settings.SQLITE_BUSY_RETRIES:
+                _count("gave_up")
+                raise
+            cap = min(settings.SQLITE_BUSY_BACKOFF_MAX_MS, settings.SQLITE_BUSY_BACKOFF_MS * (2 ** attempt))
+            time.sleep(random.uniform(0, cap) / 1000.0)
+            attempt += 1
+            _count("retries")
+
+
+class BusyRetryCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        return _retry_busy(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        # Materialise generators so a retry replays the same rows
+        return _retry_busy(super().executemany, sql, list(seq_of_parameters))
+
+
+class BusyRetryConnection(sqlite3.Connection):
+    def cursor(self, factory=BusyRetryCursor):
+        return super().cursor(factory)
+
+    def commit(self):
+        # A COMMIT that fails with SQLITE_BUSY leaves the transaction open and may be retried
+        return _retry_busy(super().commit)
+
+
+# ----- SQLite: connection profile -----
+
+def sqlite_pragmas() -> dict:
+    """Pragmas applied to every SQLite connection under the active profile"""
+    if settings.SQLITE_PROFILE.lower() != "production":
+        return {}
+    return {
+        "journal_mode": settings.SQLITE_JOURNAL_MODE,
+        "synchronous": settings.SQLITE_SYNCHRONOUS,
+        "mmap_size": settings.SQLITE_MMAP_SIZE,
+        "cache_size": settings.SQLITE_CACHE_SIZE,
+        "temp_store": settings.SQLITE_TEMP_STORE,
+        "busy_timeout": settings.SQLITE_BUSY_TIMEOUT_MS,
+    }
+
+
+def database_url() -> str:
+    if DATABASE_URL:
+        return DATABASE_URL
+    return f"sqlite:///{os.path.abspath(DATABASE_FILE)}"
+
+
+db_url = database_url()
+
+# The SQLite setup follows the URL's dialect, so DATABASE_URL=sqlite:///...
+# gets the same connection profile as DATABASE_FILE
+if make_url(db_url).get_backend_name() == "sqlite":
+    engine = create_engine(db_url, connect_args={
+        "check_same_thread": False,
+        "factory": BusyRetryConnection,
+        "timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000.0,
+    })
+
+    @event.listens_for(engine, "connect")
+    def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in sqlite_pragmas().items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
 else:
-    db_path = os.path.abspath(DATABASE_FILE)
-    db_url = f"sqlite:///{db_path}"
-    engine = create_engine(db_url, connect_args={"check_same_thread": False})
+    # e.g. postgres or another SQLAlchemy-compatible URL
+    engine = create_engine(db_url)
+
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 Base = declarative_base()
 
@@ -0,0 +1,152 @@
+"""
+Maintenance of the ``dm_conversations`` summary table.
+
+Each DM conversation has two summary rows, one per participant, holding the
+conversation's latest message, that participant's read marker (the last
+message from the partner they have read) and their unread count. The
+conversation list is then one indexed query instead of a scan of
+``direct_messages`` per partner, and reading a conversation moves the marker
+instead of flagging every message.
+
+Every write path that changes a DM calls into this module on the same
+session, so the summary commits (or rolls back) together with the message:
+
+- ``record_sent``     - after a new DM is flushed
+- ``mark_read_up_to`` - when the user reads up to a message
+- ``record_deleted``  - before a DM is deleted
+
+Edits need no bookkeeping: rows point at the latest message by id, and the
+list endpoint loads its current content.
+"""
+
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import case, or_, tuple_
+from sqlalchemy.orm import Session
+
+from .models import DMConversation, DirectMessage, conversation_key
+
+
+def _upsert(db: Session, user_id: int, partner_id: int, dm: DirectMessage, unread: int):
+    table = DMConversation.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect not in ("sqlite", "postgresql"):
+        row = db.get(DMConversation, (user_id, partner_id))
+        if row is None:
+            row = DMConversation(user_id=user_id, partner_id=partner_id, unread_count=0)
+            db.add(row)
+        if row.last_message_at is None or dm.timestamp >= row.last_message_at:
+            row.last_message_id = dm.id
+            row.last_message_at = dm.timestamp
+        row.unread_count = (row.unread_count or 0) + unread
+        db.flush()
+        return
+
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    stmt = insert(table).values(
+        user_id=user_id,
+        partner_id=partner_id,
+        last_message_id=dm.id,
+        last_message_at=dm.timestamp,
+        unread_count=unread
+    )
+    # Concurrent sends may commit out of timestamp order; keep the newest
+    newer = or_(table.c.last_message_at.is_(None), stmt.excluded.last_message_at >= table.c.last_message_at)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.partner_id],
+        set_={
+            "last_message_id": case((newer, stmt.excluded.last_message_id), else_=table.c.last_message_id),
+            "last_message_at": case((newer, stmt.excluded.last_message_at), else_=table.c.last_message_at),
+            "unread_count": table.c.unread_count + unread
+        }
+    )
+    db.execute(stmt)
+
+
+def record_sent(db: Session, dm: DirectMessage):
+    """Update both participants' summaries for a newly flushed DM"""
+    _upsert(db, dm.sender_id, dm.receiver_id, dm, unread=0)
+    _upsert(db, dm.receiver_id, dm.sender_id, dm, unread=1)
+
+
+def read_position(row: Optional[DMConversation]) -> Optional[tuple]:
+    """The (timestamp, id) a summary's read marker points at, or None if nothing was read yet"""
+    if row is None or row.last_read_at is None:
+        return None
+    return (row.last_read_at, row.last_read_message_id)
+
+
+def is_read_by(row: Optional[DMConversation], dm: DirectMessage) -> bool:
+    """Whether the owner of ``row`` (the DM's receiver) has read ``dm``"""
+    position = read_position(row)
+    return position is not None and (dm.timestamp, dm.id) <= position
+
+
+def load_receiver_markers(db: Session, dms: Iterable[DirectMessage]) -> Dict[Tuple[int, int], DMConversation]:
+    """The receivers' rows of a set of DMs, keyed by (receiver_id, sender_id), in one query"""
+    wanted = {(dm.receiver_id, dm.sender_id) for dm in dms}
+    if not wanted:
+        return {}
+    rows = db.query(DMConversation).filter(
+        tuple_(DMConversation.user_id, DMConversation.partner_id).in_(sorted(wanted))
+    ).all()
+    return {(row.user_id, row.partner_id): row for row in rows}
+
+
+def mark_read_up_to(db: Session, user_id: int, partner_id: int, dm: DirectMessage) -> Optional[DMConversation]:
+    """
+    Move a user's read marker in a conversation up to ``dm`` (never
+    backwards) and recount what is still unread: one row write however many
+    messages it covers.
+    """
+    row = db.get(DMConversation, (user_id, partner_id))
+    if row is None:
+        return None
+
+    position = read_position(row)
+    if position is not None and (dm.timestamp, dm.id) <= position:
+        return row
+
+    row.last_read_message_id = dm.id
+    row.last_read_at = dm.timestamp
+    if row.last_message_at is None or (dm.timestamp, dm.id) >= (row.last_message_at, row.last_message_id):
+        row.unread_count = 0
+    else:
+        # Range count on the conversation index, starting just past the marker
+        row.unread_count = db.query(DirectMessage).filter(
+            DirectMessage.conversation_key == conversation_key(user_id, partner_id),
+            tuple_(DirectMessage.timestamp, DirectMessage.id) > (dm.timestamp, dm.id),
+            DirectMessage.sender_id == partner_id
+        ).count()
+    db.flush()
+    return row
+
+
+def record_deleted(db: Session, dm: DirectMessage):
+    """Update both participants' summaries before a DM is deleted"""
+    receiver_row = db.get(DMConversation, (dm.receiver_id, dm.sender_id))
+    if receiver_row is not None and receiver_row.unread_count and not is_read_by(receiver_row, dm):
+        receiver_row.unread_count -= 1
+
+    rows = db.query(DMConversation).filter(
+        DMConversation.last_message_id == dm.id
+    ).all()
+    if not rows:
+        return
+
+    latest = db.query(DirectMessage.id, DirectMessage.timestamp).filter(
+        DirectMessage.conversation_key == conversation_key(dm.sender_id, dm.receiver_id),
+        DirectMessage.id != dm.id
+    ).order_by(DirectMessage.timestamp.desc(), DirectMessage.id.desc()).first()
+
+    for row in rows:
+        if latest is None:
+            # Conversation is now empty
+            db.delete(row)
+        else:
+            row.last_message_id, row.last_message_at = latest.id, latest.timestamp
+    db.flush()
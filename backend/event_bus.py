@@ -0,0 +1,335 @@
+"""
+Pluggable brokers that carry real-time events between worker processes.
+
+With a single uvicorn worker the in-process ``LocalBroker`` is enough. Once
+the app runs several workers, a write handled by one worker must reach
+WebSocket clients connected to all the others, so events are routed through a
+shared broker instead:
+
+- ``UnixSocketBroker`` - no extra infrastructure. The first worker to take an
+  flock on ``<socket>.lock`` serves a small relay on a Unix socket; every
+  worker (including that one) connects to it as a client. If the serving
+  worker exits, the lock is released and another worker takes over.
+- ``RedisBroker`` - for deployments that already run Redis (or any server
+  speaking the Redis protocol with EVAL and PUBLISH). Requires the optional
+  ``redis`` package.
+
+Ordering and delivery: every event passes through a single sequencer (the
+relay loop, or a Lua script on the Redis server) that stamps a per-topic
+sequence number. Each worker receives each event exactly once over one
+ordered stream and hands it to its local hub, which fans it out to that
+worker's sockets. Publishing workers never deliver locally on their own, so a
+socket sees each event once regardless of which worker it is connected to,
+and all sockets see a topic's events in the same order. Sequence numbers let
+workers drop any duplicate and count gaps after a reconnect.
+"""
+
+import asyncio
+import fcntl
+import json
+import logging
+import os
+from collections import deque
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+Deliver = Callable[[str, str], None]
+
+
+class Broker:
+    """Base class: accepts publishes from any thread, delivers on the event loop"""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._deliver: Optional[Deliver] = None
+        self._last_seq: Dict[str, int] = {}
+        self.duplicates_dropped = 0
+        self.gaps_detected = 0
+
+    async def start(self, deliver: Deliver):
+        self._loop = asyncio.get_running_loop()
+        self._deliver = deliver
+
+    async def stop(self):
+        pass
+
+    def publish(self, topic: str, payload: str):
+        """Thread-safe: schedule a publish on the broker's event loop"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._publish(topic, payload)
+        else:
+            loop.call_soon_threadsafe(self._publish, topic, payload)
+
+    def _publish(self, topic: str, payload: str):
+        raise NotImplementedError
+
+    def _reset_sequences(self):
+        """Forget per-topic sequence numbers (after a reconnect the stream restarts)"""
+        self._last_seq.clear()
+
+    def _accept(self, topic: str, seq: int, payload: str):
+        """Deliver a sequenced event exactly once and in order"""
+        last = self._last_seq.get(topic, 0)
+        if seq <= last:
+            self.duplicates_dropped += 1
+            return
+        if last and seq != last + 1:
+            self.gaps_detected += 1
+            logger.warning("event bus gap on %s: expected %d, got %d", topic, last + 1, seq)
+        self._last_seq[topic] = seq
+        self._deliver(topic, payload)
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self).__name__,
+            "duplicates_dropped": self.duplicates_dropped,
+            "gaps_detected": self.gaps_detected
+        }
+
+
+class LocalBroker(Broker):
+    """Single-process delivery straight into the local hub"""
+
+    def _publish(self, topic: str, payload: str):
+        self._deliver(topic, payload)
+
+
+class UnixSocketBroker(Broker):
+    """Relay over a Unix domain socket, served by whichever worker holds the lock"""
+
+    RECONNECT_DELAY_SECONDS = 0.5
+    MAX_PENDING = 10000
+    # A worker whose socket buffers this much unread data is dropped and must reconnect
+    MAX_PEER_BUFFER_BYTES = 8 * 1024 * 1024
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._lock_fd: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._peers = set()
+        self._peer_tasks = set()
+        self._relay_seq: Dict[str, int] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._pending = deque(maxlen=self.MAX_PENDING)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    async def start(self, deliver: Deliver):
+        await super().start(deliver)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._stopping = True
+        if self._task:
+            self._task.cancel()
+        if self._writer:
+            self._writer.close()
+        if self._server:
+            self._server.close()
+            for peer in list(self._peers):
+                peer.close()
+            # let peer handlers see EOF and finish before the loop goes away
+            await asyncio.gather(*self._peer_tasks, return_exceptions=True)
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    # ----- client side -----
+
+    def _publish(self, topic: str, payload: str):
+        frame = (json.dumps({"t": topic, "p": payload}) + "\n").encode()
+        if self._writer is not None and not self._writer.is_closing():
+            self._writer.write(frame)
+        else:
+            self._pending.append(frame)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await self._maybe_serve()
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except (OSError, ConnectionError):
+                await asyncio.sleep(self.RECONNECT_DELAY_SECONDS)
+                continue
+
+            self._reset_sequences()
+            self._writer = writer
+            while self._pending:
+                writer.write(self._pending.popleft())
+
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    frame = json.loads(line)
+                    self._accept(frame["t"], frame["s"], frame["p"])
+            except (OSError, ConnectionError, ValueError):
+                pass
+            finally:
+                self._writer = None
+                writer.close()
+
+            if not self._stopping:
+                await asyncio.sleep(self.RECONNECT_DELAY_SECONDS)
+
+    # ----- relay side -----
+
+    async def _maybe_serve(self):
+        """Become the relay if no other worker currently holds the lock"""
+        if self._server is not None:
+            return
+
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return
+
+        self._lock_fd = fd
+        try:
+            os.unlink(self.path)  # stale socket left by a previous relay
+        except FileNotFoundError:
+            pass
+        self._server = await asyncio.start_unix_server(self._serve_peer, path=self.path)
+        logger.info("event bus relay listening on %s (pid %d)", self.path, os.getpid())
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._peers.add(writer)
+        self._peer_tasks.add(asyncio.current_task())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                frame = json.loads(line)
+                self._relay(frame["t"], frame["p"])
+        except (OSError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._peers.discard(writer)
+            self._peer_tasks.discard(asyncio.current_task())
+            writer.close()
+
+    def _relay(self, topic: str, payload: str):
+        # Runs to completion on the relay's loop, so sequence numbers and
+        # write order are identical for every peer.
+        seq = self._relay_seq.get(topic, 0) + 1
+        self._relay_seq[topic] = seq
+        out = (json.dumps({"t": topic, "s": seq, "p": payload}) + "\n").encode()
+        for peer in list(self._peers):
+            if peer.transport.get_write_buffer_size() > self.MAX_PEER_BUFFER_BYTES:
+                logger.warning("event bus dropping stalled worker connection")
+                self._peers.discard(peer)
+                peer.close()
+                continue
+            peer.write(out)
+
+
+class RedisBroker(Broker):
+    """Relay through a Redis-protocol server using PUBLISH and a sequencing script"""
+
+    # Atomically assign the topic's next sequence number and publish with it
+    PUBLISH_SCRIPT = """
+local seq = redis.call('INCR', KEYS[1])
+redis.call('PUBLISH', KEYS[2], seq .. ' ' .. ARGV[1])
+return seq
+"""
+    RECONNECT_DELAY_SECONDS = 1.0
+
+    def __init__(self, url: str, prefix: str = "slack-clone:events:"):
+        super().__init__()
+        self.url = url
+        self.prefix = prefix
+        self._client = None
+        self._script = None
+        self._outbox: Optional[asyncio.Queue] = None
+        self._tasks = []
+
+    async def start(self, deliver: Deliver):
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:
+            raise RuntimeError("EVENT_BROKER=redis requires the 'redis' package (pip install redis)")
+
+        await super().start(deliver)
+        self._client = aioredis.from_url(self.url)
+        self._script = self._client.register_script(self.PUBLISH_SCRIPT)
+        self._outbox = asyncio.Queue()
+        self._tasks = [
+            asyncio.create_task(self._send_loop()),
+            asyncio.create_task(self._listen_loop())
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+
+    def _publish(self, topic: str, payload: str):
+        self._outbox.put_nowait((topic, payload))
+
+    async def _send_loop(self):
+        # One sender keeps this worker's publishes in call order
+        while True:
+            topic, payload = await self._outbox.get()
+            while True:
+                try:
+                    await self._script(
+                        keys=[f"{self.prefix}seq:{topic}", f"{self.prefix}{topic}"],
+                        args=[payload]
+                    )
+                    break
+                except Exception as exc:
+                    logger.warning("event bus publish failed, retrying: %s", exc)
+                    await asyncio.sleep(self.RECONNECT_DELAY_SECONDS)
+
+    async def _listen_loop(self):
+        while True:
+            pubsub = self._client.pubsub()
+            try:
+                await pubsub.psubscribe(f"{self.prefix}*")
+                self._reset_sequences()
+                async for message in pubsub.listen():
+                    if message.get("type") != "pmessage":
+                        continue
+                    channel = message["channel"].decode()
+                    seq, _, payload = message["data"].decode().partition(" ")
+                    self._accept(channel[len(self.prefix):], int(seq), payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.warning("event bus subscription lost, reconnecting: %s", exc)
+                await asyncio.sleep(self.RECONNECT_DELAY_SECONDS)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+
+def create_broker(backend: str, socket_path: str, url: str) -> Broker:
+    """Build the broker selected by EVENT_BROKER"""
+    backend = (backend or "local").lower()
+    if backend == "local":
+        return LocalBroker()
+    if backend == "unix":
+        return UnixSocketBroker(socket_path)
+    if backend == "redis":
+        return RedisBroker(url)
+    raise ValueError(f"Unknown EVENT_BROKER '{backend}' (expected local, unix or redis)")
@@ -0,0 +1,254 @@
+"""
+Batch hydration of the rows that hang off a page of messages.
+
+Routes that return lists of messages need the author, channel, attachments,
+reactions and thread replies for each one. Loading those lazily costs one
+query per row; the helpers here collect the IDs for a whole page and resolve
+each kind with a single ``IN (...)`` query instead. Author profiles are also
+kept in a short-lived in-process cache since the same few people write most
+messages on any page.
+"""
+
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .dm_conversations import is_read_by, load_receiver_markers
+from .models import User, Channel, Message, DirectMessage, Attachment, Reaction, Thread
+
+
+class ProfileCache:
+    """Thread-safe TTL cache of public user profile dicts keyed by user id"""
+
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, user_ids: Iterable[int]) -> Dict[int, dict]:
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for user_id in user_ids:
+                entry = self._entries.get(user_id)
+                if entry and entry[0] > now:
+                    found[user_id] = entry[1]
+        return found
+
+    def put_many(self, profiles: Dict[int, dict]):
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            for user_id, profile in profiles.items():
+                self._entries[user_id] = (expires_at, profile)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+profile_cache = ProfileCache(settings.PROFILE_CACHE_TTL_SECONDS)
+
+
+def invalidate_user_profile(user_id: int):
+    """Drop a user's cached profile (call after profile fields change)"""
+    profile_cache.invalidate(user_id)
+
+
+def serialize_user(user: User) -> dict:
+    """Public profile fields embedded in message payloads"""
+    return {
+        'id': user.id,
+        'username': user.username,
+        'full_name': user.full_name,
+        'name': user.full_name or user.username,
+        'profile_picture': user.profile_picture
+    }
+
+
+def load_user_profiles(db: Session, user_ids: Iterable[int]) -> Dict[int, dict]:
+    """Resolve user profiles from the cache, fetching any misses in one query"""
+    wanted = {uid for uid in user_ids if uid is not None}
+    if not wanted:
+        return {}
+
+    profiles = profile_cache.get_many(wanted)
+    missing = wanted - profiles.keys()
+    if missing:
+        fetched = {
+            user.id: serialize_user(user)
+            for user in db.query(User).filter(User.id.in_(missing)).all()
+        }
+        profile_cache.put_many(fetched)
+        profiles.update(fetched)
+    return profiles
+
+
+def load_channels(db: Session, channel_ids: Iterable[int]) -> Dict[int, Channel]:
+    """Resolve channels by id in one query"""
+    wanted = {cid for cid in channel_ids if cid is not None}
+    if not wanted:
+        return {}
+    return {
+        channel.id: channel
+        for channel in db.query(Channel).filter(Channel.id.in_(wanted)).all()
+    }
+
+
+def load_attachments(db: Session, message_ids: Iterable[int]) -> Dict[int, List[dict]]:
+    """Resolve attachments for a set of channel messages in one query"""
+    wanted = set(message_ids)
+    result = defaultdict(list)
+    if not wanted:
+        return result
+
+    rows = db.query(Attachment).filter(
+        Attachment.message_id.in_(wanted)
+    ).order_by(Attachment.id.asc()).all()
+    for att in rows:
+        result[att.message_id].append({
+            'id': att.id,
+            'filename': att.filename,
+            'file_path': att.file_path,
+            'file_type': att.file_type,
+            'file_size': att.file_size,
+            'mime_type': att.mime_type,
+            'uploaded_at': att.uploaded_at.isoformat() if att.uploaded_at else None
+        })
+    return result
+
+
+def load_reaction_summaries(db: Session, message_ids: Iterable[int]) -> Dict[int, List[dict]]:
+    """Summarise reactions per message as [{emoji, count, user_ids}] in one query"""
+    wanted = set(message_ids)
+    result = defaultdict(list)
+    if not wanted:
+        return result
+
+    rows = db.query(Reaction.message_id, Reaction.emoji, Reaction.user_id).filter(
+        Reaction.message_id.in_(wanted)
+    ).order_by(Reaction.message_id, Reaction.timestamp.asc(), Reaction.id.asc()).all()
+
+    by_emoji = defaultdict(dict)
+    for message_id, emoji, user_id in rows:
+        summary = by_emoji[message_id].get(emoji)
+        if summary is None:
+            summary = {'emoji': emoji, 'count': 0, 'user_ids': []}
+            by_emoji[message_id][emoji] = summary
+            result[message_id].append(summary)
+        summary['count'] += 1
+        summary['user_ids'].append(user_id)
+    return result
+
+
+def load_thread_summaries(db: Session, message_ids: Iterable[int]) -> Dict[int, dict]:
+    """Reply count and last reply time per parent message in one grouped query"""
+    wanted = set(message_ids)
+    if not wanted:
+        return {}
+
+    rows = db.query(
+        Thread.parent_message_id,
+        func.count(Thread.id),
+        func.max(Thread.timestamp)
+    ).filter(
+        Thread.parent_message_id.in_(wanted)
+    ).group_by(Thread.parent_message_id).all()
+
+    return {
+        parent_id: {
+            'reply_count': count,
+            'last_reply_at': last_reply_at.isoformat() if last_reply_at else None
+        }
+        for parent_id, count, last_reply_at in rows
+    }
+
+
+def hydrate_messages(
+    db: Session,
+    msgs: List[Message],
+    include_channel: bool = False
+) -> List[dict]:
+    """
+    Serialize a page of channel messages with author, attachments, reaction
+    and thread summaries, issuing a fixed number of queries for the page.
+    """
+    message_ids = [m.id for m in msgs]
+    users = load_user_profiles(db, (m.user_id for m in msgs))
+    attachments = load_attachments(db, message_ids)
+    reactions = load_reaction_summaries(db, message_ids)
+    threads = load_thread_summaries(db, message_ids)
+    channels = load_channels(db, (m.channel_id for m in msgs)) if include_channel else {}
+
+    result = []
+    for msg in msgs:
+        msg_dict = {
+            'id': msg.id,
+            'channel_id': msg.channel_id,
+            'user_id': msg.user_id,
+            'content': msg.content,
+            'timestamp': msg.timestamp.isoformat() if msg.timestamp else None,
+            'edited_at': msg.edited_at.isoformat() if msg.edited_at else None,
+            'is_deleted': msg.is_deleted,
+            'is_system_message': msg.is_system_message,
+            'formatted_content': msg.formatted_content,
+            'formatting': msg.formatting,
+            'mentions': msg.mentions,
+            'mentions_channel': msg.mentions_channel,
+            'attachments': attachments.get(msg.id, []),
+            'reactions': reactions.get(msg.id, []),
+            'thread': threads.get(msg.id, {'reply_count': 0, 'last_reply_at': None}),
+            'user': users.get(msg.user_id)
+        }
+        if include_channel:
+            channel = channels.get(msg.channel_id)
+            msg_dict['channel_name'] = channel.name if channel else None
+        result.append(msg_dict)
+    return result
+
+
+def hydrate_direct_messages(db: Session, dms: List[DirectMessage]) -> List[dict]:
+    """Serialize direct messages with sender and receiver profiles in one query"""
+    users = load_user_profiles(
+        db,
+        [dm.sender_id for dm in dms] + [dm.receiver_id for dm in dms]
+    )
+    # is_read comes from each receiver's read marker, one query for all of them
+    markers = load_receiver_markers(db, dms)
+    return [{
+        'id': dm.id,
+        'sender_id': dm.sender_id,
+        'receiver_id': dm.receiver_id,
+        'content': dm.content,
+        'formatted_content': dm.formatted_content,
+        'timestamp': dm.timestamp.isoformat() if dm.timestamp else None,
+        'edited_at': dm.edited_at.isoformat() if dm.edited_at else None,
+        'is_read': is_read_by(markers.get((dm.receiver_id, dm.sender_id)), dm),
+        'is_deleted': dm.is_deleted,
+        'sender': users.get(dm.sender_id),
+        'receiver': users.get(dm.receiver_id)
+    } for dm in dms]
+
+
+def load_messages(db: Session, message_ids: Iterable[int]) -> Dict[int, Message]:
+    """Resolve channel messages by id in one query"""
+    wanted = {mid for mid in message_ids if mid is not None}
+    if not wanted:
+        return {}
+    return {m.id: m for m in db.query(Message).filter(Message.id.in_(wanted)).all()}
+
+
+def load_direct_messages(db: Session, dm_ids: Iterable[int]) -> Dict[int, DirectMessage]:
+    """Resolve direct messages by id in one query"""
+    wanted = {dmid for dmid in dm_ids if dmid is not None}
+    if not wanted:
+        return {}
+    return {dm.id: dm for dm in db.query(DirectMessage).filter(DirectMessage.id.in_(wanted)).all()}
@@ -10,9 +10,18 @@ try:
     from .routes import (
         messages, channels, users, auth, direct_messages, search, attachments,
         notifications, pins, bookmarks, activity, drafts, scheduled_messages,
-        user_groups, custom_emojis, canvas, workflows, permalinks, calls
+        user_groups, custom_emojis, canvas, workflows, permalinks, calls,
+        realtime, diagnostics
     )
     from . import models
+    from . import realtime as realtime_hub
+    from .write_batcher import write_batcher
+    from .notification_fanout import notification_fanout
+    from .retention import retention_worker
+    from .migrations import run_migrations
+    from .dm_conversations import record_sent
+    from .channel_reads import record_message_sent
+    from .typeahead import typeahead_index
 except Exception:
     # Fallback: absolute imports (works if code is executed without package context)
     # This makes the app more tolerant when uvicorn is invoked incorrectly
@@ -21,9 +30,18 @@ except Exception:
     from backend.routes import (
         messages, channels, users, auth, direct_messages, search, attachments,
         notifications, pins, bookmarks, activity, drafts, scheduled_messages,
-        user_groups, custom_emojis, canvas, workflows, permalinks, calls
+        user_groups, custom_emojis, canvas, workflows, permalinks, calls,
+        realtime, diagnostics
     )
     import backend.models as models
+    import backend.realtime as realtime_hub
+    from backend.write_batcher import write_batcher
+    from backend.notification_fanout import notification_fanout
+    from backend.retention import retention_worker
+    from backend.migrations import run_migrations
+    from backend.dm_conversations import record_sent
+    from backend.channel_reads import record_message_sent
+    from backend.typeahead import typeahead_index
 
 app = FastAPI(title=settings.APP_NAME)
 
@@ -59,6 +77,38 @@ app.include_router(workflows.router)
 app.include_router(permalinks.router)
 app.include_router(calls.router)
 
+# Real-time WebSocket gateway
+app.include_router(realtime.router)
+
+# Operational diagnostics
+app.include_router(diagnostics.router)
+
+@app.on_event("startup")
+async def start_realtime():
+    await realtime_hub.start_event_bus()
+
+@app.on_event("shutdown")
+async def stop_realtime():
+    await realtime_hub.stop_event_bus()
+
+@app.on_event("startup")
+def start_write_batcher():
+    if settings.WRITE_BATCHING:
+        write_batcher.start()
+
+@app.on_event("shutdown")
+def stop_write_batcher():
+    write_batcher.stop()
+
+@app.on_event("startup")
+def start_notification_fanout():
+    if settings.NOTIFICATION_FANOUT:
+        notification_fanout.start()
+
+@app.on_event("shutdown")
+def stop_notification_fanout():
+    notification_fanout.stop()
+
 @app.on_event("startup")
 def startup():
     # ensure data dir exists
@@ -68,6 +118,10 @@ def startup():
     # create tables
     Base.metadata.create_all(bind=engine)
 
+    # create_all skips tables that already exist; bring existing tables
+    # up to date (columns, indexes, backfills) through versioned migrations
+    run_migrations(engine)
+
     # seed DB if empty using data/seed.json
     from sqlalchemy.orm import Session
     from .database import SessionLocal
@@ -130,6 +184,7 @@ def startup():
                     if member_ids:
                         members = db.query(models.User).filter(models.User.id.in_(member_ids)).all()
                         chan.members = members
+                        chan.member_count = len(members)
                     db.add(chan)
                 db.commit()
                 
@@ -149,6 +204,8 @@ def startup():
                         timestamp=ts
                     )
                     db.add(msg)
+                    db.flush()
+                    record_message_sent(db, msg)
                 db.commit()
                 
                 # user_groups
@@ -182,6 +239,8 @@ def startup():
                         timestamp=ts
                     )
                     db.add(direct_msg)
+                    db.flush()
+                    record_sent(db, direct_msg)
                 db.commit()
                 
                 # contacts
@@ -208,7 +267,7 @@ def startup():
                         description=a.get('description'),
                         target_type=a.get('target_type'),
                         target_id=a.get('target_id'),
-                        activity_metadata=json.dumps(a.get('activity_metadata', {})),
+                        activity_metadata=a.get('activity_metadata', {}),
                         created_at=ts
                     )
                     db.add(act)
@@ -221,5 +280,18 @@ def startup():
                 print(f"   - {len(seed.get('messages', []))} messages")
                 print(f"   - {len(seed.get('direct_messages', []))} direct messages")
                 print(f"   - {len(seed.get('activities', []))} activities")
+
+        # In-memory typeahead index; kept current from here on by ORM commits
+        typeahead_index.rebuild(db)
     finally:
         db.close()
+
+# Registered after startup() so the first pass runs against a migrated schema
+@app.on_event("startup")
+def start_retention():
+    if settings.RETENTION_ENABLED:
+        retention_worker.start()
+
+@app.on_event("shutdown")
+def stop_retention():
+    retention_worker.stop()
@@ -0,0 +1,208 @@
+"""
+Channel membership lookups.
+
+Access checks used to be written ``current_user in channel.members``, which
+loads every member of the channel as an ORM object to test one id - in a
+20k-member ``#general`` that dominated sending a message, reacting, pinning
+and opening a permalink. Checks now go through ``is_member`` instead, which
+answers from a per-process cache of member-id sets (one indexed read of
+``channel_members`` per channel, then a set lookup).
+
+Membership changes go through ``add_member`` / ``remove_member`` - single-row
+writes to ``channel_members`` that never load the member list, plus a
+relative update of ``Channel.member_count`` in the same transaction - and the
+channel's cached set is dropped once the transaction commits. ORM changes to
+``Channel.members`` (channel creation, seeding) are picked up at flush time.
+Invalidations are published on the ``membership`` event-bus topic so every
+worker drops its copy too. The same event carries who joined or left which
+channel, and every worker subscribes or unsubscribes that user's open
+WebSocket connections to the channel's topic - a member removed from a
+private channel stops receiving its events at once, and an invitee starts
+receiving them without reconnecting.
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, Optional, Set
+
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .database import SessionLocal
+from .models import Channel, channel_members
+from .realtime import channel_topic, hub
+
+MEMBERSHIP_TOPIC = "membership"
+
+
+class MembershipCache:
+    """Thread-safe LRU of channel id -> frozenset of member user ids"""
+
+    def __init__(self, max_channels: int):
+        self.max_channels = max_channels
+        self._members: "OrderedDict[int, FrozenSet[int]]" = OrderedDict()
+        # Bumped on every invalidation so a load that raced a change is not stored
+        self._versions: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def member_ids(self, db: Session, channel_id: int) -> FrozenSet[int]:
+        with self._lock:
+            members = self._members.get(channel_id)
+            if members is not None:
+                self._members.move_to_end(channel_id)
+                self.hits += 1
+                return members
+            self.misses += 1
+            version = self._versions.get(channel_id, 0)
+
+        # Primary key (channel_id, user_id) range scan
+        members = frozenset(db.execute(
+            select(channel_members.c.user_id).where(channel_members.c.channel_id == channel_id)
+        ).scalars())
+
+        with self._lock:
+            if self._versions.get(channel_id, 0) == version:
+                self._members[channel_id] = members
+                while len(self._members) > self.max_channels:
+                    self._members.popitem(last=False)
+        return members
+
+    def invalidate(self, channel_ids: Iterable[int]):
+        with self._lock:
+            for channel_id in channel_ids:
+                self._members.pop(channel_id, None)
+                self._versions[channel_id] = self._versions.get(channel_id, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._members.clear()
+            for channel_id in self._versions:
+                self._versions[channel_id] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "channels": len(self._members),
+                "memberships": sum(len(members) for members in self._members.values()),
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+membership_cache = MembershipCache(settings.MEMBERSHIP_CACHE_CHANNELS)
+
+
+def member_ids(db: Session, channel_id: int) -> FrozenSet[int]:
+    """Ids of every member of a channel"""
+    return membership_cache.member_ids(db, channel_id)
+
+
+def is_member(db: Session, channel_id: int, user_id: int) -> bool:
+    return user_id in membership_cache.member_ids(db, channel_id)
+
+
+def can_read(db: Session, channel: Channel, user_id: int) -> bool:
+    """Public channels are readable by everyone, private ones by their members"""
+    return not channel.is_private or is_member(db, channel.id, user_id)
+
+
+def _touch(db: Session, channel_id: int):
+    db.info.setdefault(_PENDING_KEY, set()).add(channel_id)
+
+
+def _record(db: Session, channel_id: int, user_id: Optional[int], joined: bool):
+    # user_id None: every member left (the channel is going away)
+    db.info.setdefault(_SUBSCRIPTIONS_KEY, []).append([channel_id, user_id, joined])
+
+
+def _adjust_count(db: Session, channel_id: int, delta: int):
+    # Relative update, so concurrent joins and leaves never lose a change
+    db.execute(update(Channel).where(Channel.id == channel_id).values(
+        member_count=Channel.member_count + delta
+    ))
+
+
+def add_member(db: Session, channel_id: int, user_id: int):
+    """Add a membership row on the session's transaction"""
+    db.execute(channel_members.insert().values(channel_id=channel_id, user_id=user_id))
+    _adjust_count(db, channel_id, 1)
+    _touch(db, channel_id)
+    _record(db, channel_id, user_id, True)
+
+
+def remove_member(db: Session, channel_id: int, user_id: int):
+    """Delete a membership row on the session's transaction"""
+    result = db.execute(channel_members.delete().where(
+        channel_members.c.channel_id == channel_id,
+        channel_members.c.user_id == user_id
+    ))
+    if result.rowcount:
+        _adjust_count(db, channel_id, -result.rowcount)
+    _touch(db, channel_id)
+    _record(db, channel_id, user_id, False)
+
+
+def remove_all_members(db: Session, channel_id: int):
+    """Delete every membership row of a channel (before deleting the channel itself)"""
+    db.execute(channel_members.delete().where(channel_members.c.channel_id == channel_id))
+    db.execute(update(Channel).where(Channel.id == channel_id).values(member_count=0))
+    _touch(db, channel_id)
+    _record(db, channel_id, None, False)
+
+
+# ----- invalidation -----
+
+_PENDING_KEY = "membership_pending"
+_SUBSCRIPTIONS_KEY = "membership_subscriptions"
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_changes(session: Session, flush_context):
+    # Channel.members edited through the ORM, or a channel created or deleted
+    changed: Set[int] = {obj.id for obj in (*session.new, *session.dirty, *session.deleted)
+                         if isinstance(obj, Channel)}
+    if changed:
+        session.info.setdefault(_PENDING_KEY, set()).update(changed)
+    # Members of a channel created through the ORM (e.g. its creator)
+    for obj in session.new:
+        if isinstance(obj, Channel):
+            for user in obj.members:
+                _record(session, obj.id, user.id, True)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _apply_changes(session: Session):
+    channel_ids = session.info.pop(_PENDING_KEY, None)
+    changes = session.info.pop(_SUBSCRIPTIONS_KEY, [])
+    if not channel_ids:
+        return
+    membership_cache.invalidate(channel_ids)
+    hub.publish(MEMBERSHIP_TOPIC, "membership.changed", {"channels": sorted(channel_ids), "changes": changes})
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_changes(session: Session):
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_SUBSCRIPTIONS_KEY, None)
+
+
+def _on_bus_event(text: str):
+    """Drop channels whose membership any worker (including this one) changed
+    and bring the joining/leaving users' connections in line (event loop)"""
+    data = json.loads(text)["data"]
+    membership_cache.invalidate(data.get("channels", ()))
+    for channel_id, user_id, joined in data.get("changes", ()):
+        topic = channel_topic(channel_id)
+        if user_id is None:
+            hub.close_topic(topic)
+        elif joined:
+            hub.subscribe_user(user_id, topic)
+        else:
+            hub.unsubscribe_user(user_id, topic)
+
+
+hub.add_listener(MEMBERSHIP_TOPIC, _on_bus_event)
@@ -0,0 +1,77 @@
+"""
+Mentions in channel messages.
+
+A message can mention people four ways:
+
+- ``<span data-user-id="123">`` in the formatted content - one user
+- ``@handle``  - every member of the user group with that ``UserGroup.handle``
+- ``@here``    - every member of the channel who is online right now
+- ``@channel`` - every member of the channel
+
+``resolve_mentions`` turns them into the user ids stored on the message
+(``Message.mentions``) plus a ``mentions_channel`` flag. ``@channel`` is never
+expanded into ids: the read counters and the notification fan-out select the
+channel's members in SQL, so a 10k-member channel costs one statement, not a
+10k-element list. ``@here`` is the channel's cached member set (see
+``membership.py``) intersected with the in-memory presence index (see
+``presence.py``); neither touches the users table.
+"""
+
+import re
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from .membership import member_ids
+from .models import Channel, UserGroup, user_group_members
+from .presence import presence_index
+
+USER_ID_PATTERN = re.compile(r'data-user-id="(\d+)"')
+# "@name" at the start of the text or after whitespace/punctuation, so emails don't match
+HANDLE_PATTERN = re.compile(r'(?<![\w@.])@([A-Za-z0-9][\w.-]*)')
+
+CHANNEL_KEYWORDS = ("channel", "everyone")
+HERE_KEYWORD = "here"
+
+
+class Mentions(NamedTuple):
+    user_ids: List[int]     # users to notify and badge, in order of first appearance
+    channel: bool = False   # @channel: every member of the channel
+
+
+def parse_handles(content: Optional[str]) -> List[str]:
+    """Lower-cased ``@names`` in plain text, each once, trailing punctuation dropped"""
+    if not content:
+        return []
+    return list(dict.fromkeys(
+        name.rstrip(".-").lower() for name in HANDLE_PATTERN.findall(content)
+    ))
+
+
+def resolve_mentions(db: Session, channel: Channel, content: Optional[str], formatted_content: Optional[str]) -> Mentions:
+    user_ids = [int(user_id) for user_id in USER_ID_PATTERN.findall(formatted_content or "")]
+
+    names = parse_handles(content)
+    mentions_channel = any(name in CHANNEL_KEYWORDS for name in names)
+    handles = [name for name in names if name not in CHANNEL_KEYWORDS and name != HERE_KEYWORD]
+
+    if handles:
+        # Stored handles carry the "@" (e.g. "@developers"); accept either form
+        group_members = db.execute(
+            select(user_group_members.c.user_id)
+            .join(UserGroup, UserGroup.id == user_group_members.c.group_id)
+            .where(func.lower(UserGroup.handle).in_([f"@{name}" for name in handles] + handles))
+            .order_by(user_group_members.c.user_id)
+        ).scalars().all()
+        if channel.is_private:
+            # Group members outside a private channel can't read the message
+            members = member_ids(db, channel.id)
+            group_members = [user_id for user_id in group_members if user_id in members]
+        user_ids.extend(group_members)
+
+    if HERE_KEYWORD in names and not mentions_channel:
+        active = presence_index.active_ids(db)
+        user_ids.extend(sorted(member_ids(db, channel.id) & active))
+
+    return Mentions(user_ids=list(dict.fromkeys(user_ids)), channel=mentions_channel)
@@ -1,17 +1,48 @@
-from fastapi import Request, HTTPException, status
+from fastapi import Request, status
 from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Receive, Scope, Send
 from sqlalchemy.orm import Session
-from datetime import datetime
-from typing import Optional
+from anyio import CapacityLimiter, to_thread
+from typing import Iterable, Optional
 
 from .database import SessionLocal
-from .models import Session as SessionModel, User
+from .models import User
+from .session_cache import CachedSession, resolve_session, session_cache
 from .config import settings
 
 
-class SessionAuthMiddleware(BaseHTTPMiddleware):
-    """Middleware to handle session authentication for protected routes"""
+class PrefixTrie:
+    """Character trie answering "does this path start with any registered prefix?" """
+
+    _END = object()
+
+    def __init__(self, prefixes: Iterable[str] = ()):
+        self._root: dict = {}
+        for prefix in prefixes:
+            self.add(prefix)
+
+    def add(self, prefix: str):
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[self._END] = True
+
+    def matches(self, path: str) -> bool:
+        node = self._root
+        if self._END in node:
+            return True
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                return False
+            if self._END in node:
+                return True
+        return False
+
+
+class SessionAuthMiddleware:
+    """Pure ASGI middleware to handle session authentication for protected routes"""
     
     # Routes that don't require authentication
     PUBLIC_ROUTES = [
@@ -23,77 +54,71 @@ class SessionAuthMiddleware(BaseHTTPMiddleware):
         "/openapi.json",
     ]
     
-    async def dispatch(self, request: Request, call_next):
-        # Check if route requires authentication
-        path = request.url.path
+    def __init__(self, app: ASGIApp, public_routes: Optional[Iterable[str]] = None, lookup_threads: Optional[int] = None):
+        self.app = app
+        self.public_routes = PrefixTrie(self.PUBLIC_ROUTES if public_routes is None else public_routes)
+        # Cache misses hit the database; keep them off the event loop and cap
+        # how many worker threads they may occupy at once
+        self.limiter = CapacityLimiter(lookup_threads or settings.AUTH_LOOKUP_THREADS)
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        # WebSockets authenticate themselves in the /ws handshake
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        path = scope["path"]
         
-        # Allow public routes
-        if any(path.startswith(route) for route in self.PUBLIC_ROUTES):
-            return await call_next(request)
+        # Allow public routes, CORS preflight and anything outside the API
+        if (
+            self.public_routes.matches(path)
+            or scope["method"] == "OPTIONS"
+            or not path.startswith("/api/")
+        ):
+            await self.app(scope, receive, send)
+            return
         
-        # Allow OPTIONS requests (CORS preflight)
-        if request.method == "OPTIONS":
-            return await call_next(request)
+        session_id = HTTPConnection(scope).cookies.get(settings.SESSION_COOKIE_NAME)
+        if not session_id:
+            await self._reject(scope, receive, send, "Not authenticated")
+            return
         
-        # For protected API routes, verify session
-        if path.startswith("/api/"):
-            session_id = request.cookies.get(settings.SESSION_COOKIE_NAME)
-            
-            if not session_id:
-                return JSONResponse(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    content={"detail": "Not authenticated"}
-                )
-            
-            # Verify session in database
-            db = SessionLocal()
-            try:
-                session = db.query(SessionModel).filter(
-                    SessionModel.session_id == session_id
-                ).first()
-                
-                if not session:
-                    return JSONResponse(
-                        status_code=status.HTTP_401_UNAUTHORIZED,
-                        content={"detail": "Invalid session"}
-                    )
-                
-                if session.expires_at < datetime.utcnow():
-                    db.delete(session)
-                    db.commit()
-                    return JSONResponse(
-                        status_code=status.HTTP_401_UNAUTHORIZED,
-                        content={"detail": "Session expired"}
-                    )
-                
-                # Session is valid, continue with request
-                user = db.query(User).filter(User.id == session.user_id).first()
-                if not user:
-                    return JSONResponse(
-                        status_code=status.HTTP_401_UNAUTHORIZED,
-                        content={"detail": "User not found"}
-                    )
-                
-            finally:
-                db.close()
+        # Verify session: cache hits stay on the loop, misses go to the threadpool
+        cached = session_cache.get(session_id)
+        if cached is None:
+            cached = await to_thread.run_sync(self._lookup, session_id, limiter=self.limiter)
         
-        response = await call_next(request)
-        return response
+        if cached is None:
+            await self._reject(scope, receive, send, "Invalid or expired session")
+            return
+        
+        # Hand the resolved session to get_current_user so it isn't looked up again
+        scope.setdefault("state", {})["session"] = cached
+        await self.app(scope, receive, send)
+    
+    @staticmethod
+    def _lookup(session_id: str) -> Optional[CachedSession]:
+        db = SessionLocal()
+        try:
+            return resolve_session(db, session_id)
+        finally:
+            db.close()
+    
+    @staticmethod
+    async def _reject(scope: Scope, receive: Receive, send: Send, detail: str):
+        response = JSONResponse(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            content={"detail": detail}
+        )
+        await response(scope, receive, send)
 
 
 def get_current_session_user(request: Request, db: Session) -> Optional[User]:
     """Helper function to get current user from session in request"""
-    session_id = request.cookies.get(settings.SESSION_COOKIE_NAME)
-    
-    if not session_id:
-        return None
-    
-    session = db.query(SessionModel).filter(
-        SessionModel.session_id == session_id
-    ).first()
-    
-    if not session or session.expires_at < datetime.utcnow():
+    cached = getattr(request.state, "session", None) or resolve_session(
+        db, request.cookies.get(settings.SESSION_COOKIE_NAME)
+    )
+    if cached is None:
         return None
     
-    user = db.query(User).filter(User.id == session.user_id).first()
-    return user
+    return db.get(User, cached.user_id)
@@ -0,0 +1,455 @@
+"""
+Versioned schema migrations.
+
+``Base.metadata.create_all`` creates missing tables but never alters existing
+ones, so changes to tables that already hold data (new columns, new indexes,
+backfills) are applied here instead. Each migration has a version number and
+runs once; applied versions are recorded in ``schema_migrations``.
+
+Migrations run at startup after ``create_all`` and can also be run by hand:
+
+    python -m backend.migrations            # apply pending migrations
+    python -m backend.migrations --status   # show applied / pending versions
+
+Migrations are written to be safe while the app is serving traffic:
+
+- indexes are built with ``create_index_online`` (``CONCURRENTLY`` on
+  PostgreSQL; on SQLite in WAL mode readers keep going during the build)
+- data changes go through ``backfill_in_chunks``, which updates a bounded
+  range of rows per transaction and pauses between chunks so regular writes
+  can interleave
+
+A migration interrupted halfway is simply run again on the next start, so
+every step must be idempotent (``IF NOT EXISTS``, ``WHERE ... IS NULL``).
+"""
+
+import json
+import logging
+import sys
+import time
+from datetime import datetime
+from typing import Callable, List, Optional, Sequence
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+
+try:
+    from .config import settings
+except ImportError:
+    from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Migration:
+    """A numbered schema change applied by ``upgrade(engine)``"""
+
+    def __init__(self, version: int, name: str, upgrade: Callable[[Engine], None]):
+        self.version = version
+        self.name = name
+        self.upgrade = upgrade
+
+
+# ----- building blocks for migrations -----
+
+def add_column_if_missing(engine: Engine, table: str, column: str, ddl_type: str):
+    """Add a nullable column to an existing table unless it is already there"""
+    columns = {col["name"] for col in inspect(engine).get_columns(table)}
+    if column in columns:
+        return
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+    logger.info("added column %s.%s", table, column)
+
+
+def create_index_online(engine: Engine, name: str, table: str, columns: Sequence[str], using: Optional[str] = None):
+    """Create an index if it does not exist, without blocking readers"""
+    column_list = ", ".join(columns)
+    if engine.dialect.name == "postgresql":
+        method = f" USING {using}" if using else ""
+        # CONCURRENTLY cannot run inside a transaction block
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table}{method} ({column_list})"))
+    else:
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({column_list})"))
+    logger.info("ensured index %s on %s(%s)", name, table, column_list)
+
+
+def drop_index_online(engine: Engine, name: str):
+    """Drop an index if it exists, without blocking readers"""
+    if engine.dialect.name == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    else:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    logger.info("dropped index %s", name)
+
+
+def id_ranges(engine: Engine, table: str, chunk_size: Optional[int] = None, pause_seconds: Optional[float] = None):
+    """Yield consecutive ``(low, high]`` id ranges covering a table, pausing between them"""
+    chunk_size = chunk_size or settings.MIGRATION_CHUNK_SIZE
+    if pause_seconds is None:
+        pause_seconds = settings.MIGRATION_CHUNK_PAUSE_MS / 1000.0
+
+    with engine.connect() as conn:
+        max_id = conn.execute(text(f"SELECT MAX(id) FROM {table}")).scalar() or 0
+
+    low = 0
+    while low < max_id:
+        high = low + chunk_size
+        yield low, high
+        low = high
+        if pause_seconds and low < max_id:
+            time.sleep(pause_seconds)
+
+
+def backfill_in_chunks(
+    engine: Engine,
+    table: str,
+    set_clause: str,
+    where_clause: str,
+    chunk_size: Optional[int] = None,
+    pause_seconds: Optional[float] = None
+) -> int:
+    """
+    Run ``UPDATE table SET set_clause WHERE where_clause`` over consecutive id
+    ranges, one short transaction per range. Returns the number of rows updated.
+    """
+    updated = 0
+    for low, high in id_ranges(engine, table, chunk_size, pause_seconds):
+        with engine.begin() as conn:
+            result = conn.execute(
+                text(f"UPDATE {table} SET {set_clause} WHERE id > :low AND id <= :high AND ({where_clause})"),
+                {"low": low, "high": high}
+            )
+            updated += result.rowcount or 0
+
+    logger.info("backfilled %d rows in %s", updated, table)
+    return updated
+
+
+# ----- migrations -----
+
+def _formatted_content(engine: Engine):
+    # Replaces backend/migrate_formatted_content.py
+    for table in ("messages", "direct_messages"):
+        add_column_if_missing(engine, table, "formatted_content", "TEXT")
+        backfill_in_chunks(engine, table, "formatted_content = content", "formatted_content IS NULL")
+
+
+def _hot_path_indexes(engine: Engine):
+    create_index_online(engine, "ix_messages_channel_timestamp_id", "messages", ["channel_id", "timestamp", "id"])
+    create_index_online(
+        engine, "ix_direct_messages_sender_receiver_timestamp", "direct_messages",
+        ["sender_id", "receiver_id", "timestamp"]
+    )
+    create_index_online(engine, "ix_reactions_message_id", "reactions", ["message_id"])
+    create_index_online(engine, "ix_threads_parent_message_id", "threads", ["parent_message_id"])
+    create_index_online(
+        engine, "ix_notifications_user_read_created", "notifications",
+        ["user_id", "is_read", "created_at"]
+    )
+    create_index_online(engine, "ix_activities_user_created", "activities", ["user_id", "created_at"])
+
+
+def _dm_conversation_key(engine: Engine):
+    add_column_if_missing(engine, "direct_messages", "conversation_key", "VARCHAR")
+    backfill_in_chunks(
+        engine, "direct_messages",
+        "conversation_key = CASE WHEN sender_id <= receiver_id "
+        "THEN CAST(sender_id AS VARCHAR) || ':' || CAST(receiver_id AS VARCHAR) "
+        "ELSE CAST(receiver_id AS VARCHAR) || ':' || CAST(sender_id AS VARCHAR) END",
+        "conversation_key IS NULL"
+    )
+    create_index_online(
+        engine, "ix_direct_messages_conversation_timestamp_id", "direct_messages",
+        ["conversation_key", "timestamp", "id"]
+    )
+
+
+def _dm_conversations(engine: Engine):
+    try:
+        from .models import DMConversation
+    except ImportError:
+        from backend.models import DMConversation
+    DMConversation.__table__.create(bind=engine, checkfirst=True)
+
+    # One summary row per (user, partner) direction, built a range of users at a time
+    populate = text(
+        "INSERT INTO dm_conversations (user_id, partner_id, last_message_id, last_message_at, unread_count) "
+        "SELECT x.user_id, x.partner_id, "
+        "(SELECT d.id FROM direct_messages d WHERE d.conversation_key = x.conversation_key "
+        "ORDER BY d.timestamp DESC, d.id DESC LIMIT 1), "
+        "MAX(x.timestamp), SUM(x.unread) "
+        "FROM ("
+        "SELECT sender_id AS user_id, receiver_id AS partner_id, conversation_key, timestamp, 0 AS unread "
+        "FROM direct_messages "
+        "UNION ALL "
+        "SELECT receiver_id, sender_id, conversation_key, timestamp, CASE WHEN is_read THEN 0 ELSE 1 END "
+        "FROM direct_messages"
+        ") x "
+        "WHERE x.user_id > :low AND x.user_id <= :high "
+        "AND NOT EXISTS (SELECT 1 FROM dm_conversations c "
+        "WHERE c.user_id = x.user_id AND c.partner_id = x.partner_id) "
+        "GROUP BY x.user_id, x.partner_id, x.conversation_key"
+    )
+    created = 0
+    for low, high in id_ranges(engine, "users"):
+        with engine.begin() as conn:
+            created += conn.execute(populate, {"low": low, "high": high}).rowcount or 0
+    logger.info("created %d dm_conversations rows", created)
+
+
+def _read_markers(engine: Engine):
+    try:
+        from .models import ChannelReadState
+    except ImportError:
+        from backend.models import ChannelReadState
+    ChannelReadState.__table__.create(bind=engine, checkfirst=True)
+
+    add_column_if_missing(engine, "dm_conversations", "last_read_message_id", "INTEGER")
+    add_column_if_missing(engine, "dm_conversations", "last_read_at", "TIMESTAMP")
+
+    # Start each DM marker at the newest message the user had already flagged read
+    latest_read = (
+        "SELECT {column} FROM direct_messages d "
+        "WHERE d.sender_id = dm_conversations.partner_id "
+        "AND d.receiver_id = dm_conversations.user_id AND d.is_read "
+        "ORDER BY d.timestamp DESC, d.id DESC LIMIT 1"
+    )
+    seed = text(
+        "UPDATE dm_conversations SET "
+        f"last_read_message_id = ({latest_read.format(column='d.id')}), "
+        f"last_read_at = ({latest_read.format(column='d.timestamp')}) "
+        "WHERE user_id > :low AND user_id <= :high AND last_read_message_id IS NULL"
+    )
+    for low, high in id_ranges(engine, "users"):
+        with engine.begin() as conn:
+            conn.execute(seed, {"low": low, "high": high})
+
+
+def _channel_unread_counters(engine: Engine):
+    add_column_if_missing(engine, "channel_read_states", "unread_count", "INTEGER NOT NULL DEFAULT 0")
+    add_column_if_missing(engine, "channel_read_states", "mention_count", "INTEGER NOT NULL DEFAULT 0")
+
+    # Every membership gets a marker row, so new messages only ever bump counters
+    create_missing = text(
+        "INSERT INTO channel_read_states (user_id, channel_id, unread_count, mention_count, updated_at) "
+        "SELECT cm.user_id, cm.channel_id, 0, 0, :now FROM channel_members cm "
+        "WHERE cm.user_id > :low AND cm.user_id <= :high "
+        "AND NOT EXISTS (SELECT 1 FROM channel_read_states s "
+        "WHERE s.user_id = cm.user_id AND s.channel_id = cm.channel_id)"
+    )
+    after_marker = (
+        "m.channel_id = channel_read_states.channel_id "
+        "AND (channel_read_states.last_read_at IS NULL "
+        "OR m.timestamp > channel_read_states.last_read_at "
+        "OR (m.timestamp = channel_read_states.last_read_at "
+        "AND m.id > channel_read_states.last_read_message_id))"
+    )
+    count = text(
+        "UPDATE channel_read_states SET "
+        "unread_count = (SELECT COUNT(*) FROM messages m "
+        f"WHERE {after_marker} AND m.user_id <> channel_read_states.user_id), "
+        "mention_count = (SELECT COUNT(DISTINCT m.id) FROM activities a JOIN messages m ON m.id = a.target_id "
+        "WHERE a.user_id = channel_read_states.user_id AND a.activity_type = 'mention' "
+        f"AND a.target_type = 'message' AND {after_marker}) "
+        "WHERE user_id > :low AND user_id <= :high"
+    )
+    for low, high in id_ranges(engine, "users"):
+        with engine.begin() as conn:
+            conn.execute(create_missing, {"low": low, "high": high, "now": datetime.utcnow()})
+            conn.execute(count, {"low": low, "high": high})
+
+
+def _full_text_search(engine: Engine):
+    try:
+        from .search_index import rebuild_index, search_backend
+    except ImportError:
+        from backend.search_index import rebuild_index, search_backend
+    backend = search_backend()
+    backend.ensure_index(engine)
+    for table in ("messages", "direct_messages"):
+        indexed = rebuild_index(engine, table, id_ranges(engine, table))
+        logger.info("indexed %d rows of %s for %s search", indexed, table, backend.name)
+
+
+def _search_filter_indexes(engine: Engine):
+    # EXISTS probes behind has:file (has:reaction and is:thread use indexes from migration 2)
+    create_index_online(engine, "ix_attachments_message_id", "attachments", ["message_id"])
+    create_index_online(engine, "ix_dm_attachments_direct_message_id", "dm_attachments", ["direct_message_id"])
+
+
+def _channel_members_by_user(engine: Engine):
+    # "Which channels is this user in" (sidebar, socket subscriptions, search scope)
+    create_index_online(engine, "ix_channel_members_user_id", "channel_members", ["user_id", "channel_id"])
+
+
+def _channel_member_counts(engine: Engine):
+    add_column_if_missing(engine, "channels", "member_count", "INTEGER NOT NULL DEFAULT 0")
+    backfill_in_chunks(
+        engine, "channels",
+        "member_count = (SELECT COUNT(*) FROM channel_members cm WHERE cm.channel_id = channels.id)",
+        "1 = 1"
+    )
+
+
+def _channel_mentions(engine: Engine):
+    add_column_if_missing(engine, "messages", "mentions_channel", "BOOLEAN NOT NULL DEFAULT FALSE")
+
+
+def _notification_coalescing(engine: Engine):
+    add_column_if_missing(engine, "notifications", "actor_count", "INTEGER NOT NULL DEFAULT 1")
+    add_column_if_missing(engine, "notifications", "recent_actors", "TEXT")
+    add_column_if_missing(engine, "notifications", "updated_at", "TIMESTAMP")
+    add_column_if_missing(engine, "users", "notification_digest", "BOOLEAN NOT NULL DEFAULT FALSE")
+    backfill_in_chunks(engine, "notifications", "updated_at = created_at", "updated_at IS NULL")
+    create_index_online(
+        engine, "ix_notifications_user_read_updated", "notifications",
+        ["user_id", "is_read", "updated_at"]
+    )
+    create_index_online(
+        engine, "ix_notifications_coalesce", "notifications",
+        ["user_id", "notification_type", "source_type", "source_id"]
+    )
+
+
+def null_invalid_json(engine: Engine, table: str, column: str) -> int:
+    """
+    Set ``column`` to NULL wherever it holds text that is not a JSON object,
+    one id range per transaction. Returns the number of rows cleared.
+    """
+    cleared = 0
+    for low, high in id_ranges(engine, table):
+        with engine.begin() as conn:
+            rows = conn.execute(
+                text(f"SELECT id, {column} FROM {table} WHERE id > :low AND id <= :high AND {column} IS NOT NULL"),
+                {"low": low, "high": high}
+            ).all()
+            invalid = []
+            for row_id, value in rows:
+                if isinstance(value, str):
+                    try:
+                        value = json.loads(value)
+                    except ValueError:
+                        value = None
+                if not isinstance(value, dict):
+                    invalid.append(row_id)
+            for row_id in invalid:
+                conn.execute(text(f"UPDATE {table} SET {column} = NULL WHERE id = :id"), {"id": row_id})
+            cleared += len(invalid)
+
+    if cleared:
+        logger.warning("cleared %d non-JSON %s.%s values", cleared, table, column)
+    return cleared
+
+
+def _activity_timeline(engine: Engine):
+    # The (created_at, id) keyset needs id in the index; it supersedes (user_id, created_at)
+    create_index_online(engine, "ix_activities_user_created_id", "activities", ["user_id", "created_at", "id"])
+    drop_index_online(engine, "ix_activities_user_created")
+    # activity_metadata is now read as JSON: legacy free-text values would make
+    # the cast below abort on PostgreSQL, and every read fail on SQLite
+    null_invalid_json(engine, "activities", "activity_metadata")
+    if engine.dialect.name == "postgresql":
+        # SQLite keeps JSON as text either way. This rewrites activities under
+        # an exclusive lock, which is short for a table of this size
+        with engine.begin() as conn:
+            conn.execute(text(
+                "ALTER TABLE activities ALTER COLUMN activity_metadata TYPE JSONB USING activity_metadata::jsonb"
+            ))
+
+
+def _retention_indexes(engine: Engine):
+    create_index_online(engine, "ix_notifications_updated_id", "notifications", ["updated_at", "id"])
+    create_index_online(engine, "ix_activities_created_id", "activities", ["created_at", "id"])
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "formatted_content", _formatted_content),
+    Migration(2, "hot_path_indexes", _hot_path_indexes),
+    Migration(3, "dm_conversation_key", _dm_conversation_key),
+    Migration(4, "dm_conversations", _dm_conversations),
+    Migration(5, "read_markers", _read_markers),
+    Migration(6, "channel_unread_counters", _channel_unread_counters),
+    Migration(7, "full_text_search", _full_text_search),
+    Migration(8, "search_filter_indexes", _search_filter_indexes),
+    Migration(9, "channel_members_by_user", _channel_members_by_user),
+    Migration(10, "channel_member_counts", _channel_member_counts),
+    Migration(11, "channel_mentions", _channel_mentions),
+    Migration(12, "notification_coalescing", _notification_coalescing),
+    Migration(13, "activity_timeline", _activity_timeline),
+    Migration(14, "retention_indexes", _retention_indexes),
+]
+
+
+# ----- runner -----
+
+def _ensure_version_table(engine: Engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, "
+            "name VARCHAR NOT NULL, "
+            "applied_at TIMESTAMP NOT NULL)"
+        ))
+
+
+def applied_versions(engine: Engine) -> List[int]:
+    _ensure_version_table(engine)
+    with engine.connect() as conn:
+        return [row[0] for row in conn.execute(text("SELECT version FROM schema_migrations ORDER BY version"))]
+
+
+def current_version(engine: Engine) -> int:
+    """Highest applied migration version (0 for a database never migrated)"""
+    versions = applied_versions(engine)
+    return versions[-1] if versions else 0
+
+
+def run_migrations(engine: Engine) -> List[int]:
+    """Apply every pending migration in order and return the versions applied"""
+    done = set(applied_versions(engine))
+    applied = []
+    for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+        if migration.version in done:
+            continue
+
+        started = time.monotonic()
+        logger.info("applying migration %d (%s)", migration.version, migration.name)
+        migration.upgrade(engine)
+
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :at)"),
+                    {"v": migration.version, "n": migration.name, "at": datetime.utcnow()}
+                )
+        except IntegrityError:
+            # Another worker finished the same (idempotent) migration first
+            pass
+
+        applied.append(migration.version)
+        logger.info("migration %d done in %.2fs", migration.version, time.monotonic() - started)
+    return applied
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    try:
+        from .database import engine
+    except ImportError:
+        from backend.database import engine
+
+    if "--status" in sys.argv:
+        done = set(applied_versions(engine))
+        for migration in MIGRATIONS:
+            state = "applied" if migration.version in done else "pending"
+            print(f"{migration.version:4d}  {migration.name:<24} {state}")
+    else:
+        versions = run_migrations(engine)
+        print(f"Applied migrations: {versions}" if versions else "Database is up to date")
+        print(f"Schema version: {current_version(engine)}")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Table, ForeignKey, DateTime, Text, Boolean
+from sqlalchemy import Column, Integer, String, Table, ForeignKey, DateTime, Text, Boolean, Index, JSON
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
@@ -14,6 +14,8 @@ channel_members = Table(
     'channel_members', Base.metadata,
     Column('channel_id', Integer, ForeignKey('channels.id'), primary_key=True),
     Column('user_id', Integer, ForeignKey('users.id'), primary_key=True),
+    # A user's channels; the primary key serves a channel's members
+    Index('ix_channel_members_user_id', 'user_id', 'channel_id'),
 )
 
 contacts = Table(
@@ -51,6 +53,7 @@ class User(Base):
     theme = Column(String, default='light')  # light, dark
     notification_sound = Column(Boolean, default=True)
     email_notifications = Column(Boolean, default=True)
+    notification_digest = Column(Boolean, default=False, nullable=False)  # reactions/replies as periodic digests
     
     # For backward compatibility with existing seed data
     name = Column(String, nullable=True)
@@ -84,8 +87,12 @@ class Channel(Base):
     
     # Channel sections support
     section = Column(String, nullable=True)  # For organizing channels into sections
+    
+    # Number of channel_members rows, kept in step by membership.add_member / remove_member
+    member_count = Column(Integer, default=0, nullable=False)
 
-    members = relationship('User', secondary=channel_members, back_populates='channels')
+    # Membership rows are removed with membership.remove_all_members, not by loading the collection
+    members = relationship('User', secondary=channel_members, back_populates='channels', passive_deletes=True)
     messages = relationship('Message', back_populates='channel', cascade='all, delete-orphan')
     creator = relationship('User', foreign_keys=[created_by])
     topic_setter = relationship('User', foreign_keys=[topic_set_by])
@@ -108,6 +115,12 @@ class Message(Base):
     formatted_content = Column(Text, nullable=True)  # HTML content with formatting
     formatting = Column(Text, nullable=True)  # JSON string with formatting metadata
     mentions = Column(Text, nullable=True)  # JSON array of mentioned user IDs
+    mentions_channel = Column(Boolean, default=False, nullable=False)  # @channel: mentions every member
+
+    # Serves keyset pagination of a channel's history
+    __table_args__ = (
+        Index('ix_messages_channel_timestamp_id', 'channel_id', 'timestamp', 'id'),
+    )
 
     channel = relationship('Channel', back_populates='messages')
     user = relationship('User')
@@ -118,11 +131,22 @@ class Message(Base):
     def __repr__(self):
         return f"<Message(id={self.id}, channel_id={self.channel_id}, user_id={self.user_id})>"
 
+def conversation_key(user_a: int, user_b: int) -> str:
+    """Direction-independent key of the DM conversation between two users"""
+    low, high = sorted((user_a, user_b))
+    return f"{low}:{high}"
+
+def _default_conversation_key(context):
+    params = context.get_current_parameters()
+    return conversation_key(params['sender_id'], params['receiver_id'])
+
 class DirectMessage(Base):
     __tablename__ = 'direct_messages'
     id = Column(Integer, primary_key=True, index=True)
     sender_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     receiver_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    # "{min user id}:{max user id}", filled in from sender/receiver on insert
+    conversation_key = Column(String, nullable=True, default=_default_conversation_key)
     content = Column(Text, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
     is_read = Column(Boolean, default=False)
@@ -134,6 +158,12 @@ class DirectMessage(Base):
     formatting = Column(Text, nullable=True)  # JSON string with formatting metadata
     mentions = Column(Text, nullable=True)  # JSON array of mentioned user IDs
 
+    __table_args__ = (
+        Index('ix_direct_messages_sender_receiver_timestamp', 'sender_id', 'receiver_id', 'timestamp'),
+        # Serves keyset pagination of a conversation's history
+        Index('ix_direct_messages_conversation_timestamp_id', 'conversation_key', 'timestamp', 'id'),
+    )
+
     sender = relationship('User', foreign_keys=[sender_id])
     receiver = relationship('User', foreign_keys=[receiver_id])
     dm_attachments = relationship('DirectMessageAttachment', back_populates='direct_message', cascade='all, delete-orphan')
@@ -141,6 +171,45 @@ class DirectMessage(Base):
     def __repr__(self):
         return f"<DirectMessage(id={self.id}, sender_id={self.sender_id}, receiver_id={self.receiver_id})>"
 
+class ChannelReadState(Base):
+    """A user's read marker in a channel"""
+    __tablename__ = 'channel_read_states'
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    channel_id = Column(Integer, ForeignKey('channels.id'), primary_key=True)
+    # Everything up to (last_read_at, last_read_message_id) has been read
+    last_read_message_id = Column(Integer, nullable=True)
+    last_read_at = Column(DateTime, nullable=True)
+    # Sidebar badges, maintained incrementally by backend/channel_reads.py
+    unread_count = Column(Integer, default=0, nullable=False)
+    mention_count = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ChannelReadState(user_id={self.user_id}, channel_id={self.channel_id}, last_read={self.last_read_message_id})>"
+
+class DMConversation(Base):
+    """Per-user summary of a DM conversation, kept in step with direct_messages"""
+    __tablename__ = 'dm_conversations'
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    partner_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    last_message_id = Column(Integer, ForeignKey('direct_messages.id'), nullable=True)
+    last_message_at = Column(DateTime, nullable=True)
+    unread_count = Column(Integer, default=0, nullable=False)
+    # Read marker: everything from the partner up to this message has been read
+    last_read_message_id = Column(Integer, nullable=True)
+    last_read_at = Column(DateTime, nullable=True)
+
+    # Serves a user's conversation list, most recent first
+    __table_args__ = (
+        Index('ix_dm_conversations_user_last_message', 'user_id', 'last_message_at', 'partner_id'),
+    )
+
+    partner = relationship('User', foreign_keys=[partner_id])
+    last_message = relationship('DirectMessage', foreign_keys=[last_message_id])
+
+    def __repr__(self):
+        return f"<DMConversation(user_id={self.user_id}, partner_id={self.partner_id}, unread={self.unread_count})>"
+
 class Thread(Base):
     __tablename__ = 'threads'
     id = Column(Integer, primary_key=True, index=True)
@@ -149,6 +218,10 @@ class Thread(Base):
     content = Column(Text, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index('ix_threads_parent_message_id', 'parent_message_id'),
+    )
+
     parent_message = relationship('Message', back_populates='threads')
     user = relationship('User')
 
@@ -163,6 +236,10 @@ class Reaction(Base):
     emoji = Column(String, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index('ix_reactions_message_id', 'message_id'),
+    )
+
     message = relationship('Message', back_populates='reactions')
     user = relationship('User')
 
@@ -180,6 +257,11 @@ class Attachment(Base):
     mime_type = Column(String, nullable=True)
     uploaded_at = Column(DateTime, default=datetime.utcnow)
 
+    # Serves attachment hydration and has:file search probes
+    __table_args__ = (
+        Index('ix_attachments_message_id', 'message_id'),
+    )
+
     message = relationship('Message', back_populates='attachments')
 
     def __repr__(self):
@@ -196,6 +278,10 @@ class DirectMessageAttachment(Base):
     mime_type = Column(String, nullable=True)
     uploaded_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index('ix_dm_attachments_direct_message_id', 'direct_message_id'),
+    )
+
     direct_message = relationship('DirectMessage', back_populates='dm_attachments')
 
     def __repr__(self):
@@ -235,9 +321,24 @@ class Notification(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     read_at = Column(DateTime, nullable=True)
     
+    # Coalescing: events with the same (user, type, source) fold into one unread row
+    actor_count = Column(Integer, default=1, nullable=False)  # distinct actors folded in
+    recent_actors = Column(Text, nullable=True)  # JSON array of user IDs, newest first
+    updated_at = Column(DateTime, default=datetime.utcnow)  # last event folded in
+    
     # Related data (JSON)
     data = Column(Text, nullable=True)  # Additional JSON data
     
+    __table_args__ = (
+        Index('ix_notifications_user_read_created', 'user_id', 'is_read', 'created_at'),
+        # A user's (unread) notification list, most recently active first
+        Index('ix_notifications_user_read_updated', 'user_id', 'is_read', 'updated_at'),
+        # The open row an event coalesces into
+        Index('ix_notifications_coalesce', 'user_id', 'notification_type', 'source_type', 'source_id'),
+        # Retention walks rows oldest first
+        Index('ix_notifications_updated_id', 'updated_at', 'id'),
+    )
+    
     user = relationship('User', foreign_keys=[user_id])
     
     def __repr__(self):
@@ -439,9 +540,16 @@ class Activity(Base):
     target_type = Column(String, nullable=True)  # message, channel, file
     target_id = Column(Integer, nullable=True)
     
-    activity_metadata = Column(Text, nullable=True)  # JSON metadata (renamed from 'metadata' to avoid SQLAlchemy conflict)
+    activity_metadata = Column(JSON, nullable=True)  # JSON metadata (renamed from 'metadata' to avoid SQLAlchemy conflict)
     created_at = Column(DateTime, default=datetime.utcnow)
     
+    # A user's timeline, newest first (keyset pages on (created_at, id))
+    __table_args__ = (
+        Index('ix_activities_user_created_id', 'user_id', 'created_at', 'id'),
+        # Retention walks rows oldest first
+        Index('ix_activities_created_id', 'created_at', 'id'),
+    )
+    
     user = relationship('User', foreign_keys=[user_id])
     
     def __repr__(self):
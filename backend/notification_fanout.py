@@ -0,0 +1,375 @@
+"""
+Background fan-out of mention, thread-reply, invitation and reaction
+notifications.
+
+Routes used to insert one ``Activity`` row per mentioned user inside the
+sender's transaction, so sending got slower with every extra mention. They
+now describe what happened as a ``FanoutEvent`` and queue it with
+``notify_after_commit``; the event is handed to a background worker only once
+the originating transaction commits (a rolled-back message notifies nobody).
+
+The worker takes whatever events have queued up and, for each one, writes
+every recipient's rows with one set-based ``INSERT ... SELECT``:
+
+- recipients are expanded in SQL - explicit user ids (checked against
+  ``users``), every member of a channel for ``@channel`` (straight from
+  ``channel_members``, so a 10k-member channel is still one statement) and,
+  for thread replies, the parent message's author and everyone who replied
+  before - and combined with ``UNION``, so a user reached twice is notified
+  once
+- the actor never notifies themselves
+- mentions and invitations also get their ``activities`` row (the Activity
+  page and mention badges read those), written the same way
+
+Rows are coalesced: an unread notification with the same (recipient, type,
+source) that saw an event within ``NOTIFICATION_COALESCE_WINDOW_SECONDS``
+absorbs the next one in place - ``actor_count`` and ``recent_actors`` are
+updated and the text becomes the latest event's - so a popular message leaves
+its author one reaction row rather than hundreds. Users who turned on
+``notification_digest`` get their reactions and thread replies as a single
+``digest`` row per ``NOTIFICATION_DIGEST_PERIOD_SECONDS`` instead, which keeps
+their unread badge and their share of the table small.
+
+A batch commits once; if it fails, its events are retried one transaction
+each. Without the worker running (``NOTIFICATION_FANOUT=false``, or scripts
+that never start the app) events are written synchronously after commit.
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import JSON, Boolean, DateTime, Integer, String, Text, event, exists, insert, literal, select, union, update
+from sqlalchemy.orm import Session, aliased
+
+from .config import settings
+from .database import SessionLocal
+from .models import Activity, Message, Notification, Thread, User, channel_members
+
+logger = logging.getLogger(__name__)
+
+MENTION = "mention"
+THREAD_REPLY = "thread_reply"
+INVITE = "invite"
+REACTION = "reaction"
+DIGEST = "digest"
+
+# Types folded into a periodic digest for users in digest mode: (singular, plural)
+DIGEST_LABELS = {
+    REACTION: ("reaction", "reactions"),
+    THREAD_REPLY: ("thread reply", "thread replies")
+}
+
+_STOP = object()
+
+
+class FanoutEvent(NamedTuple):
+    """Something that notifies a set of users"""
+    notification_type: str          # mention, thread_reply, invite, reaction
+    actor_id: int                   # never notified about their own action
+    title: str
+    message: str
+    source_type: str                # what the notification links to (message, channel)
+    source_id: int
+    data: Dict[str, Any]
+    recipients: Tuple[int, ...] = ()
+    thread_of: Optional[int] = None      # also the author and earlier repliers of this message
+    channel_id: Optional[int] = None     # also every member of this channel
+    activity_type: Optional[str] = None  # also add an activities row of this type
+
+    def as_dict(self) -> dict:
+        return {**self._asdict(), "recipients": list(self.recipients)}
+
+
+def _recipient_ids(event: FanoutEvent):
+    """Subquery (one ``user_id`` column) of everyone the event reaches, deduplicated"""
+    parts = []
+    if event.recipients:
+        parts.append(select(User.id.label("user_id")).where(User.id.in_(event.recipients)))
+    if event.channel_id is not None:
+        parts.append(select(channel_members.c.user_id).where(channel_members.c.channel_id == event.channel_id))
+    if event.thread_of is not None:
+        parts.append(select(Message.user_id.label("user_id")).where(Message.id == event.thread_of))
+        parts.append(select(Thread.user_id.label("user_id")).where(Thread.parent_message_id == event.thread_of))
+    if not parts:
+        return None
+    return (union(*parts) if len(parts) > 1 else parts[0]).subquery()
+
+
+class _Target(NamedTuple):
+    """The notification row an event is written into for a group of recipients"""
+    notification_type: str
+    title: str
+    message: str
+    source_type: str
+    source_id: int
+    data: Dict[str, Any]
+    open_since: Optional[datetime]  # unread rows last updated after this absorb the event
+
+
+def _own_target(event: FanoutEvent, now: datetime) -> _Target:
+    window = settings.NOTIFICATION_COALESCE_WINDOW_SECONDS
+    return _Target(
+        event.notification_type, event.title, event.message, event.source_type, event.source_id,
+        event.data, now - timedelta(seconds=window) if window > 0 else None
+    )
+
+
+def _digest_message(counts: Dict[str, int]) -> str:
+    return ", ".join(
+        f"{count} new {DIGEST_LABELS[kind][0 if count == 1 else 1]}"
+        for kind, count in counts.items()
+    )
+
+
+def _digest_target(event: FanoutEvent, now: datetime) -> _Target:
+    # One digest per user per period; the period number is its source id
+    period = settings.NOTIFICATION_DIGEST_PERIOD_SECONDS
+    number = int(now.replace(tzinfo=timezone.utc).timestamp()) // period
+    start = datetime.fromtimestamp(number * period, timezone.utc).replace(tzinfo=None)
+    counts = {event.notification_type: 1}
+    return _Target(
+        DIGEST, "Activity digest", _digest_message(counts), DIGEST, number,
+        {"counts": counts, "period_start": start.isoformat()},
+        start
+    )
+
+
+def _coalesce(existing: Notification, event: FanoutEvent, target: _Target, now: datetime) -> dict:
+    """New values for an open row absorbing the event"""
+    recent = json.loads(existing.recent_actors) if existing.recent_actors else []
+    values = {
+        "id": existing.id,
+        "actor_count": existing.actor_count + (0 if event.actor_id in recent else 1),
+        "recent_actors": json.dumps(
+            [event.actor_id] + [actor for actor in recent if actor != event.actor_id][:settings.NOTIFICATION_RECENT_ACTORS - 1]
+        ),
+        "updated_at": now
+    }
+    if target.notification_type == DIGEST:
+        data = json.loads(existing.data) if existing.data else {}
+        counts = data.setdefault("counts", {})
+        counts[event.notification_type] = counts.get(event.notification_type, 0) + 1
+        values.update(message=_digest_message(counts), data=json.dumps(data))
+    else:
+        # The row reads as the latest event; actor_count/recent_actors carry the rest
+        values.update(title=target.title, message=target.message, data=json.dumps(target.data))
+    return values
+
+
+def _deliver(db: Session, event: FanoutEvent, target: _Target, recipients, conditions: list, now: datetime) -> int:
+    """Write ``target`` for the recipients matching ``conditions``: update open rows in place, insert the rest"""
+    user_id = recipients.c.user_id
+    open_row = aliased(Notification)
+    is_open = [
+        open_row.notification_type == target.notification_type,
+        open_row.source_type == target.source_type,
+        open_row.source_id == target.source_id,
+        open_row.is_read == False
+    ]
+    written = 0
+
+    if target.open_since is not None:
+        existing = db.execute(select(open_row).where(
+            open_row.user_id.in_(select(user_id).where(*conditions)),
+            open_row.updated_at > target.open_since,
+            *is_open
+        )).scalars().all()
+        if existing:
+            db.execute(update(Notification), [_coalesce(row, event, target, now) for row in existing])
+            written += len(existing)
+        is_open.append(open_row.updated_at > target.open_since)
+
+    rows = select(
+        user_id,
+        literal(target.notification_type, String),
+        literal(target.title, String),
+        literal(target.message, Text),
+        literal(target.source_type, String),
+        literal(target.source_id, Integer),
+        literal(json.dumps(target.data), Text),
+        literal(False, Boolean),
+        literal(now, DateTime),
+        literal(now, DateTime),
+        literal(1, Integer),
+        literal(json.dumps([event.actor_id]), Text)
+    ).where(*conditions)
+    if target.open_since is not None:
+        rows = rows.where(~exists().where(open_row.user_id == user_id, *is_open))
+    result = db.execute(insert(Notification).from_select([
+        "user_id", "notification_type", "title", "message", "source_type", "source_id", "data", "is_read",
+        "created_at", "updated_at", "actor_count", "recent_actors"
+    ], rows))
+    return written + (result.rowcount or 0)
+
+
+def write_event(db: Session, event: FanoutEvent) -> int:
+    """Write the event's notifications (and activities) set-based; returns the notification rows touched"""
+    recipients = _recipient_ids(event)
+    if recipients is None:
+        return 0
+    user_id = recipients.c.user_id
+    now = datetime.utcnow()
+
+    conditions = [user_id != event.actor_id]
+    written = 0
+    if event.notification_type in DIGEST_LABELS:
+        digest_users = select(User.id).where(User.notification_digest == True)
+        written += _deliver(
+            db, event, _digest_target(event, now), recipients, conditions + [user_id.in_(digest_users)], now
+        )
+        conditions.append(user_id.not_in(digest_users))
+    written += _deliver(db, event, _own_target(event, now), recipients, conditions, now)
+
+    if event.activity_type:
+        activities = select(
+            user_id,
+            literal(event.activity_type, String),
+            literal(event.message, Text),
+            literal(event.source_type, String),
+            literal(event.source_id, Integer),
+            literal(event.data, JSON),
+            literal(now, DateTime)
+        ).where(user_id != event.actor_id)
+        db.execute(insert(Activity).from_select([
+            "user_id", "activity_type", "description", "target_type", "target_id", "activity_metadata", "created_at"
+        ], activities))
+
+    return written
+
+
+class NotificationFanout:
+    """Worker thread writing queued FanoutEvents in small batches"""
+
+    def __init__(self, session_factory, window_ms: int, max_batch: int):
+        self.session_factory = session_factory
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self.batches = 0
+        self.events = 0
+        self.notifications = 0
+        self.failures = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._thread = threading.Thread(target=self._run, name="notification-fanout", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Write whatever is queued, then stop the worker"""
+        if not self.running:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, events: List[FanoutEvent]):
+        if not self.running:
+            self._write(list(events))
+            return
+        for item in events:
+            self._queue.put(item)
+
+    def wait_idle(self):
+        """Block until every event submitted so far has been written"""
+        self._queue.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch: List[FanoutEvent]):
+        db = self.session_factory()
+        try:
+            try:
+                written = sum(write_event(db, item) for item in batch)
+                db.commit()
+            except Exception:
+                db.rollback()
+                logger.warning("notification batch of %d failed, retrying events one by one", len(batch), exc_info=True)
+                written = 0
+                for item in batch:
+                    try:
+                        written += write_event(db, item)
+                        db.commit()
+                    except Exception:
+                        db.rollback()
+                        self.failures += 1
+                        logger.exception("dropping notification event %s", item.as_dict())
+            self.batches += 1
+            self.events += len(batch)
+            self.notifications += written
+        finally:
+            db.close()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.running,
+            "batches": self.batches,
+            "events": self.events,
+            "notifications": self.notifications,
+            "failures": self.failures,
+            "queued": self._queue.qsize()
+        }
+
+
+notification_fanout = NotificationFanout(
+    SessionLocal, settings.NOTIFICATION_FANOUT_WINDOW_MS, settings.NOTIFICATION_FANOUT_MAX_BATCH
+)
+
+
+# ----- queueing on commit -----
+
+_PENDING_KEY = "notification_events_pending"
+
+
+def notify_after_commit(db: Session, event: FanoutEvent):
+    """Queue an event on the session; it is fanned out only if the transaction commits"""
+    db.info.setdefault(_PENDING_KEY, []).append(event)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _submit_pending(session: Session):
+    events = session.info.pop(_PENDING_KEY, None)
+    if events:
+        notification_fanout.submit(events)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_pending(session: Session):
+    session.info.pop(_PENDING_KEY, None)
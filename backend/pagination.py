@@ -0,0 +1,104 @@
+"""
+Keyset (cursor) pagination helpers.
+
+Cursors are opaque, URL-safe strings that encode a ``(timestamp, id)`` pair.
+Pages are selected with a row-value comparison against that pair so the
+database can seek straight to the page through a composite index instead of
+scanning (and sorting) the whole history.
+"""
+
+import base64
+from datetime import datetime
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    """Encode a (timestamp, id) pair into an opaque cursor string"""
+    raw = f"{timestamp.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        ts, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(ts), int(row_id)
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+
+def cursor_for(row, timestamp_attr: str = "timestamp") -> Optional[str]:
+    """Build the cursor pointing at a given row"""
+    if row is None:
+        return None
+    return encode_cursor(getattr(row, timestamp_attr), row.id)
+
+
+def keyset_page(
+    query,
+    ts_column,
+    id_column,
+    limit: int,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    around: Optional[str] = None,
+):
+    """
+    Fetch one page of rows ordered by (ts_column, id_column) ascending.
+
+    Only one of ``before``/``after``/``around`` may be given. Without a cursor
+    the newest ``limit`` rows are returned. Returns ``(rows, has_older,
+    has_newer)`` with rows always in ascending order.
+    """
+    if sum(c is not None for c in (before, after, around)) > 1:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only one of before, after or around may be given"
+        )
+
+    key = tuple_(ts_column, id_column)
+
+    def older_than(ts, row_id, n, inclusive=False):
+        cond = key <= (ts, row_id) if inclusive else key < (ts, row_id)
+        rows = query.filter(cond).order_by(
+            ts_column.desc(), id_column.desc()
+        ).limit(n + 1).all()
+        return list(reversed(rows[:n])), len(rows) > n
+
+    def newer_than(ts, row_id, n, inclusive=False):
+        cond = key >= (ts, row_id) if inclusive else key > (ts, row_id)
+        rows = query.filter(cond).order_by(
+            ts_column.asc(), id_column.asc()
+        ).limit(n + 1).all()
+        return rows[:n], len(rows) > n
+
+    if before is not None:
+        ts, row_id = decode_cursor(before)
+        rows, has_older = older_than(ts, row_id, limit)
+        return rows, has_older, True
+
+    if after is not None:
+        ts, row_id = decode_cursor(after)
+        rows, has_newer = newer_than(ts, row_id, limit)
+        return rows, True, has_newer
+
+    if around is not None:
+        ts, row_id = decode_cursor(around)
+        older_count = limit // 2
+        older, has_older = older_than(ts, row_id, older_count)
+        newer, has_newer = newer_than(ts, row_id, limit - older_count, inclusive=True)
+        return older + newer, has_older, has_newer
+
+    rows = query.order_by(ts_column.desc(), id_column.desc()).limit(limit + 1).all()
+    return list(reversed(rows[:limit])), len(rows) > limit, False
@@ -0,0 +1,121 @@
+"""
+In-memory presence index.
+
+``@here`` notifies the members of a channel who are around right now.
+Finding them with ``users.presence`` means scanning the users table (the
+column is not indexed, and most users are offline) on every such message.
+Instead each worker keeps two things in memory, both maintained from the
+``presence`` event-bus topic:
+
+- socket liveness - which workers hold an open WebSocket for each user. The
+  hub announces a user's first socket on a worker and the last one closing,
+  tagged with the worker's id. A user is connected while any worker holds a
+  socket, so closing the last socket on one worker does not hide a user who
+  is still connected elsewhere. A worker that starts asks the others to
+  re-announce their connected users.
+- chosen presence - what the user set with ``PUT /api/users/me/presence``
+  (stored in ``users.presence``), loaded once and then updated from the same
+  topic.
+
+A user is "here" while connected, unless they chose one of
+``QUIET_PRESENCES``. Socket events never change the chosen presence, so
+opening a socket does not pull a ``dnd`` user into ``@here``. They are not
+written to ``users.presence`` either: they describe one worker's sockets, and
+a write per connect would put the database on the WebSocket path. A stored
+``offline`` is the column's default rather than an opt-out, so it does not
+silence a connected user.
+"""
+
+import json
+import threading
+from typing import Dict, FrozenSet, Optional, Set
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .models import User
+from .realtime import hub, worker_id, PRESENCE_TOPIC
+
+# Chosen presences that keep a connected user out of @here
+QUIET_PRESENCES = ("away", "dnd")
+
+
+class PresenceIndex:
+    """Thread-safe socket liveness and chosen presence per user"""
+
+    def __init__(self):
+        self._sockets: Dict[int, Set[str]] = {}
+        self._chosen: Dict[int, str] = {}
+        self._active: Optional[FrozenSet[int]] = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self, db: Session):
+        if self._loaded:
+            return
+        rows = db.execute(select(User.id, User.presence).where(User.presence.in_(QUIET_PRESENCES))).all()
+        with self._lock:
+            if self._loaded:
+                return
+            chosen = {user_id: presence for user_id, presence in rows}
+            # Choices that arrived while loading are newer than the rows read
+            chosen.update(self._chosen)
+            self._chosen = chosen
+            # Sockets connected to this worker before the first load
+            for user_id in hub.online_user_ids():
+                self._sockets.setdefault(user_id, set()).add(worker_id())
+            self._active = None
+            self._loaded = True
+
+    def set(self, user_id: int, presence: str):
+        """Record the presence a user chose"""
+        with self._lock:
+            self._chosen[user_id] = presence
+            self._active = None
+
+    def set_connected(self, user_id: int, worker: str, connected: bool):
+        """Record whether ``worker`` holds a socket for a user"""
+        with self._lock:
+            workers = self._sockets.get(user_id)
+            if connected:
+                self._sockets.setdefault(user_id, set()).add(worker)
+            elif workers is not None:
+                workers.discard(worker)
+                if not workers:
+                    del self._sockets[user_id]
+            self._active = None
+
+    def active_ids(self, db: Session) -> FrozenSet[int]:
+        """Connected users who have not chosen a quiet presence"""
+        self._ensure_loaded(db)
+        with self._lock:
+            if self._active is None:
+                self._active = frozenset(
+                    user_id for user_id in self._sockets if self._chosen.get(user_id) not in QUIET_PRESENCES
+                )
+            return self._active
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "loaded": self._loaded,
+                "connected": len(self._sockets),
+                "quiet": sum(1 for presence in self._chosen.values() if presence in QUIET_PRESENCES),
+                "active": sum(1 for user_id in self._sockets if self._chosen.get(user_id) not in QUIET_PRESENCES)
+            }
+
+
+presence_index = PresenceIndex()
+
+
+def _on_bus_event(text: str):
+    data = json.loads(text)["data"]
+    if "user_id" not in data or "presence" not in data:
+        return
+    if "worker" in data:
+        presence_index.set_connected(data["user_id"], data["worker"], data["presence"] != "offline")
+    else:
+        presence_index.set(data["user_id"], data["presence"])
+
+
+hub.add_listener(PRESENCE_TOPIC, _on_bus_event)
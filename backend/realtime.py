@@ -0,0 +1,289 @@
+"""
+In-process pub/sub hub for real-time events delivered over WebSockets.
+
+Topics are plain strings:
+
+- ``channel:{channel_id}``  - messages, threads, reactions and pins in a channel
+- ``dm:{low_id}:{high_id}`` - direct messages between two users
+- ``user:{user_id}``        - a user's personal inbox (invites, DMs, notifications)
+- ``presence``              - users coming online / going offline
+
+Every connection owns a bounded send queue drained by its own task, so a
+client that stops reading only ever fills its own queue. When a queue is full
+(or a send stalls past the timeout) the connection is evicted rather than
+holding up delivery to everyone else.
+
+Routes queue events on their DB session with ``publish_after_commit``; they
+are handed to the hub only once that session's transaction commits, so
+clients never see writes that were rolled back. The hub sends every event
+through the configured broker (see ``event_bus``), which delivers it back to
+the hub of every worker process for local fan-out.
+"""
+
+import asyncio
+import json
+import os
+import socket
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set
+
+from fastapi import WebSocket
+from sqlalchemy import event
+
+from .config import settings
+from .database import SessionLocal
+from .event_bus import Broker, LocalBroker, create_broker
+
+# Close code sent to evicted slow consumers ("try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+def channel_topic(channel_id: int) -> str:
+    return f"channel:{channel_id}"
+
+
+def dm_topic(user_a: int, user_b: int) -> str:
+    low, high = sorted((user_a, user_b))
+    return f"dm:{low}:{high}"
+
+
+def user_topic(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+PRESENCE_TOPIC = "presence"
+
+
+def worker_id() -> str:
+    """Identifies this worker process in socket presence events"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Connection:
+    """One WebSocket client and its bounded outbound queue"""
+
+    def __init__(self, websocket: WebSocket, user_id: int, queue_size: int):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.topics: Set[str] = set()
+        self.sender_task: Optional[asyncio.Task] = None
+        self.closed = False
+
+
+class Hub:
+    """Topic-based fan-out to WebSocket connections on this worker"""
+
+    def __init__(self, queue_size: int, send_timeout: float):
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.broker: Broker = LocalBroker()
+        self._topics: Dict[str, Set[Connection]] = defaultdict(set)
+        self._user_connections: Dict[int, Set[Connection]] = defaultdict(set)
+        self._listeners: Dict[str, List[Callable[[str], None]]] = defaultdict(list)
+        self.evicted_count = 0
+        self.add_listener(PRESENCE_TOPIC, self._on_presence_event)
+
+    async def start(self, broker: Broker):
+        """Attach the cross-worker broker (call once from app startup)"""
+        self.broker = broker
+        await broker.start(self._fanout)
+        # Ask the other workers which users they hold sockets for
+        self.publish(PRESENCE_TOPIC, "presence.sync", {"worker": worker_id()})
+
+    async def stop(self):
+        await self.broker.stop()
+
+    # ----- connection lifecycle (event loop only) -----
+
+    async def connect(self, websocket: WebSocket, user_id: int) -> Connection:
+        conn = Connection(websocket, user_id, self.queue_size)
+        conn.sender_task = asyncio.create_task(self._pump(conn))
+
+        first_for_user = not self._user_connections[user_id]
+        self._user_connections[user_id].add(conn)
+        if first_for_user:
+            self._publish_connected(user_id, True)
+        return conn
+
+    async def disconnect(self, conn: Connection):
+        if conn.sender_task and conn.sender_task is not asyncio.current_task():
+            conn.sender_task.cancel()
+        self._detach(conn)
+
+    def subscribe(self, conn: Connection, topic: str):
+        if conn.closed:
+            return
+        conn.topics.add(topic)
+        self._topics[topic].add(conn)
+
+    def unsubscribe(self, conn: Connection, topic: str):
+        conn.topics.discard(topic)
+        subscribers = self._topics.get(topic)
+        if subscribers is not None:
+            subscribers.discard(conn)
+            if not subscribers:
+                del self._topics[topic]
+
+    def subscribe_user(self, user_id: int, topic: str):
+        """Subscribe every open connection of a user (after they joined a channel)"""
+        for conn in list(self._user_connections.get(user_id, ())):
+            if topic not in conn.topics:
+                self.subscribe(conn, topic)
+                self.send(conn, "subscribed", {"topic": topic})
+
+    def unsubscribe_user(self, user_id: int, topic: str):
+        """Unsubscribe every open connection of a user (after they left or were removed)"""
+        for conn in list(self._user_connections.get(user_id, ())):
+            if topic in conn.topics:
+                self.unsubscribe(conn, topic)
+                self.send(conn, "unsubscribed", {"topic": topic})
+
+    def close_topic(self, topic: str):
+        """Unsubscribe every connection from a topic (e.g. a deleted channel)"""
+        for conn in list(self._topics.get(topic, ())):
+            self.unsubscribe(conn, topic)
+            self.send(conn, "unsubscribed", {"topic": topic})
+
+    def _detach(self, conn: Connection):
+        if conn.closed:
+            return
+        conn.closed = True
+        for topic in list(conn.topics):
+            self.unsubscribe(conn, topic)
+
+        user_conns = self._user_connections.get(conn.user_id)
+        if user_conns is not None:
+            user_conns.discard(conn)
+            if not user_conns:
+                del self._user_connections[conn.user_id]
+                self._publish_connected(conn.user_id, False)
+
+    def _publish_connected(self, user_id: int, connected: bool):
+        # "worker" marks a socket event: it says whether this worker holds a
+        # socket for the user, not what presence the user chose
+        self.publish(PRESENCE_TOPIC, "presence.changed", {
+            "user_id": user_id,
+            "presence": "online" if connected else "offline",
+            "worker": worker_id()
+        })
+
+    def _on_presence_event(self, text: str):
+        """Answer a newly started worker's sync request with this worker's connected users"""
+        message = json.loads(text)
+        if message.get("type") == "presence.sync" and message["data"].get("worker") != worker_id():
+            for user_id in list(self._user_connections):
+                self._publish_connected(user_id, True)
+
+    def _evict(self, conn: Connection):
+        """Drop a slow consumer without blocking the publisher"""
+        if conn.closed:
+            return
+        self.evicted_count += 1
+        self._detach(conn)
+        if conn.sender_task and conn.sender_task is not asyncio.current_task():
+            conn.sender_task.cancel()
+        asyncio.ensure_future(self._close(conn, SLOW_CONSUMER_CLOSE_CODE))
+
+    async def _close(self, conn: Connection, code: int):
+        try:
+            await conn.websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def _pump(self, conn: Connection):
+        """Drain one connection's queue onto its socket"""
+        try:
+            while True:
+                text = await conn.queue.get()
+                await asyncio.wait_for(conn.websocket.send_text(text), timeout=self.send_timeout)
+        except asyncio.TimeoutError:
+            self._evict(conn)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # Socket went away underneath us; the receive loop cleans up
+            self._detach(conn)
+
+    # ----- publishing (safe from any thread) -----
+
+    def publish(self, topic: str, event_type: str, data: dict):
+        """Send an event to every subscriber of a topic, on every worker"""
+        # Serialize once, not once per subscriber
+        text = json.dumps({
+            "type": event_type,
+            "topic": topic,
+            "data": data,
+            "sent_at": datetime.utcnow().isoformat()
+        }, default=str)
+        self.broker.publish(topic, text)
+
+    def send(self, conn: Connection, event_type: str, data: dict):
+        """Queue a reply for a single connection (event loop only)"""
+        text = json.dumps({"type": event_type, "data": data}, default=str)
+        try:
+            conn.queue.put_nowait(text)
+        except asyncio.QueueFull:
+            self._evict(conn)
+
+    def add_listener(self, topic: str, callback: Callable[[str], None]):
+        """Hand every event on a topic to an in-process consumer (e.g. a cache) as well as to sockets"""
+        self._listeners[topic].append(callback)
+
+    def _fanout(self, topic: str, text: str):
+        for callback in self._listeners.get(topic, ()):
+            callback(text)
+        for conn in list(self._topics.get(topic, ())):
+            try:
+                conn.queue.put_nowait(text)
+            except asyncio.QueueFull:
+                self._evict(conn)
+
+    def stats(self) -> dict:
+        return {
+            "connections": sum(len(c) for c in self._user_connections.values()),
+            "users_online": len(self._user_connections),
+            "topics": len(self._topics),
+            "evicted": self.evicted_count,
+            "broker": self.broker.stats()
+        }
+
+    def online_user_ids(self) -> Set[int]:
+        return set(self._user_connections.keys())
+
+
+hub = Hub(settings.WS_SEND_QUEUE_SIZE, settings.WS_SEND_TIMEOUT_SECONDS)
+
+
+async def start_event_bus():
+    await hub.start(create_broker(
+        settings.EVENT_BROKER,
+        settings.EVENT_BROKER_SOCKET,
+        settings.EVENT_BROKER_URL
+    ))
+
+
+async def stop_event_bus():
+    await hub.stop()
+
+
+# ----- transactional publishing -----
+
+_PENDING_KEY = "realtime_pending_events"
+
+
+def publish_after_commit(db, topic: str, event_type: str, data: dict):
+    """Queue an event on the session; it is published only if the transaction commits"""
+    db.info.setdefault(_PENDING_KEY, []).append((topic, event_type, data))
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _publish_pending(session):
+    for topic, event_type, data in session.info.pop(_PENDING_KEY, ()):
+        hub.publish(topic, event_type, data)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_pending(session):
+    session.info.pop(_PENDING_KEY, None)
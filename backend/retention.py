@@ -0,0 +1,182 @@
+"""
+Retention for notifications and activities.
+
+Both tables only grow: rows are removed only when a user deletes them. A
+background worker now enforces age-based policies:
+
+- ``notifications_read`` - read notifications whose last event is older than
+  ``NOTIFICATION_RETENTION_DAYS``
+- ``activities``         - activities older than ``ACTIVITY_RETENTION_DAYS``
+
+Setting a policy's days to 0 turns it off. Deletes never hold a long write
+lock. Each pass walks the table's ``(timestamp, id)`` index from the oldest
+row. It selects at most ``RETENTION_CHUNK_SIZE`` expired ids, deletes them in
+their own short transaction and sleeps ``RETENTION_CHUNK_PAUSE_MS`` before the
+next chunk, so regular writes interleave. The walk resumes after the last row
+seen, so rows a policy keeps (unread notifications) are scanned once per pass.
+
+Neither table feeds the search index, the search cache or the membership
+cache, so deleting with Core statements needs no invalidation. Reclaimed rows
+are counted per policy and reported by ``stats()`` (see
+``/api/diagnostics/database``).
+
+Run a single pass by hand with::
+
+    python -m backend.retention
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import Column, and_, delete, select, tuple_
+from sqlalchemy.engine import Engine
+
+from .config import settings
+from .database import engine
+from .models import Activity, Notification
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionPolicy(NamedTuple):
+    """Rows of ``model`` whose ``age_column`` is older than ``days`` (and match ``condition``) expire"""
+    name: str
+    model: type
+    age_column: Column
+    days: int
+    condition: Optional[Callable[[], object]] = None
+
+
+def default_policies() -> List[RetentionPolicy]:
+    return [
+        RetentionPolicy(
+            "notifications_read", Notification, Notification.updated_at,
+            settings.NOTIFICATION_RETENTION_DAYS, lambda: Notification.is_read == True
+        ),
+        RetentionPolicy("activities", Activity, Activity.created_at, settings.ACTIVITY_RETENTION_DAYS),
+    ]
+
+
+class RetentionWorker:
+    """Thread applying retention policies every ``interval`` seconds"""
+
+    def __init__(self, engine: Engine, policies: List[RetentionPolicy], interval: float,
+                 chunk_size: int, pause_seconds: float):
+        self.engine = engine
+        self.policies = policies
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.pause = pause_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.passes = 0
+        self.last_pass_at: Optional[datetime] = None
+        self._metrics: Dict[str, dict] = {
+            policy.name: {"days": policy.days, "deleted": 0, "chunks": 0, "last_deleted": 0, "last_seconds": 0.0}
+            for policy in policies
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop after the current chunk"""
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("retention pass failed")
+            self._stop.wait(self.interval)
+
+    def run_once(self) -> Dict[str, int]:
+        """Apply every enabled policy once; returns rows deleted per policy"""
+        deleted = {policy.name: self.apply(policy) for policy in self.policies if policy.days > 0}
+        with self._lock:
+            self.passes += 1
+            self.last_pass_at = datetime.utcnow()
+        return deleted
+
+    def apply(self, policy: RetentionPolicy) -> int:
+        """Delete one policy's expired rows chunk by chunk; returns the number deleted"""
+        model = policy.model
+        key = tuple_(policy.age_column, model.id)
+        cutoff = datetime.utcnow() - timedelta(days=policy.days)
+        expired = [policy.age_column < cutoff]
+        if policy.condition is not None:
+            expired.append(policy.condition())
+
+        started = time.monotonic()
+        deleted = 0
+        last = None
+        while not self._stop.is_set():
+            with self.engine.begin() as conn:
+                query = select(policy.age_column, model.id).where(*expired)
+                if last is not None:
+                    query = query.where(key > last)
+                rows = conn.execute(
+                    query.order_by(policy.age_column, model.id).limit(self.chunk_size)
+                ).all()
+                if not rows:
+                    break
+                last = tuple(rows[-1])
+                # Conditions repeated so a row changed since the select is kept
+                result = conn.execute(delete(model).where(and_(model.id.in_([row[1] for row in rows]), *expired)))
+                deleted += result.rowcount or 0
+
+            with self._lock:
+                self._metrics[policy.name]["chunks"] += 1
+            if len(rows) < self.chunk_size:
+                break
+            if self.pause:
+                self._stop.wait(self.pause)
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            metrics = self._metrics[policy.name]
+            metrics["deleted"] += deleted
+            metrics["last_deleted"] = deleted
+            metrics["last_seconds"] = round(elapsed, 3)
+        if deleted:
+            logger.info("retention %s: deleted %d rows in %.2fs", policy.name, deleted, elapsed)
+        return deleted
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.running,
+                "interval_seconds": self.interval,
+                "passes": self.passes,
+                "last_pass_at": self.last_pass_at.isoformat() if self.last_pass_at else None,
+                "policies": {name: dict(metrics) for name, metrics in self._metrics.items()}
+            }
+
+
+retention_worker = RetentionWorker(
+    engine, default_policies(), settings.RETENTION_INTERVAL_SECONDS,
+    settings.RETENTION_CHUNK_SIZE, settings.RETENTION_CHUNK_PAUSE_MS / 1000.0
+)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    for name, count in retention_worker.run_once().items():
+        print(f"{name:<20} {count} rows deleted")
@@ -1,12 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session, joinedload
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session
+from typing import List, Optional
 from datetime import datetime, timedelta
-import json
 
 from ..database import get_db
 from ..models import User, Activity
-from ..schemas import ActivitySchema
+from ..pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, cursor_for, decode_cursor
+from ..schemas import ActivitySchema, ActivityFeedPage
+from ..write_batcher import run_write
 from .auth import get_current_user
 
 router = APIRouter(prefix="/api/activity", tags=["activity"])
@@ -31,47 +33,51 @@ def get_activities(
     return activities
 
 
-@router.get("/all", response_model=List[ActivitySchema])
+@router.get("/all", response_model=ActivityFeedPage)
 def get_all_activities(
-    skip: int = 0,
-    limit: int = 100,
+    before: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Get all activities across workspace (for Activity page)"""
-    # Get activities from channels user is member of
-    activities = db.query(Activity).options(joinedload(Activity.user)).order_by(
-        Activity.created_at.desc()
-    ).offset(skip).limit(limit).all()
+    """
+    The current user's activity timeline (for Activity page), newest first.
+
+    Activities are written per recipient (mentions, invitations, ...), so this
+    is one range read of ``ix_activities_user_created_id``.
+    """
+    query = db.query(Activity).filter(Activity.user_id == current_user.id)
+    if before is not None:
+        created_at, activity_id = decode_cursor(before)
+        query = query.filter(tuple_(Activity.created_at, Activity.id) < (created_at, activity_id))
+    rows = query.order_by(Activity.created_at.desc(), Activity.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    activities = rows[:limit]
     
-    # Format activities for frontend
-    formatted_activities = []
-    for activity in activities:
-        # Parse metadata if exists
-        metadata = {}
-        if activity.activity_metadata:
-            try:
-                metadata = json.loads(activity.activity_metadata)
-            except:
-                pass
-
-        formatted_activities.append({
-            'id': activity.id,
-            'user_id': activity.user_id,
-            'description': activity.description,
-            'metadata': json.dumps(metadata),  # Convert metadata to JSON string
-            'created_at': activity.created_at.isoformat() if activity.created_at else None,
-            'user_name': activity.user.username if activity.user else 'Unknown',
-            'user': activity.user.username if activity.user else 'Unknown',
-            'action': activity.description,
-            'activity_type': activity.activity_type,
-            'timestamp': activity.created_at.isoformat() if activity.created_at else None,
-            'is_read': True,  # Default to read for now
-            'contentType': 'dm' if activity.target_type == 'dm' else 'channel',
-            'contentId': activity.target_id if activity.target_id else activity.user_id,
-        })
-
-    return formatted_activities
+    # Format activities for frontend; metadata is already decoded by the JSON column
+    formatted_activities = [{
+        'id': activity.id,
+        'user_id': activity.user_id,
+        'user_name': current_user.username,
+        'user': current_user.username,
+        'description': activity.description,
+        'action': activity.description,
+        'activity_type': activity.activity_type,
+        'target_type': activity.target_type,
+        'target_id': activity.target_id,
+        'metadata': activity.activity_metadata,
+        'created_at': activity.created_at,
+        'timestamp': activity.created_at,
+        'is_read': True,  # Default to read for now
+        'contentType': 'dm' if activity.target_type == 'dm' else 'channel',
+        'contentId': activity.target_id if activity.target_id else activity.user_id,
+    } for activity in activities]
+    
+    return {
+        'activities': formatted_activities,
+        'next_cursor': cursor_for(activities[-1], "created_at") if has_more else None,
+        'has_more': has_more
+    }
 
 
 @router.get("/public")
@@ -113,15 +119,19 @@ def create_activity(
     metadata: dict = None
 ):
     """Helper function to create an activity log"""
-    activity = Activity(
-        user_id=user_id,
-        activity_type=activity_type,
-        description=description,
-        target_type=target_type,
-        target_id=target_id,
-        metadata=json.dumps(metadata) if metadata else None
-    )
-    db.add(activity)
-    db.commit()
-    db.refresh(activity)
-    return activity
+    def write_activity(write_db: Session) -> int:
+        activity = Activity(
+            user_id=user_id,
+            activity_type=activity_type,
+            description=description,
+            target_type=target_type,
+            target_id=target_id,
+            activity_metadata=metadata
+        )
+        write_db.add(activity)
+        write_db.flush()
+        return activity.id
+    
+    # Commits the activity (batched with other writers when WRITE_BATCHING is on)
+    activity_id = run_write(db, write_activity)
+    return db.get(Activity, activity_id)
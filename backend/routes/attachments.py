@@ -8,6 +8,7 @@ from pathlib import Path
 from ..database import get_db
 from ..models import User, Message, DirectMessage, Attachment, DirectMessageAttachment
 from ..schemas import AttachmentSchema, DMAttachmentSchema
+from ..membership import can_read, is_member
 from .auth import get_current_user
 
 router = APIRouter(prefix="/api/attachments", tags=["attachments"])
@@ -89,7 +90,7 @@ async def upload_message_attachment(
     
     # Verify user is member of channel
     channel = message.channel
-    if current_user not in channel.members:
+    if not is_member(db, channel.id, current_user.id):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You don't have access to this channel"
@@ -184,7 +185,7 @@ def get_message_attachments(
     
     # Verify access
     channel = message.channel
-    if channel.is_private and current_user not in channel.members:
+    if not can_read(db, channel, current_user.id):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You don't have access to this channel"
@@ -287,7 +288,7 @@ async def download_attachment(
         
         # Verify access
         channel = attachment.message.channel
-        if channel.is_private and current_user not in channel.members:
+        if not can_read(db, channel, current_user.id):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="You don't have access to this file"
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Response, Cookie
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response, Cookie
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 import secrets
@@ -8,6 +8,7 @@ from ..database import get_db
 from ..models import User, Session as SessionModel
 from ..schemas import UserCreate, UserLogin, User as UserSchema, AuthResponse, LogoutResponse
 from ..config import settings
+from ..session_cache import drop_session, resolve_session
 
 router = APIRouter(prefix="/api/auth", tags=["authentication"])
 
@@ -36,10 +37,19 @@ def create_session(user_id: int, db: Session) -> str:
     return session_id
 
 def get_current_user(
+    request: Request,
     session_id: Optional[str] = Cookie(None, alias=settings.SESSION_COOKIE_NAME),
     db: Session = Depends(get_db)
 ) -> User:
     """Get the current authenticated user from session cookie or return default user"""
+    # Reuse the session already resolved by the auth middleware, else the session cache
+    cached = getattr(request.state, "session", None) or resolve_session(db, session_id)
+    if cached is not None:
+        user = db.get(User, cached.user_id)
+        if user:
+            return user
+        drop_session(cached.session_id)
+    
     # If no session, return the first user (demo mode without authentication)
     if not session_id:
         default_user = db.query(User).first()
@@ -56,26 +66,8 @@ def get_current_user(
             db.refresh(default_user)
         return default_user
     
-    session = db.query(SessionModel).filter(
-        SessionModel.session_id == session_id
-    ).first()
-    
-    if not session:
-        # Return default user instead of raising error
-        return db.query(User).first()
-    
-    if session.expires_at < datetime.utcnow():
-        db.delete(session)
-        db.commit()
-        # Return default user instead of raising error
-        return db.query(User).first()
-    
-    user = db.query(User).filter(User.id == session.user_id).first()
-    if not user:
-        # Return default user instead of raising error
-        return db.query(User).first()
-    
-    return user
+    # Unknown, expired or orphaned session: return default user instead of raising error
+    return db.query(User).first()
 
 # Routes
 @router.post("/signup", response_model=AuthResponse, status_code=status.HTTP_201_CREATED)
@@ -181,6 +173,7 @@ def logout(
             
             db.delete(session)
             db.commit()
+        drop_session(session_id)
     
     # Clear cookie
     response.delete_cookie(key=settings.SESSION_COOKIE_NAME)
@@ -198,14 +191,8 @@ def check_auth(
     db: Session = Depends(get_db)
 ):
     """Check if user is authenticated"""
-    if not session_id:
-        return {"authenticated": False}
-    
-    session = db.query(SessionModel).filter(
-        SessionModel.session_id == session_id
-    ).first()
-    
-    if not session or session.expires_at < datetime.utcnow():
+    cached = resolve_session(db, session_id)
+    if cached is None:
         return {"authenticated": False}
     
-    return {"authenticated": True, "user_id": session.user_id}
+    return {"authenticated": True, "user_id": cached.user_id}
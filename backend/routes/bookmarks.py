@@ -6,6 +6,10 @@ from datetime import datetime
 from ..database import get_db
 from ..models import User, Bookmark, Message, DirectMessage
 from ..schemas import BookmarkCreate, BookmarkSchema
+from ..hydration import (
+    hydrate_messages, hydrate_direct_messages, load_channels, load_messages, load_direct_messages
+)
+from ..membership import can_read, is_member
 from .auth import get_current_user
 
 router = APIRouter(prefix="/api/bookmarks", tags=["bookmarks"])
@@ -32,7 +36,7 @@ def create_bookmark(
             raise HTTPException(status_code=404, detail="Message not found")
         
         # Check if user has access to the channel
-        if current_user not in message.channel.members:
+        if not is_member(db, message.channel_id, current_user.id):
             raise HTTPException(status_code=403, detail="No access to this message")
     
     # Check if DM exists (if provided)
@@ -83,7 +87,28 @@ def get_bookmarks(
         Bookmark.user_id == current_user.id
     ).order_by(Bookmark.created_at.desc()).offset(skip).limit(limit).all()
     
-    return bookmarks
+    # Attach the saved messages and DMs in a fixed number of queries
+    messages = load_messages(db, (b.message_id for b in bookmarks))
+    # A message is only previewed while its channel is still readable (the user
+    # may have left or been removed from a private channel since saving it)
+    channels = load_channels(db, (m.channel_id for m in messages.values()))
+    messages = {
+        message_id: m for message_id, m in messages.items()
+        if m.channel_id in channels and can_read(db, channels[m.channel_id], current_user.id)
+    }
+    dms = load_direct_messages(db, (b.direct_message_id for b in bookmarks))
+    hydrated_messages = {
+        m['id']: m for m in hydrate_messages(db, list(messages.values()), include_channel=True)
+    }
+    hydrated_dms = {dm['id']: dm for dm in hydrate_direct_messages(db, list(dms.values()))}
+    
+    return [
+        BookmarkSchema.model_validate(b).model_copy(update={
+            "message_preview": hydrated_messages.get(b.message_id),
+            "direct_message_preview": hydrated_dms.get(b.direct_message_id)
+        })
+        for b in bookmarks
+    ]
 
 
 @router.delete("/{bookmark_id}")
@@ -6,6 +6,7 @@ from datetime import datetime
 from ..database import get_db
 from ..models import User, Canvas, Channel
 from ..schemas import CanvasCreate, CanvasUpdate, CanvasSchema
+from ..membership import is_member
 from .auth import get_current_user
 
 router = APIRouter(prefix="/api/canvas", tags=["canvas"])
@@ -23,7 +24,7 @@ def create_canvas(
         channel = db.query(Channel).filter(Channel.id == canvas_data.channel_id).first()
         if not channel:
             raise HTTPException(status_code=404, detail="Channel not found")
-        if current_user not in channel.members:
+        if not is_member(db, channel.id, current_user.id):
             raise HTTPException(status_code=403, detail="Not a member of this channel")
     # Negative channel_ids represent DMs, no verification needed
     
@@ -76,7 +77,7 @@ def get_canvas(
     if canvas.owner_id != current_user.id and not canvas.is_public:
         if canvas.channel_id:
             channel = db.query(Channel).filter(Channel.id == canvas.channel_id).first()
-            if not channel or current_user not in channel.members:
+            if not channel or not is_member(db, channel.id, current_user.id):
                 raise HTTPException(status_code=403, detail="Access denied")
         else:
             raise HTTPException(status_code=403, detail="Access denied")
@@ -1,12 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import and_
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from .. import schemas, models
 from ..database import get_db
+from ..pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from ..membership import add_member, can_read, is_member, remove_all_members, remove_member
+from ..notification_fanout import FanoutEvent, INVITE, notify_after_commit
 from .auth import get_current_user
+from ..realtime import publish_after_commit, channel_topic, user_topic
+from ..channel_reads import (
+    advance_channel_marker, forget_channel_markers, record_message_sent, start_channel_marker
+)
 
 router = APIRouter(prefix="/api/channels", tags=["channels"])
 
+PRESENCE_VALUES = ("online", "away", "dnd", "offline")
+
 @router.post("", response_model=schemas.Channel, status_code=status.HTTP_201_CREATED)
 def create_channel(
     payload: schemas.ChannelCreate,
@@ -36,6 +46,7 @@ def create_channel(
     
     users = db.query(models.User).filter(models.User.id.in_(member_ids)).all()
     channel.members = users
+    channel.member_count = len(users)
     
     db.add(channel)
     db.commit()
@@ -78,6 +89,38 @@ def get_my_channels(
     
     return channels
 
+@router.get("/unread", response_model=List[schemas.ChannelReadMarker])
+def get_unread_counts(
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Unread and mention counts for every channel the current user is a member of"""
+    # Counters are maintained on write; this reads one marker row per channel
+    rows = db.query(
+        models.channel_members.c.channel_id,
+        models.ChannelReadState.last_read_message_id,
+        models.ChannelReadState.unread_count,
+        models.ChannelReadState.mention_count
+    ).outerjoin(
+        models.ChannelReadState,
+        and_(
+            models.ChannelReadState.user_id == models.channel_members.c.user_id,
+            models.ChannelReadState.channel_id == models.channel_members.c.channel_id
+        )
+    ).filter(
+        models.channel_members.c.user_id == current_user.id
+    ).all()
+    
+    return [
+        schemas.ChannelReadMarker(
+            channel_id=row.channel_id,
+            last_read_message_id=row.last_read_message_id,
+            unread_count=row.unread_count or 0,
+            mention_count=row.mention_count or 0
+        )
+        for row in rows
+    ]
+
 @router.get("/{channel_identifier}", response_model=schemas.Channel)
 def get_channel(
     channel_identifier: str,
@@ -100,13 +143,11 @@ def get_channel(
         )
     
     # Check if user has access to private channel
-    if channel.is_private:
-        is_member = current_user in channel.members
-        if not is_member:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="You don't have access to this private channel"
-            )
+    if not can_read(db, channel, current_user.id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this private channel"
+        )
     
     return channel
 
@@ -180,14 +221,15 @@ def join_channel(
         )
     
     # Check if already a member
-    if current_user in channel.members:
+    if is_member(db, channel.id, current_user.id):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="You are already a member of this channel"
         )
     
-    # Add user to channel
-    channel.members.append(current_user)
+    # Add user to channel; its history starts out read
+    add_member(db, channel_id, current_user.id)
+    start_channel_marker(db, current_user.id, channel_id)
     db.commit()
     db.refresh(channel)
     
@@ -209,14 +251,15 @@ def leave_channel(
         )
     
     # Check if user is a member
-    if current_user not in channel.members:
+    if not is_member(db, channel.id, current_user.id):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="You are not a member of this channel"
         )
     
     # Remove user from channel
-    channel.members.remove(current_user)
+    remove_member(db, channel_id, current_user.id)
+    forget_channel_markers(db, channel_id, current_user.id)
     db.commit()
     
     return None
@@ -244,7 +287,7 @@ def invite_to_channel(
             detail="Only channel creator can invite to private channel"
         )
     
-    if not channel.is_private and current_user not in channel.members:
+    if not channel.is_private and not is_member(db, channel.id, current_user.id):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You must be a member to invite others"
@@ -259,14 +302,15 @@ def invite_to_channel(
         )
     
     # Check if already a member
-    if user_to_invite in channel.members:
+    if is_member(db, channel.id, user_to_invite.id):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="User is already a member of this channel"
         )
     
-    # Add user to channel
-    channel.members.append(user_to_invite)
+    # Add user to channel; its history starts out read
+    add_member(db, channel_id, user_to_invite.id)
+    start_channel_marker(db, user_to_invite.id, channel_id)
     
     # Create system message for channel
     system_message = models.Message(
@@ -277,17 +321,31 @@ def invite_to_channel(
     )
     db.add(system_message)
     
-    # Create activity for invited user
-    activity = models.Activity(
-        user_id=user_to_invite.id,
-        activity_type='invitation',
-        description=f'{current_user.username} invited you to #{channel.name}',
-        target_type='channel',
-        target_id=channel_id,
-        activity_metadata=f'{{"channel_id": {channel_id}, "invited_by": {current_user.id}}}'
-    )
-    db.add(activity)
-    
+    # Notification and activity for the invited user, written after commit
+    notify_after_commit(db, FanoutEvent(
+        notification_type=INVITE,
+        actor_id=current_user.id,
+        title='Channel invitation',
+        message=f'{current_user.username} invited you to #{channel.name}',
+        source_type='channel',
+        source_id=channel_id,
+        data={'channel_id': channel_id, 'invited_by': current_user.id},
+        recipients=(user_to_invite.id,),
+        activity_type='invitation'
+    ))
+    
+    db.flush()
+    record_message_sent(db, system_message)
+    publish_after_commit(db, user_topic(user_to_invite.id), "channel.invited", {
+        "channel_id": channel_id,
+        "channel_name": channel.name,
+        "invited_by": current_user.id
+    })
+    publish_after_commit(db, channel_topic(channel_id), "member.joined", {
+        "channel_id": channel_id,
+        "user_id": user_to_invite.id,
+        "system_message_id": system_message.id
+    })
     db.commit()
     db.refresh(channel)
     
@@ -315,6 +373,8 @@ def delete_channel(
             detail="Only channel creator can delete the channel"
         )
     
+    forget_channel_markers(db, channel_id)
+    remove_all_members(db, channel_id)
     db.delete(channel)
     db.commit()
     
@@ -338,7 +398,7 @@ def update_channel_topic(
         raise HTTPException(status_code=404, detail="Channel not found")
     
     # Check if user is member
-    if current_user not in channel.members:
+    if not is_member(db, channel.id, current_user.id):
         raise HTTPException(status_code=403, detail="Not a member of this channel")
     
     if topic_update.topic is not None:
@@ -366,7 +426,7 @@ def update_channel_section(
         raise HTTPException(status_code=404, detail="Channel not found")
     
     # Check if user is member
-    if current_user not in channel.members:
+    if not is_member(db, channel.id, current_user.id):
         raise HTTPException(status_code=403, detail="Not a member of this channel")
     
     channel.section = section
@@ -400,13 +460,16 @@ def get_channels_by_section(
     
     return sections
 
-@router.get("/{channel_id}/members", response_model=List[schemas.User])
+@router.get("/{channel_id}/members", response_model=schemas.ChannelMemberPage)
 def get_channel_members(
     channel_id: int,
+    presence: Optional[str] = Query(None, description="Only members with this presence: online, away, dnd or offline"),
+    cursor: Optional[int] = Query(None, description="next_cursor of the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get all members of a channel"""
+    """Get a page of channel members, ordered by user id"""
     channel = db.query(models.Channel).filter(models.Channel.id == channel_id).first()
     
     if not channel:
@@ -416,11 +479,79 @@ def get_channel_members(
         )
     
     # Check if user has access to this channel
-    if channel.is_private and current_user not in channel.members:
+    if not can_read(db, channel, current_user.id):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You don't have access to this channel"
         )
     
-    return channel.members
+    if presence is not None and presence not in PRESENCE_VALUES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"presence must be one of {', '.join(PRESENCE_VALUES)}"
+        )
+    
+    # Seek along the channel_members primary key (channel_id, user_id)
+    query = db.query(models.User).join(
+        models.channel_members,
+        models.channel_members.c.user_id == models.User.id
+    ).filter(models.channel_members.c.channel_id == channel_id)
+    if presence is not None:
+        query = query.filter(models.User.presence == presence)
+    if cursor is not None:
+        query = query.filter(models.channel_members.c.user_id > cursor)
+    
+    rows = query.order_by(models.channel_members.c.user_id).limit(limit + 1).all()
+    members = rows[:limit]
+    has_more = len(rows) > limit
+    return schemas.ChannelMemberPage(
+        members=members,
+        member_count=channel.member_count,
+        next_cursor=members[-1].id if has_more else None,
+        has_more=has_more
+    )
+
 
+@router.post("/{channel_id}/read", response_model=schemas.ChannelReadMarker)
+def mark_channel_read(
+    channel_id: int,
+    payload: schemas.MarkReadRequest,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Mark a channel as read up to and including a message"""
+    channel = db.query(models.Channel).filter(models.Channel.id == channel_id).first()
+    
+    if not channel:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Channel not found"
+        )
+    
+    # Check if user has access to this channel
+    if not can_read(db, channel, current_user.id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this channel"
+        )
+    
+    message = db.query(models.Message).filter(
+        models.Message.id == payload.message_id,
+        models.Message.channel_id == channel_id
+    ).first()
+    if not message:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Message not found in this channel"
+        )
+    
+    state = advance_channel_marker(db, current_user.id, channel_id, message)
+    result = schemas.ChannelReadMarker(
+        channel_id=channel_id,
+        last_read_message_id=state.last_read_message_id,
+        unread_count=state.unread_count,
+        mention_count=state.mention_count
+    )
+    db.commit()
+    
+    return result
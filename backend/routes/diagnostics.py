@@ -0,0 +1,68 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ..database import get_db, engine, busy_stats, sqlite_pragmas
+from ..models import User
+from ..config import settings
+from ..write_batcher import write_batcher
+from ..notification_fanout import notification_fanout
+from ..presence import presence_index
+from ..retention import retention_worker
+from ..membership import membership_cache
+from ..search_cache import search_cache
+from ..search_fanout import search_fanout
+from .auth import get_current_user
+
+router = APIRouter(prefix="/api/diagnostics", tags=["diagnostics"])
+
+# Pragmas read back from the live connection, whatever the profile
+REPORTED_PRAGMAS = ["journal_mode", "synchronous", "mmap_size", "cache_size", "temp_store", "busy_timeout"]
+
+
+@router.get("/database")
+def get_database_diagnostics(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Report the database backend, the configured profile and the settings actually in effect"""
+    # Internal details: hidden unless the operator turns them on
+    if not settings.DIAGNOSTICS_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    
+    dialect = engine.dialect.name
+    if dialect != "sqlite":
+        return {
+            "dialect": dialect,
+            "write_batching": write_batcher.stats(),
+            "search_fanout": search_fanout.stats(),
+            "search_cache": search_cache.stats(),
+            "membership_cache": membership_cache.stats(),
+            "notification_fanout": notification_fanout.stats(),
+            "presence_index": presence_index.stats(),
+            "retention": retention_worker.stats()
+        }
+
+    active = {
+        name: db.execute(text(f"PRAGMA {name}")).scalar()
+        for name in REPORTED_PRAGMAS
+    }
+    return {
+        "dialect": dialect,
+        "profile": settings.SQLITE_PROFILE,
+        "configured": sqlite_pragmas(),
+        "active": active,
+        "busy_retry": {
+            "max_retries": settings.SQLITE_BUSY_RETRIES,
+            "backoff_ms": settings.SQLITE_BUSY_BACKOFF_MS,
+            "backoff_max_ms": settings.SQLITE_BUSY_BACKOFF_MAX_MS,
+            **busy_stats
+        },
+        "write_batching": write_batcher.stats(),
+        "search_fanout": search_fanout.stats(),
+        "search_cache": search_cache.stats(),
+        "membership_cache": membership_cache.stats(),
+        "notification_fanout": notification_fanout.stats(),
+        "presence_index": presence_index.stats(),
+        "retention": retention_worker.stats()
+    }
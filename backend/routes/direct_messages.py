@@ -1,6 +1,6 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Query
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import tuple_
 from typing import List, Optional
 import os
 import shutil
@@ -9,13 +9,19 @@ import uuid
 import bleach
 
 from ..database import get_db
-from ..models import DirectMessage, DirectMessageAttachment, User
+from ..models import DirectMessage, DirectMessageAttachment, DMConversation, User, conversation_key
+from ..pagination import keyset_page, cursor_for, encode_cursor, decode_cursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from ..dm_conversations import record_sent, record_deleted, mark_read_up_to, is_read_by, load_receiver_markers
 from ..schemas import (
     DirectMessage as DirectMessageSchema,
     DirectMessageCreate,
-    DirectMessageUpdate
+    DirectMessageUpdate,
+    MarkReadRequest,
+    DMReadMarker
 )
 from .auth import get_current_user
+from ..realtime import publish_after_commit, dm_topic, user_topic
+from ..write_batcher import run_write_async
 
 router = APIRouter(prefix="/api/direct-messages", tags=["direct messages"])
 
@@ -35,6 +41,13 @@ def sanitize_html(html: str) -> str:
     """Sanitize HTML content to prevent XSS attacks"""
     return bleach.clean(html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, strip=True)
 
+def with_read_state(dm: DirectMessage, my_summary, partner_summary, current_user_id: int) -> DirectMessageSchema:
+    """Serialize a DM with is_read derived from the receiver's read marker"""
+    receiver_summary = my_summary if dm.receiver_id == current_user_id else partner_summary
+    return DirectMessageSchema.model_validate(dm).model_copy(
+        update={"is_read": is_read_by(receiver_summary, dm)}
+    )
+
 @router.post("", response_model=DirectMessageSchema, status_code=status.HTTP_201_CREATED)
 async def send_direct_message(
     receiver_id: int = Form(...),
@@ -69,18 +82,8 @@ async def send_direct_message(
         print(f"DM Original HTML: {formatted_content}")
         print(f"DM Sanitized HTML: {sanitized_formatted_content}")
     
-    # Create direct message
-    dm = DirectMessage(
-        sender_id=current_user.id,
-        receiver_id=receiver_id,
-        content=content,
-        formatted_content=sanitized_formatted_content
-    )
-    
-    db.add(dm)
-    db.flush()  # Get DM ID before processing attachments
-    
-    # Handle file uploads
+    # Save uploaded files up front; their rows are written with the message
+    saved_files = []
     if files:
         upload_dir = Path("uploads/direct_messages")
         upload_dir.mkdir(parents=True, exist_ok=True)
@@ -95,29 +98,59 @@ async def send_direct_message(
             with open(file_path, "wb") as buffer:
                 shutil.copyfileobj(file.file, buffer)
             
-            # Create attachment record
-            attachment = DirectMessageAttachment(
-                direct_message_id=dm.id,
-                filename=file.filename,
-                file_path=str(file_path),
-                file_type=file.content_type.split('/')[0] if file.content_type else 'file',
-                file_size=os.path.getsize(file_path),
-                mime_type=file.content_type
-            )
-            db.add(attachment)
+            saved_files.append({
+                'filename': file.filename,
+                'file_path': str(file_path),
+                'file_type': file.content_type.split('/')[0] if file.content_type else 'file',
+                'file_size': os.path.getsize(file_path),
+                'mime_type': file.content_type
+            })
+    
+    sender_id = current_user.id
+    sender_username = current_user.username
     
+    def write_direct_message(write_db: Session) -> dict:
+        # Create direct message
+        dm = DirectMessage(
+            sender_id=sender_id,
+            receiver_id=receiver_id,
+            content=content,
+            formatted_content=sanitized_formatted_content
+        )
+        write_db.add(dm)
+        write_db.flush()  # Get DM ID before adding attachments
+        
+        for saved in saved_files:
+            write_db.add(DirectMessageAttachment(direct_message_id=dm.id, **saved))
+        
+        record_sent(write_db, dm)
+        write_db.flush()
+        return DirectMessageSchema.model_validate(dm).model_dump(mode="json")
+    
+    # Commits the message (batched with other writers when WRITE_BATCHING is on)
+    payload = await run_write_async(db, write_direct_message)
+    
+    publish_after_commit(db, dm_topic(sender_id, receiver_id), "dm.created", payload)
+    publish_after_commit(db, user_topic(receiver_id), "dm.received", {
+        "id": payload["id"],
+        "sender_id": sender_id,
+        "sender_username": sender_username
+    })
     db.commit()
-    db.refresh(dm)
     
-    return DirectMessageSchema.model_validate(dm)
+    return payload
 
-@router.get("/conversation/{user_id}", response_model=List[DirectMessageSchema])
+@router.get("/conversation/{user_id}")
 def get_conversation(
     user_id: int,
+    before: Optional[str] = Query(None, description="Return messages older than this cursor"),
+    after: Optional[str] = Query(None, description="Return messages newer than this cursor"),
+    around: Optional[str] = Query(None, description="Return messages centred on this cursor"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get all direct messages between current user and specified user"""
+    """Get a page of direct messages between current user and specified user (newest page by default)"""
     # Verify other user exists
     other_user = db.query(User).filter(User.id == user_id).first()
     if not other_user:
@@ -126,88 +159,112 @@ def get_conversation(
             detail="User not found"
         )
     
-    # Get all messages between the two users
-    messages = db.query(DirectMessage).filter(
-        or_(
-            and_(
-                DirectMessage.sender_id == current_user.id,
-                DirectMessage.receiver_id == user_id
-            ),
-            and_(
-                DirectMessage.sender_id == user_id,
-                DirectMessage.receiver_id == current_user.id
-            )
+    key = conversation_key(current_user.id, user_id)
+    query = db.query(DirectMessage).filter(DirectMessage.conversation_key == key)
+    messages, has_older, has_newer = keyset_page(
+        query,
+        DirectMessage.timestamp,
+        DirectMessage.id,
+        limit,
+        before=before,
+        after=after,
+        around=around
+    )
+    
+    # Reading the newest page marks the conversation read up to its last message
+    my_summary = db.get(DMConversation, (current_user.id, user_id))
+    partner_summary = db.get(DMConversation, (user_id, current_user.id))
+    if messages and not has_newer:
+        mark_read_up_to(db, current_user.id, user_id, messages[-1])
+    
+    page = [with_read_state(msg, my_summary, partner_summary, current_user.id) for msg in messages]
+    cursors = (
+        cursor_for(messages[0]) if messages and has_older else None,
+        cursor_for(messages[-1]) if messages and has_newer else None
+    )
+    db.commit()
+    
+    return {
+        'messages': page,
+        # Pass prev_cursor as `before` to scroll back, next_cursor as `after` to scroll forward
+        'prev_cursor': cursors[0],
+        'next_cursor': cursors[1],
+        'has_more_before': has_older,
+        'has_more_after': has_newer
+    }
+
+@router.post("/conversation/{user_id}/read", response_model=DMReadMarker)
+def mark_conversation_read(
+    user_id: int,
+    payload: MarkReadRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Mark the conversation with a user as read up to and including a message"""
+    dm = db.query(DirectMessage).filter(
+        DirectMessage.id == payload.message_id,
+        DirectMessage.conversation_key == conversation_key(current_user.id, user_id)
+    ).first()
+    if not dm:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Direct message not found in this conversation"
         )
-    ).order_by(DirectMessage.timestamp).all()
     
-    # Mark received messages as read
-    for msg in messages:
-        if msg.receiver_id == current_user.id and not msg.is_read:
-            msg.is_read = True
+    summary = mark_read_up_to(db, current_user.id, user_id, dm)
+    result = DMReadMarker(
+        user_id=user_id,
+        last_read_message_id=summary.last_read_message_id if summary else None,
+        unread_count=summary.unread_count if summary else 0
+    )
     db.commit()
     
-    return [DirectMessageSchema.model_validate(msg) for msg in messages]
+    return result
 
 @router.get("/conversations", response_model=List[dict])
 def get_all_conversations(
+    before: Optional[str] = Query(None, description="Return conversations older than this cursor"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get list of all users current user has DM conversations with"""
-    # Get all unique users involved in DMs with current user
-    sent_to = db.query(DirectMessage.receiver_id).filter(
-        DirectMessage.sender_id == current_user.id
-    ).distinct().all()
-    
-    received_from = db.query(DirectMessage.sender_id).filter(
-        DirectMessage.receiver_id == current_user.id
-    ).distinct().all()
-    
-    # Combine and get unique user IDs
-    user_ids = set([u[0] for u in sent_to] + [u[0] for u in received_from])
-    
-    # Get user details and last message for each conversation
-    conversations = []
-    for user_id in user_ids:
-        user = db.query(User).filter(User.id == user_id).first()
-        if user:
-            # Get last message in conversation
-            last_message = db.query(DirectMessage).filter(
-                or_(
-                    and_(
-                        DirectMessage.sender_id == current_user.id,
-                        DirectMessage.receiver_id == user_id
-                    ),
-                    and_(
-                        DirectMessage.sender_id == user_id,
-                        DirectMessage.receiver_id == current_user.id
-                    )
-                )
-            ).order_by(DirectMessage.timestamp.desc()).first()
-            
-            # Count unread messages
-            unread_count = db.query(DirectMessage).filter(
-                DirectMessage.sender_id == user_id,
-                DirectMessage.receiver_id == current_user.id,
-                DirectMessage.is_read == False
-            ).count()
-            
-            conversations.append({
-                "user_id": user.id,
-                "username": user.username,
-                "profile_picture": user.profile_picture,
-                "status": user.status,
-                "last_message": DirectMessageSchema.model_validate(last_message) if last_message else None,
-                "unread_count": unread_count
-            })
-    
-    # Sort by last message timestamp
-    conversations.sort(
-        key=lambda x: x["last_message"].timestamp if x["last_message"] else "",
-        reverse=True
+    """
+    Get the current user's DM conversations, most recent first. Pass the
+    `cursor` of the last item as `before` to fetch the next page.
+    """
+    query = db.query(DMConversation, User, DirectMessage).join(
+        User, User.id == DMConversation.partner_id
+    ).outerjoin(
+        DirectMessage, DirectMessage.id == DMConversation.last_message_id
+    ).options(
+        selectinload(DirectMessage.dm_attachments)
+    ).filter(
+        DMConversation.user_id == current_user.id
     )
-    
-    return conversations
+    if before is not None:
+        last_at, partner_id = decode_cursor(before)
+        query = query.filter(
+            tuple_(DMConversation.last_message_at, DMConversation.partner_id) < (last_at, partner_id)
+        )
+    rows = query.order_by(
+        DMConversation.last_message_at.desc(),
+        DMConversation.partner_id.desc()
+    ).limit(limit).all()
+    
+    # is_read of each last message comes from its receiver's read marker
+    markers = load_receiver_markers(db, [last_message for _, _, last_message in rows if last_message])
+    
+    return [{
+        "user_id": user.id,
+        "username": user.username,
+        "profile_picture": user.profile_picture,
+        "status": user.status,
+        "last_message": DirectMessageSchema.model_validate(last_message).model_copy(update={
+            "is_read": is_read_by(markers.get((last_message.receiver_id, last_message.sender_id)), last_message)
+        }) if last_message else None,
+        "unread_count": summary.unread_count,
+        "cursor": encode_cursor(summary.last_message_at, summary.partner_id) if summary.last_message_at else None
+    } for summary, user, last_message in rows]
 
 @router.put("/{message_id}", response_model=DirectMessageSchema)
 def update_direct_message(
@@ -273,6 +330,7 @@ def delete_direct_message(
             detail="You can only delete your own messages"
         )
     
+    record_deleted(db, dm)
     db.delete(dm)
     db.commit()
     
@@ -300,8 +358,8 @@ def mark_as_read(
             detail="You can only mark messages sent to you as read"
         )
     
-    dm.is_read = True
+    mark_read_up_to(db, current_user.id, dm.sender_id, dm)
+    result = DirectMessageSchema.model_validate(dm).model_copy(update={"is_read": True})
     db.commit()
-    db.refresh(dm)
     
-    return DirectMessageSchema.model_validate(dm)
+    return result
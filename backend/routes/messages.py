@@ -1,8 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Query
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from .. import schemas, models
 from ..database import get_db
+from ..pagination import keyset_page, cursor_for, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from ..hydration import hydrate_messages, serialize_user
+from ..realtime import publish_after_commit, channel_topic
+from ..write_batcher import run_write, run_write_async
+from ..channel_reads import message_mentions, record_mentions_changed, record_message_deleted, record_message_sent
+from ..membership import can_read, is_member
+from ..mentions import resolve_mentions
+from ..notification_fanout import FanoutEvent, MENTION, REACTION, THREAD_REPLY, notify_after_commit
 from .auth import get_current_user
 import os
 import shutil
@@ -50,7 +58,7 @@ async def send_message(
         )
     
     # Verify user is a member of the channel
-    if current_user not in channel.members:
+    if not is_member(db, channel.id, current_user.id):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You must be a member of the channel to send messages"
@@ -63,17 +71,8 @@ async def send_message(
         print(f"Original HTML: {formatted_content}")
         print(f"Sanitized HTML: {sanitized_formatted_content}")
     
-    # Create message (use current_user.id instead of payload.user_id for security)
-    msg = models.Message(
-        channel_id=channel_id,
-        user_id=current_user.id,
-        content=content,
-        formatted_content=sanitized_formatted_content
-    )
-    db.add(msg)
-    db.flush()  # Get message ID before processing attachments
-    
-    # Handle file uploads
+    # Save uploaded files up front; their rows are written with the message
+    saved_files = []
     if files:
         upload_dir = Path("uploads/messages")
         upload_dir.mkdir(parents=True, exist_ok=True)
@@ -88,72 +87,99 @@ async def send_message(
             with open(file_path, "wb") as buffer:
                 shutil.copyfileobj(file.file, buffer)
             
-            # Create attachment record
-            attachment = models.Attachment(
-                message_id=msg.id,
-                filename=file.filename,
-                file_path=str(file_path),
-                file_type=file.content_type.split('/')[0] if file.content_type else 'file',
-                file_size=os.path.getsize(file_path),
-                mime_type=file.content_type
-            )
-            db.add(attachment)
-    
-    # Extract mentions from formatted content and create activities
-    if formatted_content:
-        import re
-        # Find all mentions in format <span class="mention" data-user-id="123">@username</span>
-        mention_pattern = r'data-user-id="(\d+)"'
-        mentioned_user_ids = re.findall(mention_pattern, formatted_content)
+            saved_files.append({
+                'filename': file.filename,
+                'file_path': str(file_path),
+                'file_type': file.content_type.split('/')[0] if file.content_type else 'file',
+                'file_size': os.path.getsize(file_path),
+                'mime_type': file.content_type
+            })
+    
+    # Mentioned users: <span data-user-id="123"> in the formatted content,
+    # members of @handle user groups and, for @here, members online right now;
+    # @channel is kept as a flag and expanded in SQL
+    mentions = resolve_mentions(db, channel, content, formatted_content)
+    mentioned_user_ids = mentions.user_ids
+    
+    sender_id = current_user.id
+    sender_username = current_user.username
+    sender_profile = serialize_user(current_user)
+    channel_name = channel.name
+    
+    def write_message(write_db: Session) -> dict:
+        # Create message (use current_user.id instead of payload.user_id for security)
+        msg = models.Message(
+            channel_id=channel_id,
+            user_id=sender_id,
+            content=content,
+            formatted_content=sanitized_formatted_content,
+            mentions=json.dumps(mentioned_user_ids) if mentioned_user_ids else None,
+            mentions_channel=mentions.channel
+        )
+        write_db.add(msg)
+        write_db.flush()  # Get message ID before adding attachments and activities
         
-        for user_id_str in mentioned_user_ids:
-            mentioned_user_id = int(user_id_str)
-            # Don't create activity if user mentions themselves
-            if mentioned_user_id != current_user.id:
-                # Create activity for mentioned user
-                activity = models.Activity(
-                    user_id=mentioned_user_id,
-                    activity_type='mention',
-                    description=f'{current_user.username} mentioned you in #{channel.name}',
-                    target_type='message',
-                    target_id=msg.id,
-                    activity_metadata=f'{{"channel_id": {channel_id}, "message_id": {msg.id}}}'
-                )
-                db.add(activity)
+        # Unread and mention badges of the other channel members
+        record_message_sent(write_db, msg, mentioned_user_ids)
+        
+        for saved in saved_files:
+            write_db.add(models.Attachment(message_id=msg.id, **saved))
+        
+        if mentioned_user_ids or mentions.channel:
+            # Notifications and Activity rows are written by the fan-out worker after commit
+            notify_after_commit(write_db, FanoutEvent(
+                notification_type=MENTION,
+                actor_id=sender_id,
+                title='New mention',
+                message=f'{sender_username} mentioned you in #{channel_name}',
+                source_type='message',
+                source_id=msg.id,
+                data={'channel_id': channel_id, 'message_id': msg.id},
+                recipients=tuple(mentioned_user_ids),
+                channel_id=channel_id if mentions.channel else None,
+                activity_type='mention'
+            ))
+        
+        write_db.flush()
+        return {
+            'id': msg.id,
+            'channel_id': msg.channel_id,
+            'user_id': msg.user_id,
+            'content': msg.content,
+            'timestamp': msg.timestamp.isoformat() if msg.timestamp else None,
+            'edited_at': msg.edited_at.isoformat() if msg.edited_at else None,
+            'is_deleted': msg.is_deleted,
+            'is_system_message': msg.is_system_message,
+            'formatted_content': msg.formatted_content,
+            'formatting': msg.formatting,
+            'mentions': msg.mentions,
+            'mentions_channel': msg.mentions_channel
+        }
     
-    db.commit()
-    db.refresh(msg)
+    # Commits the message (batched with other writers when WRITE_BATCHING is on)
+    payload = await run_write_async(db, write_message)
     
-    # Return message with user info
-    return {
-        'id': msg.id,
-        'channel_id': msg.channel_id,
-        'user_id': msg.user_id,
-        'content': msg.content,
-        'timestamp': msg.timestamp.isoformat() if msg.timestamp else None,
-        'edited_at': msg.edited_at.isoformat() if msg.edited_at else None,
-        'is_deleted': msg.is_deleted,
-        'is_system_message': msg.is_system_message,
-        'formatted_content': msg.formatted_content,
-        'formatting': msg.formatting,
-        'mentions': msg.mentions,
+    # Message with user info, returned to the sender and broadcast to the channel
+    payload.update({
         'attachments': [],
-        'user': {
-            'id': current_user.id,
-            'username': current_user.username,
-            'full_name': current_user.full_name,
-            'name': current_user.full_name or current_user.username,
-            'profile_picture': current_user.profile_picture
-        }
-    }
+        'user': sender_profile
+    })
+    publish_after_commit(db, channel_topic(channel_id), "message.created", payload)
+    db.commit()
+    
+    return payload
 
 @router.get("/channel/{channel_id}")
 def get_messages(
     channel_id: int,
+    before: Optional[str] = Query(None, description="Return messages older than this cursor"),
+    after: Optional[str] = Query(None, description="Return messages newer than this cursor"),
+    around: Optional[str] = Query(None, description="Return messages centred on this cursor"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get all messages in a channel"""
+    """Get a page of messages in a channel (newest page by default)"""
     # Verify channel exists
     channel = db.query(models.Channel).filter(models.Channel.id == channel_id).first()
     if not channel:
@@ -163,48 +189,34 @@ def get_messages(
         )
     
     # Verify user has access to channel
-    if channel.is_private and current_user not in channel.members:
+    if not can_read(db, channel, current_user.id):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You don't have access to this channel"
         )
     
-    msgs = db.query(models.Message).filter(
-        models.Message.channel_id == channel_id
-    ).order_by(models.Message.timestamp.asc()).all()
+    query = db.query(models.Message).filter(models.Message.channel_id == channel_id)
+    msgs, has_older, has_newer = keyset_page(
+        query,
+        models.Message.timestamp,
+        models.Message.id,
+        limit,
+        before=before,
+        after=after,
+        around=around
+    )
     
-    # Add user information to each message
-    result = []
-    for msg in msgs:
-        # Fetch user details
-        user = db.query(models.User).filter(models.User.id == msg.user_id).first()
-        msg_dict = {
-            'id': msg.id,
-            'channel_id': msg.channel_id,
-            'user_id': msg.user_id,
-            'content': msg.content,
-            'timestamp': msg.timestamp.isoformat() if msg.timestamp else None,
-            'edited_at': msg.edited_at.isoformat() if msg.edited_at else None,
-            'is_deleted': msg.is_deleted,
-            'is_system_message': msg.is_system_message,
-            'formatted_content': msg.formatted_content,
-            'formatting': msg.formatting,
-            'mentions': msg.mentions,
-            'attachments': [],
-            'user': None
-        }
-        
-        if user:
-            msg_dict['user'] = {
-                'id': user.id,
-                'username': user.username,
-                'full_name': user.full_name,
-                'name': user.full_name or user.username,
-                'profile_picture': user.profile_picture
-            }
-        result.append(msg_dict)
-    
-    return result
+    # Resolve authors, attachments, reactions and thread counts for the whole page at once
+    result = hydrate_messages(db, msgs)
+    
+    return {
+        'messages': result,
+        # Pass prev_cursor as `before` to scroll back, next_cursor as `after` to scroll forward
+        'prev_cursor': cursor_for(msgs[0]) if msgs and has_older else None,
+        'next_cursor': cursor_for(msgs[-1]) if msgs and has_newer else None,
+        'has_more_before': has_older,
+        'has_more_after': has_newer
+    }
 
 @router.put("/{message_id}", response_model=schemas.Message)
 def update_message(
@@ -241,8 +253,11 @@ def update_message(
     
     # Update mentions if provided
     if update_data.mentions is not None:
+        previous_mentions = message_mentions(msg)
         msg.mentions = json.dumps(update_data.mentions)
+        record_mentions_changed(db, msg, previous_mentions)
     
+    publish_after_commit(db, channel_topic(msg.channel_id), "message.updated", hydrate_messages(db, [msg])[0])
     db.commit()
     db.refresh(msg)
     
@@ -270,6 +285,11 @@ def delete_message(
             detail="You can only delete your own messages"
         )
     
+    publish_after_commit(db, channel_topic(msg.channel_id), "message.deleted", {
+        'id': msg.id,
+        'channel_id': msg.channel_id
+    })
+    record_message_deleted(db, msg)
     db.delete(msg)
     db.commit()
     
@@ -295,7 +315,7 @@ def create_thread(
     
     # Verify user has access to the channel
     channel = parent_msg.channel
-    if channel.is_private and current_user not in channel.members:
+    if not can_read(db, channel, current_user.id):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You don't have access to this channel"
@@ -309,6 +329,22 @@ def create_thread(
     )
     
     db.add(thread)
+    db.flush()
+    publish_after_commit(
+        db, channel_topic(channel.id), "thread.created",
+        schemas.Thread.model_validate(thread).model_dump(mode="json")
+    )
+    # The parent's author and everyone already in the thread
+    notify_after_commit(db, FanoutEvent(
+        notification_type=THREAD_REPLY,
+        actor_id=current_user.id,
+        title='New reply',
+        message=f'{current_user.username} replied to a thread in #{channel.name}',
+        source_type='message',
+        source_id=message_id,
+        data={'channel_id': channel.id, 'message_id': message_id, 'thread_id': thread.id},
+        thread_of=message_id
+    ))
     db.commit()
     db.refresh(thread)
     
@@ -331,7 +367,7 @@ def get_threads(
     
     # Verify user has access to the channel
     channel = parent_msg.channel
-    if channel.is_private and current_user not in channel.members:
+    if not can_read(db, channel, current_user.id):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You don't have access to this channel"
@@ -419,7 +455,7 @@ def add_reaction(
     
     # Verify user has access to the channel
     channel = msg.channel
-    if channel.is_private and current_user not in channel.members:
+    if not can_read(db, channel, current_user.id):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You don't have access to this channel"
@@ -438,16 +474,37 @@ def add_reaction(
             detail="You already reacted with this emoji"
         )
     
-    # Create reaction
-    reaction = models.Reaction(
-        message_id=message_id,
-        user_id=current_user.id,
-        emoji=reaction_data.emoji
-    )
-    
-    db.add(reaction)
+    user_id = current_user.id
+    username = current_user.username
+    author_id = msg.user_id
+    channel_id = channel.id
+    channel_name = channel.name
+    
+    def write_reaction(write_db: Session) -> dict:
+        # Create reaction
+        reaction = models.Reaction(
+            message_id=message_id,
+            user_id=user_id,
+            emoji=reaction_data.emoji
+        )
+        write_db.add(reaction)
+        write_db.flush()
+        notify_after_commit(write_db, FanoutEvent(
+            notification_type=REACTION,
+            actor_id=user_id,
+            title='New reaction',
+            message=f'{username} reacted {reaction_data.emoji} to your message in #{channel_name}',
+            source_type='message',
+            source_id=message_id,
+            data={'channel_id': channel_id, 'message_id': message_id, 'emoji': reaction_data.emoji},
+            recipients=(author_id,)
+        ))
+        return schemas.Reaction.model_validate(reaction).model_dump(mode="json")
+    
+    # Commits the reaction (batched with other writers when WRITE_BATCHING is on)
+    reaction = run_write(db, write_reaction)
+    publish_after_commit(db, channel_topic(channel.id), "reaction.added", reaction)
     db.commit()
-    db.refresh(reaction)
     
     return reaction
 
@@ -463,7 +520,7 @@ def get_reactions(
     if msg:
         # Verify user has access to the channel
         channel = msg.channel
-        if channel.is_private and current_user not in channel.members:
+        if not can_read(db, channel, current_user.id):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="You don't have access to this channel"
@@ -514,6 +571,13 @@ def remove_reaction(
             detail="You can only remove your own reactions"
         )
     
+    if reaction.message:
+        publish_after_commit(db, channel_topic(reaction.message.channel_id), "reaction.removed", {
+            'id': reaction.id,
+            'message_id': reaction.message_id,
+            'user_id': reaction.user_id,
+            'emoji': reaction.emoji
+        })
     db.delete(reaction)
     db.commit()
     
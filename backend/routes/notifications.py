@@ -7,6 +7,7 @@ import json
 from ..database import get_db
 from ..models import User, Notification
 from ..schemas import NotificationSchema
+from ..write_batcher import run_write
 from .auth import get_current_user
 
 router = APIRouter(prefix="/api/notifications", tags=["notifications"])
@@ -26,7 +27,8 @@ def get_notifications(
     if unread_only:
         query = query.filter(Notification.is_read == False)
     
-    notifications = query.order_by(Notification.created_at.desc()).offset(skip).limit(limit).all()
+    # Coalesced rows move up as new events fold into them
+    notifications = query.order_by(Notification.updated_at.desc()).offset(skip).limit(limit).all()
     return notifications
 
 
@@ -130,16 +132,20 @@ def create_notification(
     data: dict = None
 ):
     """Helper function to create a notification"""
-    notification = Notification(
-        user_id=user_id,
-        notification_type=notification_type,
-        title=title,
-        message=message,
-        source_type=source_type,
-        source_id=source_id,
-        data=json.dumps(data) if data else None
-    )
-    db.add(notification)
-    db.commit()
-    db.refresh(notification)
-    return notification
+    def write_notification(write_db: Session) -> int:
+        notification = Notification(
+            user_id=user_id,
+            notification_type=notification_type,
+            title=title,
+            message=message,
+            source_type=source_type,
+            source_id=source_id,
+            data=json.dumps(data) if data else None
+        )
+        write_db.add(notification)
+        write_db.flush()
+        return notification.id
+    
+    # Commits the notification (batched with other writers when WRITE_BATCHING is on)
+    notification_id = run_write(db, write_notification)
+    return db.get(Notification, notification_id)
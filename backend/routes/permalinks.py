@@ -5,6 +5,8 @@ import uuid
 from ..database import get_db
 from ..models import User, Permalink, Message, DirectMessage
 from ..schemas import PermalinkCreate, PermalinkSchema
+from ..hydration import load_user_profiles
+from ..membership import is_member
 from .auth import get_current_user
 
 router = APIRouter(prefix="/api/permalinks", tags=["permalinks"])
@@ -83,7 +85,7 @@ def get_by_permalink(
             raise HTTPException(status_code=404, detail="Message not found")
         
         # Check if user has access to channel
-        if current_user not in message.channel.members:
+        if not is_member(db, message.channel_id, current_user.id):
             raise HTTPException(status_code=403, detail="No access to this channel")
         
         return {
@@ -92,6 +94,7 @@ def get_by_permalink(
             "channel_id": message.channel_id,
             "channel_name": message.channel.name,
             "user_id": message.user_id,
+            "user": load_user_profiles(db, [message.user_id]).get(message.user_id),
             "content": message.content,
             "timestamp": message.timestamp,
             "permalink": permalink_str
@@ -111,6 +114,7 @@ def get_by_permalink(
             "id": dm.id,
             "sender_id": dm.sender_id,
             "receiver_id": dm.receiver_id,
+            "sender": load_user_profiles(db, [dm.sender_id]).get(dm.sender_id),
             "content": dm.content,
             "timestamp": dm.timestamp,
             "permalink": permalink_str
@@ -6,6 +6,9 @@ from datetime import datetime
 from ..database import get_db
 from ..models import User, PinnedMessage, Message, Channel
 from ..schemas import PinnedMessageCreate, PinnedMessageSchema
+from ..hydration import hydrate_messages, load_messages
+from ..realtime import publish_after_commit, channel_topic
+from ..membership import is_member
 from .auth import get_current_user
 
 router = APIRouter(prefix="/api/pins", tags=["pins"])
@@ -25,7 +28,7 @@ def pin_message(
         raise HTTPException(status_code=404, detail="Channel not found")
     
     # Check if user is member of channel
-    if current_user not in channel.members:
+    if not is_member(db, channel.id, current_user.id):
         raise HTTPException(status_code=403, detail="Not a member of this channel")
     
     # Check if message exists and belongs to channel
@@ -51,6 +54,11 @@ def pin_message(
         pinned_by=current_user.id
     )
     db.add(pinned_message)
+    db.flush()
+    publish_after_commit(
+        db, channel_topic(channel_id), "pin.added",
+        PinnedMessageSchema.model_validate(pinned_message).model_dump(mode="json")
+    )
     db.commit()
     db.refresh(pinned_message)
     
@@ -70,14 +78,23 @@ def get_pinned_messages(
         raise HTTPException(status_code=404, detail="Channel not found")
     
     # Check if user is member of channel
-    if current_user not in channel.members:
+    if not is_member(db, channel.id, current_user.id):
         raise HTTPException(status_code=403, detail="Not a member of this channel")
     
     pins = db.query(PinnedMessage).filter(
         PinnedMessage.channel_id == channel_id
     ).order_by(PinnedMessage.pinned_at.desc()).all()
     
-    return pins
+    # Attach the pinned messages (with authors) in a fixed number of queries
+    messages = load_messages(db, (pin.message_id for pin in pins))
+    hydrated = {m['id']: m for m in hydrate_messages(db, list(messages.values()))}
+    
+    return [
+        PinnedMessageSchema.model_validate(pin).model_copy(
+            update={"message_preview": hydrated.get(pin.message_id)}
+        )
+        for pin in pins
+    ]
 
 
 @router.delete("/channels/{channel_id}/messages/{message_id}")
@@ -94,7 +111,7 @@ def unpin_message(
         raise HTTPException(status_code=404, detail="Channel not found")
     
     # Check if user is member of channel
-    if current_user not in channel.members:
+    if not is_member(db, channel.id, current_user.id):
         raise HTTPException(status_code=403, detail="Not a member of this channel")
     
     # Find the pin
@@ -110,6 +127,10 @@ def unpin_message(
     if channel.created_by != current_user.id and pin.pinned_by != current_user.id:
         raise HTTPException(status_code=403, detail="Only channel creator or pin creator can unpin messages")
     
+    publish_after_commit(db, channel_topic(channel_id), "pin.removed", {
+        "message_id": message_id,
+        "channel_id": channel_id
+    })
     db.delete(pin)
     db.commit()
     
@@ -0,0 +1,109 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional, Tuple
+
+from ..database import SessionLocal
+from ..models import Channel, channel_members
+from ..membership import can_read
+from ..session_cache import resolve_session
+from ..config import settings
+from ..realtime import hub, channel_topic, user_topic, PRESENCE_TOPIC
+
+router = APIRouter(tags=["realtime"])
+
+
+def resolve_connection(session_id: Optional[str]) -> Optional[Tuple[int, List[int]]]:
+    """Resolve the session cookie to (user_id, member channel ids)"""
+    if not session_id:
+        return None
+
+    db = SessionLocal()
+    try:
+        cached = resolve_session(db, session_id)
+        if cached is None:
+            return None
+
+        channel_ids = [
+            row.channel_id for row in db.query(channel_members.c.channel_id).filter(
+                channel_members.c.user_id == cached.user_id
+            ).all()
+        ]
+        return cached.user_id, channel_ids
+    finally:
+        db.close()
+
+
+def can_subscribe(user_id: int, topic: str) -> bool:
+    """Check whether a user may listen on a topic"""
+    if topic == PRESENCE_TOPIC:
+        return True
+
+    kind, _, rest = topic.partition(":")
+    if kind == "user":
+        return rest == str(user_id)
+
+    if kind == "dm":
+        parts = rest.split(":")
+        return len(parts) == 2 and all(p.isdigit() for p in parts) and str(user_id) in parts
+
+    if kind == "channel" and rest.isdigit():
+        db = SessionLocal()
+        try:
+            channel = db.query(Channel).filter(Channel.id == int(rest)).first()
+            return channel is not None and can_read(db, channel, user_id)
+        finally:
+            db.close()
+
+    return False
+
+
+@router.websocket("/ws")
+async def websocket_gateway(websocket: WebSocket):
+    """
+    Real-time event stream.
+
+    On connect the client is subscribed to its own inbox, presence and every
+    channel it belongs to. It may then send
+    ``{"action": "subscribe" | "unsubscribe", "topic": "..."}`` or
+    ``{"action": "ping"}``.
+    """
+    resolved = await run_in_threadpool(
+        resolve_connection, websocket.cookies.get(settings.SESSION_COOKIE_NAME)
+    )
+    if not resolved:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    user_id, channel_ids = resolved
+    await websocket.accept()
+    conn = await hub.connect(websocket, user_id)
+
+    hub.subscribe(conn, user_topic(user_id))
+    hub.subscribe(conn, PRESENCE_TOPIC)
+    for channel_id in channel_ids:
+        hub.subscribe(conn, channel_topic(channel_id))
+    hub.send(conn, "ready", {"user_id": user_id, "topics": sorted(conn.topics)})
+
+    try:
+        while True:
+            message = await websocket.receive_json()
+            action = message.get("action") if isinstance(message, dict) else None
+            topic = message.get("topic") if isinstance(message, dict) else None
+
+            if action == "ping":
+                hub.send(conn, "pong", {})
+            elif action == "subscribe" and isinstance(topic, str):
+                if await run_in_threadpool(can_subscribe, user_id, topic):
+                    hub.subscribe(conn, topic)
+                    hub.send(conn, "subscribed", {"topic": topic})
+                else:
+                    hub.send(conn, "error", {"topic": topic, "detail": "Not allowed to subscribe"})
+            elif action == "unsubscribe" and isinstance(topic, str):
+                hub.unsubscribe(conn, topic)
+                hub.send(conn, "unsubscribed", {"topic": topic})
+            else:
+                hub.send(conn, "error", {"detail": "Unknown action"})
+    except (WebSocketDisconnect, RuntimeError, ValueError):
+        pass
+    finally:
+        await hub.disconnect(conn)
@@ -6,6 +6,7 @@ from datetime import datetime
 from ..database import get_db
 from ..models import User, ScheduledMessage, Channel
 from ..schemas import ScheduledMessageCreate, ScheduledMessageUpdate, ScheduledMessageSchema
+from ..membership import is_member
 from .auth import get_current_user
 
 router = APIRouter(prefix="/api/scheduled", tags=["scheduled-messages"])
@@ -34,7 +35,7 @@ def schedule_message(
         channel = db.query(Channel).filter(Channel.id == message_data.channel_id).first()
         if not channel:
             raise HTTPException(status_code=404, detail="Channel not found")
-        if current_user not in channel.members:
+        if not is_member(db, channel.id, current_user.id):
             raise HTTPException(status_code=403, detail="Not a member of this channel")
     
     # Create scheduled message
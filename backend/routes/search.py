@@ -1,41 +1,68 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 from sqlalchemy import or_, and_
 from typing import List, Optional
 
+from ..config import settings
 from ..database import get_db
-from ..models import User, Channel, Message, DirectMessage
-from ..schemas import SearchResponse, SearchResult
+from ..models import User, Channel, Message, DirectMessage, channel_members, conversation_key
+from ..schemas import SearchResponse, SearchResult, TypeaheadMatch
+from ..hydration import load_channels, load_user_profiles
+from ..search_index import search_text
+from ..search_cache import channel_set_digest, search_cache
+from ..search_fanout import Category, search_fanout
+from ..search_query import (
+    SORT_RECENT, SORT_RELEVANCE, fetch_ranked, merge_ranked, message_filters, normalize_query, parse_query
+)
+from ..typeahead import CHANNEL, KINDS, USER, USER_GROUP, in_rank_order, typeahead_index
+from ..membership import is_member
 from .auth import get_current_user
 
 router = APIRouter(prefix="/api/search", tags=["search"])
 
+# Position of each table in the merged message stream (see search_query.merge_ranked)
+MESSAGE_KIND = 1
+DIRECT_MESSAGE_KIND = 0
+
 @router.get("", response_model=SearchResponse)
 def search(
-    q: str = Query(..., min_length=1, description="Search query"),
+    q: str = Query(..., min_length=1, description="Search query; supports from:, in:, before:, after:, during:, has: and is:"),
     search_type: str = Query("all", description="Type: all, messages, channels, users"),
+    sort: Optional[str] = Query(None, description="relevance or recent (default: relevance when there is search text)"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
     limit: int = Query(50, ge=1, le=100),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
-    Universal search across messages, channels, and users
+    Universal search across messages, channels, and users. Categories are
+    searched concurrently; one that runs out of time is left out and listed
+    in `timed_out` (with `partial` set) instead of failing the request.
     """
-    results = []
+    parsed = parse_query(q)
+    if sort is None:
+        sort = SORT_RELEVANCE if parsed.terms else SORT_RECENT
+    if sort not in (SORT_RELEVANCE, SORT_RECENT):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="sort must be relevance or recent"
+        )
     
-    # Search Users
-    if search_type in ["all", "users"]:
-        search_term = f"%{q}%"
-        users = db.query(User).filter(
-            or_(
-                User.username.ilike(search_term),
-                User.email.ilike(search_term),
-                User.name.ilike(search_term) if User.name else False
-            )
-        ).limit(limit).all()
+    # Users and channels only match on free text and are listed on the first page
+    first_page = cursor is None and bool(parsed.terms) and not parsed.modifiers
+    user_channel_ids = [c.id for c in current_user.channels]
+    
+    # Each category runs concurrently on its own session (see search_fanout)
+    categories = []
+    
+    if search_type in ["all", "users"] and first_page:
+        users_limit = limit if search_type == "users" else min(limit, settings.SEARCH_USERS_LIMIT)
         
-        for user in users:
-            results.append(SearchResult(
+        def search_users(session):
+            # Best matches first, and only as many ids as the page shows
+            user_ids = typeahead_index.substring_ids(USER, parsed.text, limit=users_limit)
+            users = in_rank_order(session.query(User).filter(User.id.in_(user_ids)).all(), user_ids)
+            return [SearchResult(
                 result_type="user",
                 id=user.id,
                 content={
@@ -44,97 +71,196 @@ def search(
                     "profile_picture": user.profile_picture,
                     "status": user.status
                 }
-            ))
-    
-    # Search Channels
-    if search_type in ["all", "channels"]:
-        search_term = f"%{q}%"
-        channels_query = db.query(Channel).filter(
-            or_(
-                Channel.name.ilike(search_term),
-                Channel.description.ilike(search_term)
-            )
-        )
+            ) for user in users]
         
-        # Filter out private channels user doesn't have access to
-        channels = []
-        for channel in channels_query.limit(limit).all():
-            if not channel.is_private or current_user in channel.members:
-                channels.append(channel)
+        categories.append(Category("users", search_users, settings.SEARCH_DIRECTORY_TIMEOUT_MS))
+    
+    if search_type in ["all", "channels"] and first_page:
+        channels_limit = limit if search_type == "channels" else min(limit, settings.SEARCH_CHANNELS_LIMIT)
         
-        for channel in channels:
-            results.append(SearchResult(
+        def search_channels(session):
+            # Private channels only for their members
+            member_of = set(user_channel_ids)
+            channel_ids = typeahead_index.substring_ids(
+                CHANNEL, parsed.text, accept=lambda entry: not entry.is_private or entry.id in member_of,
+                limit=channels_limit
+            )
+            channels = in_rank_order(session.query(Channel).filter(Channel.id.in_(channel_ids)).all(), channel_ids)
+            return [SearchResult(
                 result_type="channel",
                 id=channel.id,
                 content={
                     "name": channel.name,
                     "description": channel.description,
                     "is_private": channel.is_private,
-                    "member_count": len(channel.members)
+                    "member_count": channel.member_count
                 }
-            ))
-    
-    # Search Messages in Channels
-    if search_type in ["all", "messages"]:
-        search_term = f"%{q}%"
+            ) for channel in channels]
         
-        # Get channels user is a member of
-        user_channel_ids = [c.id for c in current_user.channels]
-        
-        messages = db.query(Message).filter(
-            and_(
-                Message.content.ilike(search_term),
-                Message.channel_id.in_(user_channel_ids),
-                Message.is_deleted == False
-            )
-        ).order_by(Message.timestamp.desc()).limit(limit).all()
+        categories.append(Category("channels", search_channels, settings.SEARCH_DIRECTORY_TIMEOUT_MS))
+    
+    # Channel messages and direct messages are fetched separately and paged
+    # together; each part is cached until a write touches its scope (see search_cache)
+    cache_keys = {}
+    cached_parts = {}
+    generation = search_cache.generation()
+    if search_type in ["all", "messages"] and (parsed.terms or parsed.modifiers):
+        page_key = (normalize_query(parsed, current_user), sort, limit, cursor)
+        cache_keys["messages"] = ("messages", channel_set_digest(user_channel_ids)) + page_key
+        cache_keys["direct_messages"] = ("direct_messages", current_user.id) + page_key
+        for name, key in cache_keys.items():
+            cached = search_cache.get(key)
+            if cached is not None:
+                cached_parts[name] = cached
         
-        for msg in messages:
-            results.append(SearchResult(
-                result_type="message",
-                id=msg.id,
-                content={
-                    "content": msg.content,
-                    "channel_id": msg.channel_id,
-                    "channel_name": msg.channel.name,
-                    "user_id": msg.user_id,
-                    "username": msg.user.username,
-                    "timestamp": msg.timestamp.isoformat()
-                }
-            ))
+        channel_filters = message_filters(db, parsed, Message, current_user)
+        if channel_filters is not None and "messages" not in cached_parts:
+            def search_channel_messages(session):
+                query = session.query(Message).filter(
+                    Message.channel_id.in_(user_channel_ids),
+                    Message.is_deleted == False,
+                    *channel_filters
+                )
+                return fetch_ranked(MESSAGE_KIND, query, Message, parsed.terms, sort, limit, cursor)
+            
+            categories.append(Category("messages", search_channel_messages, settings.SEARCH_MESSAGES_TIMEOUT_MS))
         
-        # Search Direct Messages
-        direct_messages = db.query(DirectMessage).filter(
-            and_(
-                DirectMessage.content.ilike(search_term),
-                or_(
-                    DirectMessage.sender_id == current_user.id,
-                    DirectMessage.receiver_id == current_user.id
-                ),
-                DirectMessage.is_deleted == False
-            )
-        ).order_by(DirectMessage.timestamp.desc()).limit(limit).all()
+        dm_filters = message_filters(db, parsed, DirectMessage, current_user)
+        if dm_filters is not None and "direct_messages" not in cached_parts:
+            def search_direct_messages(session):
+                query = session.query(DirectMessage).filter(
+                    or_(
+                        DirectMessage.sender_id == current_user.id,
+                        DirectMessage.receiver_id == current_user.id
+                    ),
+                    DirectMessage.is_deleted == False,
+                    *dm_filters
+                )
+                return fetch_ranked(DIRECT_MESSAGE_KIND, query, DirectMessage, parsed.terms, sort, limit, cursor)
+            
+            categories.append(Category("direct_messages", search_direct_messages, settings.SEARCH_MESSAGES_TIMEOUT_MS))
+    
+    outcome = search_fanout.run(categories)
+    timed_out = [name for name, result in outcome.items() if result.timed_out]
+    
+    results = []
+    total_count = 0
+    for name in ("users", "channels"):
+        if name in outcome and not outcome[name].timed_out:
+            results.extend(outcome[name].value)
+            total_count += len(outcome[name].value)
+    
+    parts = []
+    for name in ("messages", "direct_messages"):
+        if name in cached_parts:
+            parts.append(cached_parts[name])
+        elif name in outcome and not outcome[name].timed_out:
+            parts.append(outcome[name].value)
+            if name == "messages":
+                search_cache.put(cache_keys[name], outcome[name].value, generation, channel_ids=user_channel_ids)
+            else:
+                search_cache.put(cache_keys[name], outcome[name].value, generation, dm_user_ids=[current_user.id])
+    hits, next_cursor = merge_ranked(parts, sort, limit)
+    total_count += sum(part.total for part in parts)
+    total_is_estimate = any(part.total_is_estimate for part in parts)
+    
+    if hits:
+        messages = [hit.row for hit in hits if hit.kind == MESSAGE_KIND]
+        direct_messages = [hit.row for hit in hits if hit.kind == DIRECT_MESSAGE_KIND]
+        channels_by_id = load_channels(db, (msg.channel_id for msg in messages))
+        profiles = load_user_profiles(db, [msg.user_id for msg in messages] + [
+            dm.sender_id if dm.sender_id != current_user.id else dm.receiver_id for dm in direct_messages
+        ])
         
-        for dm in direct_messages:
-            other_user = dm.sender if dm.sender_id != current_user.id else dm.receiver
-            results.append(SearchResult(
-                result_type="direct_message",
-                id=dm.id,
-                content={
-                    "content": dm.content,
-                    "other_user_id": other_user.id,
-                    "other_username": other_user.username,
-                    "timestamp": dm.timestamp.isoformat(),
-                    "is_sent_by_me": dm.sender_id == current_user.id
-                }
-            ))
+        for hit in hits:
+            if hit.kind == MESSAGE_KIND:
+                msg = hit.row
+                results.append(SearchResult(
+                    result_type="message",
+                    id=msg.id,
+                    content={
+                        "content": msg.content,
+                        "snippet": hit.snippet,
+                        "channel_id": msg.channel_id,
+                        "channel_name": channels_by_id[msg.channel_id].name,
+                        "user_id": msg.user_id,
+                        "username": profiles[msg.user_id]['username'],
+                        "timestamp": msg.timestamp.isoformat()
+                    },
+                    relevance_score=-hit.rank if hit.rank else 0.0
+                ))
+            else:
+                dm = hit.row
+                other_user = profiles[dm.sender_id if dm.sender_id != current_user.id else dm.receiver_id]
+                results.append(SearchResult(
+                    result_type="direct_message",
+                    id=dm.id,
+                    content={
+                        "content": dm.content,
+                        "snippet": hit.snippet,
+                        "other_user_id": other_user['id'],
+                        "other_username": other_user['username'],
+                        "timestamp": dm.timestamp.isoformat(),
+                        "is_sent_by_me": dm.sender_id == current_user.id
+                    },
+                    relevance_score=-hit.rank if hit.rank else 0.0
+                ))
     
     return SearchResponse(
         query=q,
-        results=results[:limit],
-        total_count=len(results)
+        results=results,
+        total_count=total_count,
+        total_is_estimate=total_is_estimate,
+        next_cursor=next_cursor,
+        has_more=next_cursor is not None,
+        partial=bool(timed_out),
+        timed_out=timed_out
     )
 
+@router.get("/typeahead", response_model=List[TypeaheadMatch])
+def typeahead(
+    q: str = Query("", description="Typed text; a leading @ limits to people and groups, # to channels"),
+    types: Optional[str] = Query(None, description="Comma-separated: user, channel, user_group"),
+    limit: int = Query(10, ge=1, le=50),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Ranked completions for @-mentions, #-channel links and the quick switcher (served from memory)"""
+    kinds = set(KINDS)
+    if types:
+        kinds &= {kind.strip() for kind in types.split(",")}
+    if q.startswith("@"):
+        kinds &= {USER, USER_GROUP}
+    elif q.startswith("#"):
+        kinds &= {CHANNEL}
+    
+    member_of = None
+    
+    def visible(entry) -> bool:
+        # Private channels only for their members; looked up once, and only if one matches
+        nonlocal member_of
+        if entry.kind != CHANNEL or not entry.is_private:
+            return True
+        if member_of is None:
+            member_of = {row.channel_id for row in db.query(channel_members.c.channel_id).filter(
+                channel_members.c.user_id == current_user.id
+            )}
+        return entry.id in member_of
+    
+    matches = typeahead_index.search(q.lstrip("@#"), kinds, accept=visible, limit=limit)
+    return [
+        TypeaheadMatch(
+            result_type=match.entry.kind,
+            id=match.entry.id,
+            name=match.entry.name,
+            display_name=match.entry.display_name,
+            is_private=match.entry.is_private if match.entry.kind == CHANNEL else None,
+            profile_picture=match.entry.profile_picture,
+            score=match.score
+        )
+        for match in matches
+    ]
+
 @router.get("/messages", response_model=List[dict])
 def search_messages(
     q: str = Query(..., min_length=1),
@@ -144,19 +270,12 @@ def search_messages(
     db: Session = Depends(get_db)
 ):
     """Search messages in channels user has access to"""
-    search_term = f"%{q}%"
-    
-    query = db.query(Message).filter(
-        and_(
-            Message.content.ilike(search_term),
-            Message.is_deleted == False
-        )
-    )
+    query = db.query(Message).filter(Message.is_deleted == False)
     
     # Filter by channel if specified
     if channel_id:
         channel = db.query(Channel).filter(Channel.id == channel_id).first()
-        if channel and (not channel.is_private or current_user in channel.members):
+        if channel and (not channel.is_private or is_member(db, channel.id, current_user.id)):
             query = query.filter(Message.channel_id == channel_id)
         else:
             return []
@@ -165,17 +284,20 @@ def search_messages(
         user_channel_ids = [c.id for c in current_user.channels]
         query = query.filter(Message.channel_id.in_(user_channel_ids))
     
-    messages = query.order_by(Message.timestamp.desc()).limit(limit).all()
+    messages = search_text(query, Message, q).limit(limit).all()
     
+    channels_by_id = load_channels(db, (msg.channel_id for msg, _, _ in messages))
+    authors = load_user_profiles(db, (msg.user_id for msg, _, _ in messages))
     return [{
         "id": msg.id,
         "content": msg.content,
+        "snippet": snippet,
         "channel_id": msg.channel_id,
-        "channel_name": msg.channel.name,
+        "channel_name": channels_by_id[msg.channel_id].name,
         "user_id": msg.user_id,
-        "username": msg.user.username,
+        "username": authors[msg.user_id]['username'],
         "timestamp": msg.timestamp.isoformat()
-    } for msg in messages]
+    } for msg, _, snippet in messages]
 
 @router.get("/users", response_model=List[dict])
 def search_users(
@@ -185,15 +307,8 @@ def search_users(
     db: Session = Depends(get_db)
 ):
     """Search for users"""
-    search_term = f"%{q}%"
-    
-    users = db.query(User).filter(
-        or_(
-            User.username.ilike(search_term),
-            User.email.ilike(search_term),
-            User.name.ilike(search_term) if User.name else False
-        )
-    ).limit(limit).all()
+    user_ids = typeahead_index.substring_ids(USER, q, limit=limit)
+    users = in_rank_order(db.query(User).filter(User.id.in_(user_ids)).all(), user_ids)
     
     return [{
         "id": user.id,
@@ -212,32 +327,23 @@ def search_channels(
     db: Session = Depends(get_db)
 ):
     """Search for channels"""
-    search_term = f"%{q}%"
-    
-    query = db.query(Channel).filter(
-        or_(
-            Channel.name.ilike(search_term),
-            Channel.description.ilike(search_term)
-        )
-    )
+    # Include public channels or private channels user is member of
+    def visible(entry):
+        return not entry.is_private or (include_private and is_member(db, entry.id, current_user.id))
     
-    channels = query.limit(limit * 2).all()  # Get more to filter
+    channel_ids = typeahead_index.substring_ids(CHANNEL, q, accept=visible, limit=limit)
+    channels = in_rank_order(db.query(Channel).filter(Channel.id.in_(channel_ids)).all(), channel_ids)
     
     results = []
     for channel in channels:
-        # Include public channels or private channels user is member of
-        if not channel.is_private or (include_private and current_user in channel.members):
-            results.append({
-                "id": channel.id,
-                "name": channel.name,
-                "description": channel.description,
-                "is_private": channel.is_private,
-                "member_count": len(channel.members),
-                "is_member": current_user in channel.members
-            })
-            
-            if len(results) >= limit:
-                break
+        results.append({
+            "id": channel.id,
+            "name": channel.name,
+            "description": channel.description,
+            "is_private": channel.is_private,
+            "member_count": channel.member_count,
+            "is_member": is_member(db, channel.id, current_user.id)
+        })
     
     return results
 
@@ -250,11 +356,8 @@ def search_direct_messages(
     db: Session = Depends(get_db)
 ):
     """Search direct messages"""
-    search_term = f"%{q}%"
-    
     query = db.query(DirectMessage).filter(
         and_(
-            DirectMessage.content.ilike(search_term),
             or_(
                 DirectMessage.sender_id == current_user.id,
                 DirectMessage.receiver_id == current_user.id
@@ -266,29 +369,25 @@ def search_direct_messages(
     # Filter by specific conversation
     if user_id:
         query = query.filter(
-            or_(
-                and_(
-                    DirectMessage.sender_id == current_user.id,
-                    DirectMessage.receiver_id == user_id
-                ),
-                and_(
-                    DirectMessage.sender_id == user_id,
-                    DirectMessage.receiver_id == current_user.id
-                )
-            )
+            DirectMessage.conversation_key == conversation_key(current_user.id, user_id)
         )
     
-    messages = query.order_by(DirectMessage.timestamp.desc()).limit(limit).all()
+    messages = search_text(query, DirectMessage, q).limit(limit).all()
+    
+    def partner_id(dm):
+        return dm.sender_id if dm.sender_id != current_user.id else dm.receiver_id
     
+    partners = load_user_profiles(db, (partner_id(dm) for dm, _, _ in messages))
     return [{
         "id": dm.id,
         "content": dm.content,
+        "snippet": snippet,
         "sender_id": dm.sender_id,
         "receiver_id": dm.receiver_id,
         "other_user": {
-            "id": dm.sender.id if dm.sender_id != current_user.id else dm.receiver.id,
-            "username": dm.sender.username if dm.sender_id != current_user.id else dm.receiver.username,
+            "id": partner_id(dm),
+            "username": partners[partner_id(dm)]['username'],
         },
         "timestamp": dm.timestamp.isoformat(),
         "is_sent_by_me": dm.sender_id == current_user.id
-    } for dm in messages]
+    } for dm, _, snippet in messages]
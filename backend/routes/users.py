@@ -1,17 +1,21 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
 from typing import List, Optional
 from .. import schemas, models
 from ..database import get_db
+from ..hydration import invalidate_user_profile
+from ..session_cache import drop_user_sessions
+from ..realtime import publish_after_commit, PRESENCE_TOPIC
+from ..typeahead import USER, in_rank_order, typeahead_index
 from .auth import get_current_user
 
 router = APIRouter(prefix="/api/users", tags=["users"])
 
 @router.get("", response_model=List[schemas.User])
 def list_users(
-    search: Optional[str] = Query(None, description="Search by username or email"),
+    search: Optional[str] = Query(None, description="Search by username, name or email"),
     status_filter: Optional[str] = Query(None, description="Filter by status (online, offline, away)"),
+    limit: int = Query(100, ge=1, le=500, description="Most search matches returned, best first"),
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -19,20 +23,19 @@ def list_users(
     query = db.query(models.User)
     
     # Apply search filter
+    user_ids = None
     if search:
-        search_term = f"%{search}%"
-        query = query.filter(
-            or_(
-                models.User.username.ilike(search_term),
-                models.User.email.ilike(search_term)
-            )
-        )
+        # Substring match answered by the in-memory typeahead index
+        user_ids = typeahead_index.substring_ids(USER, search, limit=limit)
+        query = query.filter(models.User.id.in_(user_ids))
     
     # Apply status filter
     if status_filter:
         query = query.filter(models.User.status == status_filter)
     
     users = query.all()
+    if user_ids is not None:
+        users = in_rank_order(users, user_ids)
     return users
 
 @router.get("/{user_id}", response_model=schemas.UserProfile)
@@ -97,6 +100,8 @@ def update_my_profile(
     
     db.commit()
     db.refresh(current_user)
+    invalidate_user_profile(current_user.id)
+    drop_user_sessions(current_user.id)
     
     return current_user
 
@@ -180,7 +185,8 @@ def remove_contact(
 
 @router.get("/directory", response_model=List[schemas.User])
 def get_user_directory(
-    search: Optional[str] = Query(None, description="Search by username or email"),
+    search: Optional[str] = Query(None, description="Search by username, name or email"),
+    limit: int = Query(100, ge=1, le=500, description="Most search matches returned, best first"),
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -188,13 +194,11 @@ def get_user_directory(
     query = db.query(models.User).filter(models.User.id != current_user.id)
     
     if search:
-        search_term = f"%{search}%"
-        query = query.filter(
-            or_(
-                models.User.username.ilike(search_term),
-                models.User.email.ilike(search_term)
-            )
+        # Substring match answered by the in-memory typeahead index
+        user_ids = typeahead_index.substring_ids(
+            USER, search, accept=lambda entry: entry.id != current_user.id, limit=limit
         )
+        return in_rank_order(query.filter(models.User.id.in_(user_ids)).all(), user_ids)
     
     users = query.all()
     return users
@@ -223,6 +227,8 @@ def update_my_profile_enhanced(
         current_user.profile_picture = profile_update.profile_picture
     
     db.commit()
+    invalidate_user_profile(current_user.id)
+    drop_user_sessions(current_user.id)
     return {"message": "Profile updated successfully"}
 
 
@@ -239,6 +245,10 @@ def update_presence(
     from datetime import datetime
     current_user.presence = presence_data.presence
     current_user.last_activity_at = datetime.utcnow()
+    publish_after_commit(db, PRESENCE_TOPIC, "presence.changed", {
+        "user_id": current_user.id,
+        "presence": presence_data.presence
+    })
     db.commit()
     
     return {"message": "Presence updated", "presence": presence_data.presence}
@@ -268,7 +278,8 @@ def get_my_preferences(
     return {
         "theme": current_user.theme,
         "notification_sound": current_user.notification_sound,
-        "email_notifications": current_user.email_notifications
+        "email_notifications": current_user.email_notifications,
+        "notification_digest": current_user.notification_digest
     }
 
 
@@ -290,6 +301,9 @@ def update_preferences(
     if preferences.email_notifications is not None:
         current_user.email_notifications = preferences.email_notifications
     
+    if preferences.notification_digest is not None:
+        current_user.notification_digest = preferences.notification_digest
+    
     db.commit()
     return {"message": "Preferences updated successfully"}
 
@@ -5,6 +5,7 @@ from typing import List
 from ..database import get_db
 from ..models import User, Workflow, Channel
 from ..schemas import WorkflowCreate, WorkflowUpdate, WorkflowSchema
+from ..membership import is_member
 from .auth import get_current_user
 
 router = APIRouter(prefix="/api/workflows", tags=["workflows"])
@@ -22,7 +23,7 @@ def create_workflow(
         channel = db.query(Channel).filter(Channel.id == workflow_data.channel_id).first()
         if not channel:
             raise HTTPException(status_code=404, detail="Channel not found")
-        if current_user not in channel.members:
+        if not is_member(db, channel.id, current_user.id):
             raise HTTPException(status_code=403, detail="Not a member of this channel")
     
     workflow = Workflow(
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, ConfigDict, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 
 # ===== User Schemas =====
@@ -51,9 +51,19 @@ class Channel(ChannelBase):
     id: int
     created_by: Optional[int] = None
     created_at: datetime
+    member_count: int = 0
     members: List[User] = []
     model_config = ConfigDict(from_attributes=True)
 
+class ChannelMember(User):
+    presence: Optional[str] = "offline"
+
+class ChannelMemberPage(BaseModel):
+    members: List[ChannelMember]
+    member_count: int  # all members, whatever the presence filter
+    next_cursor: Optional[int] = None  # pass back as `cursor` for the next page
+    has_more: bool = False
+
 # ===== Message Schemas =====
 class MessageBase(BaseModel):
     content: str
@@ -98,6 +108,7 @@ class Message(MessageBase):
     formatted_content: Optional[str] = None
     formatting: Optional[str] = None
     mentions: Optional[str] = None
+    mentions_channel: bool = False
     attachments: List[AttachmentSchema] = []
     user: Optional[dict] = None  # Include user info for frontend
     model_config = ConfigDict(from_attributes=True)
@@ -170,6 +181,21 @@ class Reaction(ReactionBase):
     timestamp: datetime
     model_config = ConfigDict(from_attributes=True)
 
+# ===== Read Marker Schemas =====
+class MarkReadRequest(BaseModel):
+    message_id: int  # mark everything up to and including this message as read
+
+class ChannelReadMarker(BaseModel):
+    channel_id: int
+    last_read_message_id: Optional[int] = None
+    unread_count: int
+    mention_count: int = 0
+
+class DMReadMarker(BaseModel):
+    user_id: int
+    last_read_message_id: Optional[int] = None
+    unread_count: int
+
 # ===== Contact Schemas =====
 class ContactAdd(BaseModel):
     contact_id: int
@@ -197,10 +223,24 @@ class SearchResult(BaseModel):
     content: dict
     relevance_score: Optional[float] = None
 
+class TypeaheadMatch(BaseModel):
+    result_type: str  # user, channel, user_group
+    id: int
+    name: str  # username, channel name or group handle
+    display_name: Optional[str] = None
+    is_private: Optional[bool] = None
+    profile_picture: Optional[str] = None
+    score: float
+
 class SearchResponse(BaseModel):
     query: str
     results: List[SearchResult]
     total_count: int
+    total_is_estimate: bool = False  # total_count is a lower bound ("1000+")
+    next_cursor: Optional[str] = None  # pass back as `cursor` for the next page
+    has_more: bool = False
+    partial: bool = False  # some categories timed out; their results are missing
+    timed_out: List[str] = []  # users, channels, messages, direct_messages
 
 
 # ===== Notification Schemas =====
@@ -224,6 +264,9 @@ class NotificationSchema(NotificationBase):
     is_read: bool
     created_at: datetime
     read_at: Optional[datetime] = None
+    actor_count: int = 1
+    recent_actors: Optional[str] = None  # JSON array of user IDs, newest first
+    updated_at: Optional[datetime] = None
     model_config = ConfigDict(from_attributes=True)
 
 
@@ -238,6 +281,7 @@ class PinnedMessageSchema(BaseModel):
     channel_id: int
     pinned_by: int
     pinned_at: datetime
+    message_preview: Optional[dict] = None  # Hydrated message with author info
     model_config = ConfigDict(from_attributes=True)
 
 
@@ -257,6 +301,8 @@ class BookmarkSchema(BaseModel):
     direct_message_id: Optional[int] = None
     note: Optional[str] = None
     created_at: datetime
+    message_preview: Optional[dict] = None  # Hydrated channel message, if bookmarked
+    direct_message_preview: Optional[dict] = None  # Hydrated DM, if bookmarked
     model_config = ConfigDict(from_attributes=True)
 
 
@@ -416,10 +462,34 @@ class ActivitySchema(BaseModel):
     description: str
     target_type: Optional[str] = None
     target_id: Optional[int] = None
-    metadata: Optional[str] = None
+    # Read from activity_metadata: Activity.metadata is the declarative MetaData
+    metadata: Optional[Dict[str, Any]] = Field(None, validation_alias="activity_metadata")
     created_at: datetime
     model_config = ConfigDict(from_attributes=True)
 
+class ActivityFeedItem(BaseModel):
+    """One entry of the Activity page timeline"""
+    id: int
+    user_id: int
+    user_name: str
+    user: str
+    description: str
+    action: str
+    activity_type: str
+    target_type: Optional[str] = None
+    target_id: Optional[int] = None
+    metadata: Optional[Dict[str, Any]] = None
+    created_at: Optional[datetime] = None
+    timestamp: Optional[datetime] = None
+    is_read: bool = True
+    contentType: str
+    contentId: int
+
+class ActivityFeedPage(BaseModel):
+    activities: List[ActivityFeedItem]  # newest first
+    next_cursor: Optional[str] = None   # pass as ?before= for the next (older) page
+    has_more: bool
+
 
 # ===== Permalink Schemas =====
 class PermalinkCreate(BaseModel):
@@ -460,6 +530,7 @@ class UserPreferencesUpdate(BaseModel):
     theme: Optional[str] = None
     notification_sound: Optional[bool] = None
     email_notifications: Optional[bool] = None
+    notification_digest: Optional[bool] = None
 
 
 # ===== Channel Topic Schemas =====
@@ -0,0 +1,216 @@
+"""
+Cache of message search results, validated by per-channel write generations.
+
+The same searches are run over and over (everyone typing the incident keyword
+during an outage), so the message and DM parts of ``GET /api/search`` are
+cached. An entry is keyed by the normalized query, the sort, page and
+filters, and the scope it was computed for - a digest of the caller's
+accessible channel set for channel messages, the caller's id for DMs - so
+users who can see the same channels share entries.
+
+Correctness comes from write generations instead of a short TTL. Every
+committed insert, edit or delete of a message (and of a reaction, attachment
+or thread, which ``has:`` and ``is:`` filter on) bumps the generation of its
+channel - or, for a DM, of both participants - to the next value of a
+process-wide counter. An entry remembers the counter value read before its
+query ran and is only served while none of the channels (or DM users) in its
+scope has a newer generation. Bumps are applied after commit and published
+on the ``search_generations`` event-bus topic so every worker applies them.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .database import SessionLocal
+from .models import (
+    Attachment, Channel, DirectMessage, DirectMessageAttachment, Message, Reaction, Thread
+)
+from .realtime import hub
+
+SEARCH_GENERATIONS_TOPIC = "search_generations"
+
+
+def channel_set_digest(channel_ids: Iterable[int]) -> str:
+    """Stable digest of a set of channel ids, for use in cache keys"""
+    raw = ",".join(str(channel_id) for channel_id in sorted(set(channel_ids)))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class _Entry(NamedTuple):
+    value: Any
+    generation: int
+    channel_ids: Tuple[int, ...]
+    dm_user_ids: Tuple[int, ...]
+    cached_until: float
+
+
+class SearchCache:
+    """Thread-safe LRU of search results checked against write generations"""
+
+    def __init__(self, max_size: int, ttl_seconds: int):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._clock = 0
+        self._channel_generations: Dict[int, int] = {}
+        self._dm_generations: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def generation(self) -> int:
+        """Counter value to pass to ``put``; read it before running the query"""
+        with self._lock:
+            return self._clock
+
+    def bump(self, channel_ids: Iterable[int] = (), dm_user_ids: Iterable[int] = ()):
+        """Mark channels and DM users as written, invalidating entries that cover them"""
+        with self._lock:
+            self._clock += 1
+            for channel_id in channel_ids:
+                self._channel_generations[channel_id] = self._clock
+            for user_id in dm_user_ids:
+                self._dm_generations[user_id] = self._clock
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.cached_until <= time.monotonic() or not self._fresh(entry):
+                del self._entries[key]
+                self.stale += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def put(self, key: Hashable, value: Any, generation: int,
+            channel_ids: Iterable[int] = (), dm_user_ids: Iterable[int] = ()):
+        if not self.enabled:
+            return
+        entry = _Entry(value, generation, tuple(channel_ids), tuple(dm_user_ids),
+                       time.monotonic() + self.ttl_seconds)
+        with self._lock:
+            if not self._fresh(entry):
+                # A write committed while the query ran
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _fresh(self, entry: _Entry) -> bool:
+        channels, dms = self._channel_generations, self._dm_generations
+        return (all(channels.get(channel_id, 0) <= entry.generation for channel_id in entry.channel_ids)
+                and all(dms.get(user_id, 0) <= entry.generation for user_id in entry.dm_user_ids))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale
+            }
+
+
+search_cache = SearchCache(settings.SEARCH_CACHE_SIZE, settings.SEARCH_CACHE_TTL_SECONDS)
+
+
+# ----- write generations -----
+
+_PENDING_KEY = "search_generations_pending"
+
+
+def _dm_users(dm: DirectMessage) -> Tuple[int, int]:
+    return (dm.sender_id, dm.receiver_id)
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_writes(session: Session, flush_context):
+    channels: Set[int] = set()
+    dm_users: Set[int] = set()
+    message_ids: Set[int] = set()
+    dm_ids: Set[int] = set()
+
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Message):
+            channels.add(obj.channel_id)
+        elif isinstance(obj, DirectMessage):
+            dm_users.update(_dm_users(obj))
+        elif isinstance(obj, Channel):
+            channels.add(obj.id)
+        elif isinstance(obj, (Reaction, Attachment)):
+            message_ids.add(obj.message_id)
+        elif isinstance(obj, Thread):
+            message_ids.add(obj.parent_message_id)
+        elif isinstance(obj, DirectMessageAttachment):
+            dm_ids.add(obj.direct_message_id)
+
+    # Rows that only reference a message: resolve its channel or participants
+    message_ids.discard(None)
+    dm_ids.discard(None)
+    if message_ids:
+        channels.update(session.connection().execute(
+            select(Message.channel_id).where(Message.id.in_(message_ids))
+        ).scalars())
+    if dm_ids:
+        for sender_id, receiver_id in session.connection().execute(
+            select(DirectMessage.sender_id, DirectMessage.receiver_id).where(DirectMessage.id.in_(dm_ids))
+        ):
+            dm_users.update((sender_id, receiver_id))
+
+    channels.discard(None)
+    dm_users.discard(None)
+    if channels or dm_users:
+        pending = session.info.setdefault(_PENDING_KEY, (set(), set()))
+        pending[0].update(channels)
+        pending[1].update(dm_users)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _apply_writes(session: Session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    channels, dm_users = pending
+    search_cache.bump(channels, dm_users)
+    hub.publish(SEARCH_GENERATIONS_TOPIC, "search.written", {
+        "channels": sorted(channels),
+        "dm_users": sorted(dm_users)
+    })
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_writes(session: Session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def _on_bus_event(text: str):
+    """Apply a bump committed by any worker (including this one)"""
+    data = json.loads(text)["data"]
+    search_cache.bump(data.get("channels", ()), data.get("dm_users", ()))
+
+
+hub.add_listener(SEARCH_GENERATIONS_TOPIC, _on_bus_event)
@@ -0,0 +1,142 @@
+"""
+Concurrent fan-out of the universal search categories.
+
+``GET /api/search`` looks in several independent places - users, channels,
+channel messages and DMs. Instead of querying them one after another, each
+category runs on its own session in a small shared thread pool
+(``SEARCH_FANOUT_THREADS``), so the response takes as long as the slowest
+category rather than the sum of all of them.
+
+Every category has its own time budget. A category that overruns it is
+reported as timed out (the response is then flagged partial) and its query
+is cancelled so the worker is freed: ``interrupt()`` on the SQLite
+connection, ``statement_timeout`` on PostgreSQL. A category is a callable
+``run(db)`` that returns plain data or detached rows with their columns
+loaded - the session is closed once it returns.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL SQLSTATE for a statement cancelled by statement_timeout
+_QUERY_CANCELED = "57014"
+
+
+class Category(NamedTuple):
+    name: str
+    run: Callable[[Session], Any]
+    timeout_ms: int
+
+
+class CategoryResult(NamedTuple):
+    value: Any             # None if the category timed out
+    timed_out: bool
+    elapsed_ms: float
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _Job:
+    """One category's run on its own session, cancellable from the request thread"""
+
+    def __init__(self, category: Category):
+        self.category = category
+        self._lock = threading.Lock()
+        self._connection = None  # raw SQLite connection while a query may be running
+        self.cancelled = False
+
+    def __call__(self):
+        db = SessionLocal()
+        try:
+            dialect = db.get_bind().dialect.name
+            if dialect == "postgresql":
+                db.execute(text(f"SET LOCAL statement_timeout = {int(self.category.timeout_ms)}"))
+            elif dialect == "sqlite":
+                with self._lock:
+                    if self.cancelled:
+                        raise _Cancelled()
+                    self._connection = db.connection().connection.driver_connection
+            return self.category.run(db)
+        except OperationalError as exc:
+            if self.cancelled or getattr(exc.orig, "pgcode", None) == _QUERY_CANCELED:
+                raise _Cancelled() from exc
+            raise
+        finally:
+            with self._lock:
+                self._connection = None
+            db.close()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            if self._connection is not None:
+                self._connection.interrupt()
+
+
+class SearchFanout:
+    """Bounded thread pool running search categories concurrently"""
+
+    def __init__(self, threads: int):
+        self.threads = threads
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.timeouts = 0
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="search")
+            return self._executor
+
+    def run(self, categories: List[Category]) -> Dict[str, CategoryResult]:
+        """
+        Run every category concurrently and wait for each up to its own
+        timeout (counted from the start of the fan-out). Errors other than a
+        timeout propagate to the caller.
+        """
+        start = time.monotonic()
+        pool = self._pool()
+        jobs = [(category, _Job(category)) for category in categories]
+        futures = [(category, job, pool.submit(job)) for category, job in jobs]
+
+        results: Dict[str, CategoryResult] = {}
+        for category, job, future in futures:
+            remaining = category.timeout_ms / 1000.0 - (time.monotonic() - start)
+            try:
+                value = future.result(timeout=max(remaining, 0.0))
+                timed_out = False
+            except (FutureTimeout, _Cancelled):
+                future.cancel()
+                job.cancel()
+                value, timed_out = None, True
+            results[category.name] = CategoryResult(value, timed_out, (time.monotonic() - start) * 1000.0)
+
+        with self._lock:
+            self.runs += 1
+            self.timeouts += sum(1 for result in results.values() if result.timed_out)
+        if any(result.timed_out for result in results.values()):
+            logger.warning("search categories timed out: %s",
+                           ", ".join(name for name, result in results.items() if result.timed_out))
+        return results
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"threads": self.threads, "runs": self.runs, "timeouts": self.timeouts}
+
+
+search_fanout = SearchFanout(settings.SEARCH_FANOUT_THREADS)
@@ -0,0 +1,343 @@
+"""
+Full-text search over channel messages and direct messages.
+
+Text matching goes through a search backend picked from the database dialect
+(or forced with ``SEARCH_BACKEND``):
+
+- ``Fts5Backend`` (SQLite) - FTS5 tables ``messages_fts`` and
+  ``direct_messages_fts``, whose rowid is the message id. Each row holds the
+  plain content plus the text of ``formatted_content`` with its tags
+  stripped. Matches are ranked with BM25 and highlighted with ``snippet()``.
+- ``PostgresBackend`` - GIN indexes on ``to_tsvector`` of the same text
+  (the parser drops HTML tags by itself), ranked with ``ts_rank_cd`` and
+  highlighted with ``ts_headline``.
+- ``LikeBackend`` - any other database, or SQLite built without FTS5: a
+  substring match, unranked.
+
+The FTS5 tables are written from the ORM flush (``_sync_index``), so inserts,
+edits and deletes of messages update the index in the same transaction.
+Bulk deletes that bypass the ORM must call ``remove_from_index``.
+
+Search text is a list of terms that must all match: bare words, "quoted
+phrases" and prefixes (``deploy*``).
+"""
+
+import html
+import re
+import threading
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import (
+    Column, Integer, MetaData, Table, Text, and_, event, func, inspect, literal, literal_column, or_, text
+)
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Query
+
+from .config import settings
+from .database import SessionLocal, engine
+from .models import DirectMessage, Message
+
+INDEXED_MODELS = (Message, DirectMessage)
+
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+
+_WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+_TERM_RE = re.compile(r'"([^"]*)"?|(\S+)')
+_TAG_RE = re.compile(r"<[^>]*>")
+
+
+class Term(NamedTuple):
+    """One search term: a word, or a phrase of consecutive words"""
+    words: Tuple[str, ...]
+    prefix: bool = False  # last word matches as a prefix
+
+
+def parse_terms(query: str) -> List[Term]:
+    """Split search text into terms; punctuation inside a bare word makes it a phrase"""
+    terms = []
+    for phrase, bare in _TERM_RE.findall(query or ""):
+        words = tuple(word.lower() for word in _WORD_RE.findall(phrase or bare))
+        if words:
+            terms.append(Term(words, prefix=bool(bare) and bare.endswith("*")))
+    return terms
+
+
+def plain_text(formatted_content: Optional[str]) -> str:
+    """Visible text of sanitized message HTML"""
+    if not formatted_content:
+        return ""
+    return " ".join(html.unescape(_TAG_RE.sub(" ", formatted_content)).split())
+
+
+def _index_text(content: Optional[str], formatted_content: Optional[str]) -> str:
+    # Only index the formatted text when it says something the content doesn't,
+    # so plain messages are not counted twice by the ranking
+    formatted = plain_text(formatted_content)
+    return "" if formatted == " ".join((content or "").split()) else formatted
+
+
+class TextMatch(NamedTuple):
+    """A query restricted to full-text matches, with its ranking expressions"""
+    query: Query
+    rank: object
+    snippet: object
+
+
+class SearchBackend:
+    """Restricts message queries to full-text matches and ranks them"""
+
+    name = "like"
+    # Whether the ORM flush must copy message text into a separate index
+    needs_sync = False
+
+    def ensure_index(self, engine: Engine):
+        """Create the index structures (idempotent)"""
+
+    def index_rows(self, conn: Connection, table: str, rows: Iterable[Tuple[int, Optional[str], Optional[str]]]):
+        """Add ``(id, content, formatted_content)`` rows to a table's index"""
+
+    def remove_rows(self, conn: Connection, table: str, ids: Sequence[int]):
+        """Drop rows from a table's index"""
+
+    def match(self, query: Query, model, terms: List[Term]) -> "TextMatch":
+        """
+        Filter an ORM query over ``model`` to rows matching every term, and
+        return it with the rank expression (lower is a better match) and the
+        snippet expression (a highlighted excerpt, or NULL)
+        """
+        conditions = []
+        for term in terms:
+            pattern = "%" + "%".join(term.words) + "%"
+            conditions.append(or_(model.content.ilike(pattern), model.formatted_content.ilike(pattern)))
+        return TextMatch(query.filter(and_(*conditions)), literal(0.0), literal(None))
+
+
+LikeBackend = SearchBackend
+
+
+_fts_metadata = MetaData()
+
+
+def _fts_table(table: str) -> Table:
+    name = f"{table}_fts"
+    if name not in _fts_metadata.tables:
+        Table(
+            name, _fts_metadata,
+            Column("rowid", Integer, primary_key=True),
+            Column("content", Text),
+            Column("formatted_text", Text)
+        )
+    return _fts_metadata.tables[name]
+
+
+def fts5_query(terms: List[Term]) -> str:
+    """FTS5 MATCH expression: every term quoted, so user input is never parsed as syntax"""
+    return " ".join(
+        '"' + " ".join(term.words) + '"' + ("*" if term.prefix else "")
+        for term in terms
+    )
+
+
+class Fts5Backend(SearchBackend):
+    name = "fts5"
+    needs_sync = True
+    # BM25 weights per column: a hit in the plain content counts for more
+    # than one only in the formatted text
+    WEIGHTS = (1.0, 0.5)
+    SNIPPET_TOKENS = 16
+
+    def ensure_index(self, engine: Engine):
+        with engine.begin() as conn:
+            for model in INDEXED_MODELS:
+                conn.execute(text(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {model.__tablename__}_fts "
+                    "USING fts5(content, formatted_text, tokenize = 'porter unicode61 remove_diacritics 2')"
+                ))
+
+    def index_rows(self, conn, table, rows):
+        values = [
+            {"id": row_id, "content": content or "", "formatted_text": _index_text(content, formatted)}
+            for row_id, content, formatted in rows
+        ]
+        if values:
+            conn.execute(
+                text(f"INSERT INTO {table}_fts (rowid, content, formatted_text) VALUES (:id, :content, :formatted_text)"),
+                values
+            )
+
+    def remove_rows(self, conn, table, ids):
+        if ids:
+            conn.execute(text(f"DELETE FROM {table}_fts WHERE rowid = :id"), [{"id": row_id} for row_id in ids])
+
+    def match(self, query, model, terms):
+        fts = _fts_table(model.__tablename__)
+        fts_ref = literal_column(fts.name)
+        rank = func.bm25(fts_ref, *self.WEIGHTS)
+        snippet = func.snippet(fts_ref, -1, HIGHLIGHT_START, HIGHLIGHT_END, "…", self.SNIPPET_TOKENS)
+        query = query.join(fts, fts.c.rowid == model.id).filter(fts_ref.op("MATCH")(fts5_query(terms)))
+        return TextMatch(query, rank, snippet)
+
+
+def tsquery_text(terms: List[Term]) -> str:
+    """to_tsquery expression: words of a phrase joined with <->, terms with &"""
+    parts = []
+    for term in terms:
+        words = list(term.words)
+        if term.prefix:
+            words[-1] += ":*"
+        parts.append("(" + " <-> ".join(words) + ")")
+    return " & ".join(parts)
+
+
+class PostgresBackend(SearchBackend):
+    name = "postgres"
+    CONFIG = "english"
+    HEADLINE_OPTIONS = f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, MaxWords=24, MinWords=8"
+
+    def _document_sql(self, table: Optional[str] = None) -> str:
+        # Must match the indexed expression exactly for the GIN index to be used
+        prefix = f"{table}." if table else ""
+        return (
+            f"to_tsvector('{self.CONFIG}', coalesce({prefix}content, '') || ' ' || "
+            f"coalesce({prefix}formatted_content, ''))"
+        )
+
+    def ensure_index(self, engine: Engine):
+        try:
+            from .migrations import create_index_online
+        except ImportError:
+            from backend.migrations import create_index_online
+        for model in INDEXED_MODELS:
+            table = model.__tablename__
+            create_index_online(engine, f"ix_{table}_fts", table, [self._document_sql()], using="gin")
+
+    def match(self, query, model, terms):
+        document = literal_column(self._document_sql(model.__tablename__))
+        tsquery = func.to_tsquery(literal_column(f"'{self.CONFIG}'"), tsquery_text(terms))
+        rank = -func.ts_rank_cd(document, tsquery)
+        snippet = func.ts_headline(
+            literal_column(f"'{self.CONFIG}'"), model.content, tsquery,
+            literal_column(f"'{self.HEADLINE_OPTIONS}'")
+        )
+        return TextMatch(query.filter(document.op("@@")(tsquery)), rank, snippet)
+
+
+def _fts5_available(engine: Engine) -> bool:
+    with engine.connect() as conn:
+        options = {row[0] for row in conn.execute(text("PRAGMA compile_options"))}
+    return "ENABLE_FTS5" in options
+
+
+def create_search_backend(backend: str, engine: Engine) -> SearchBackend:
+    """Build the backend selected by SEARCH_BACKEND (``auto`` picks by dialect)"""
+    backend = (backend or "auto").lower()
+    dialect = engine.dialect.name
+    if backend == "auto":
+        if dialect == "postgresql":
+            backend = "postgres"
+        elif dialect == "sqlite" and _fts5_available(engine):
+            backend = "fts5"
+        else:
+            backend = "like"
+    if backend == "fts5":
+        return Fts5Backend()
+    if backend == "postgres":
+        return PostgresBackend()
+    if backend == "like":
+        return LikeBackend()
+    raise ValueError(f"Unknown SEARCH_BACKEND '{backend}' (expected auto, fts5, postgres or like)")
+
+
+_backend: Optional[SearchBackend] = None
+_backend_lock = threading.Lock()
+
+
+def search_backend() -> SearchBackend:
+    """The process-wide search backend, created on first use"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_search_backend(settings.SEARCH_BACKEND, engine)
+    return _backend
+
+
+def match_terms(query: Query, model, terms: List[Term]) -> TextMatch:
+    """Full-text match for parsed terms; with no terms every row matches, unranked"""
+    if not terms:
+        return TextMatch(query, literal(0.0), literal(None))
+    return search_backend().match(query, model, terms)
+
+
+def search_text(query: Query, model, text_query: str) -> Query:
+    """
+    Rows matching ``text_query``, best match first, with ``rank`` and
+    ``snippet`` columns added (matches nothing if the text has no terms)
+    """
+    terms = parse_terms(text_query)
+    if not terms:
+        query = query.filter(literal(False))
+    matched = match_terms(query, model, terms)
+    return matched.query.add_columns(
+        matched.rank.label("rank"),
+        matched.snippet.label("snippet")
+    ).order_by(matched.rank, model.timestamp.desc(), model.id.desc())
+
+
+def rebuild_index(engine: Engine, table: str, id_ranges) -> int:
+    """Re-index a table range by range (``id_ranges`` yields ``(low, high]``); returns rows indexed"""
+    backend = search_backend()
+    if not backend.needs_sync:
+        return 0
+    indexed = 0
+    for low, high in id_ranges:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                text(f"SELECT id, content, formatted_content FROM {table} WHERE id > :low AND id <= :high"),
+                {"low": low, "high": high}
+            ).all()
+            conn.execute(text(f"DELETE FROM {table}_fts WHERE rowid > :low AND rowid <= :high"), {"low": low, "high": high})
+            backend.index_rows(conn, table, rows)
+            indexed += len(rows)
+    return indexed
+
+
+def remove_from_index(conn: Connection, table: str, ids: Sequence[int]):
+    """Drop deleted rows from the index (for deletes that bypass the ORM)"""
+    backend = search_backend()
+    if backend.needs_sync:
+        backend.remove_rows(conn, table, ids)
+
+
+def _text_changed(obj) -> bool:
+    state = inspect(obj)
+    return state.attrs.content.history.has_changes() or state.attrs.formatted_content.history.has_changes()
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _sync_index(session, flush_context):
+    backend = search_backend()
+    if not backend.needs_sync:
+        return
+
+    changed = {}
+    removed = {}
+    for obj in session.new:
+        if isinstance(obj, INDEXED_MODELS):
+            changed.setdefault(obj.__tablename__, []).append(obj)
+    for obj in session.dirty:
+        if isinstance(obj, INDEXED_MODELS) and _text_changed(obj):
+            changed.setdefault(obj.__tablename__, []).append(obj)
+    for obj in session.deleted:
+        if isinstance(obj, INDEXED_MODELS):
+            removed.setdefault(obj.__tablename__, []).append(obj.id)
+    if not changed and not removed:
+        return
+
+    conn = session.connection()
+    for table, objs in changed.items():
+        backend.remove_rows(conn, table, [obj.id for obj in objs])
+        backend.index_rows(conn, table, [(obj.id, obj.content, obj.formatted_content) for obj in objs])
+    for table, ids in removed.items():
+        backend.remove_rows(conn, table, ids)
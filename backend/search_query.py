@@ -0,0 +1,317 @@
+"""
+Slack-style search query language.
+
+    deploy failed from:@sarah in:#incidents after:2024-05-01 has:link
+
+``parse_query`` turns the search box text into a ``ParsedQuery``: free-text
+terms (matched through the full-text index, see ``search_index``) plus a list
+of modifiers. ``message_filters`` compiles the modifiers into SQL predicates
+that the database evaluates together with the text match - column comparisons
+on indexed columns (author, channel, conversation, timestamp ranges) and
+EXISTS probes on indexed foreign keys - instead of filtering rows in Python
+after fetching them.
+
+Modifiers:
+
+- ``from:@user``       messages by that user (``from:me`` for yourself)
+- ``in:#channel``      channel messages posted in that channel
+- ``in:@user``         direct messages with that user
+- ``before:DATE``      before that day
+- ``after:DATE``       after that day
+- ``during:DATE``      within that day, month (``YYYY-MM``) or year (``YYYY``)
+- ``has:file``, ``has:link``, ``has:reaction``
+- ``is:thread``        messages that have replies
+
+``DATE`` is ``YYYY-MM-DD``, ``today`` or ``yesterday``. Anything that is not a
+known modifier is searched as text.
+
+Results of several tables (channel messages and DMs) are paged together with
+an opaque keyset cursor holding the last row's sort key: each table is asked
+for the rows past the cursor (``fetch_ranked``, which can run concurrently
+per table) and the results are merged (``merge_ranked``).
+"""
+
+import base64
+import json
+import re
+from datetime import date, datetime, timedelta
+from typing import List, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import and_, exists, false, func, or_, tuple_
+from sqlalchemy.orm import Query, Session
+
+from .models import (
+    Attachment, Channel, DirectMessage, DirectMessageAttachment, Message, Reaction, Thread, User, conversation_key
+)
+from .search_index import Term, match_terms, parse_terms
+
+MODIFIERS = ("from", "in", "before", "after", "during", "has", "is")
+HAS_VALUES = ("file", "link", "reaction")
+IS_VALUES = ("thread",)
+
+SORT_RELEVANCE = "relevance"
+SORT_RECENT = "recent"
+
+# Totals above this are reported as an estimate ("1000+")
+COUNT_LIMIT = 1000
+
+_TOKEN_RE = re.compile(r'(\w+):("[^"]*"|\S+)|"[^"]*"?|\S+')
+
+
+class Modifier(NamedTuple):
+    key: str
+    value: str
+
+
+class ParsedQuery(NamedTuple):
+    """Search box text split into free text and modifiers"""
+    text: str
+    terms: List[Term]
+    modifiers: List[Modifier]
+
+
+def parse_query(query: str) -> ParsedQuery:
+    text_parts = []
+    modifiers = []
+    for match in _TOKEN_RE.finditer(query or ""):
+        key, value = match.group(1), match.group(2)
+        if key and key.lower() in MODIFIERS and value.strip('"'):
+            modifiers.append(Modifier(key.lower(), value.strip('"')))
+        else:
+            text_parts.append(match.group(0))
+    text = " ".join(text_parts)
+    return ParsedQuery(text, parse_terms(text), modifiers)
+
+
+def normalize_query(parsed: ParsedQuery, current_user: User) -> str:
+    """
+    Canonical form of a query, for cache keys: text lowercased with collapsed
+    whitespace, modifiers sorted, ``me`` resolved to the caller and relative
+    days (``today``, ``yesterday``) pinned to the current date
+    """
+    modifiers = []
+    for key, value in parsed.modifiers:
+        lowered = value.lower()
+        if key == "from" and lowered.lstrip("@") == "me":
+            value = f"#{current_user.id}"
+        elif lowered in ("today", "yesterday"):
+            value = _day(value, key).isoformat()
+        modifiers.append(f"{key}:{value}")
+    text = " ".join(parsed.text.lower().split())
+    return " ".join([text] + sorted(modifiers))
+
+
+def _bad_query(detail: str):
+    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+
+def _day(value: str, modifier: str) -> date:
+    value = value.lower()
+    today = datetime.utcnow().date()
+    if value == "today":
+        return today
+    if value == "yesterday":
+        return today - timedelta(days=1)
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        _bad_query(f"Invalid date in {modifier}: (expected YYYY-MM-DD, today or yesterday)")
+
+
+def _period(value: str) -> Tuple[datetime, datetime]:
+    """[start, end) of the day, month or year named by a during: value"""
+    if re.fullmatch(r"\d{4}", value):
+        year = int(value)
+        return datetime(year, 1, 1), datetime(year + 1, 1, 1)
+    if re.fullmatch(r"\d{4}-\d{2}", value):
+        year, month = (int(part) for part in value.split("-"))
+        if not 1 <= month <= 12:
+            _bad_query("Invalid month in during:")
+        start = datetime(year, month, 1)
+        return start, datetime(year + month // 12, month % 12 + 1, 1)
+    start = datetime.combine(_day(value, "during"), datetime.min.time())
+    return start, start + timedelta(days=1)
+
+
+def _user_id(db: Session, value: str, current_user: User) -> Optional[int]:
+    name = value.lstrip("@")
+    if name.lower() == "me":
+        return current_user.id
+    return db.query(User.id).filter(User.username == name).scalar()
+
+
+def message_filters(db: Session, parsed: ParsedQuery, model, current_user: User) -> Optional[list]:
+    """
+    SQL predicates over ``model`` (Message or DirectMessage) for the query's
+    modifiers, or None if the modifiers rule that table out entirely
+    """
+    is_channel = model is Message
+    author = Message.user_id if is_channel else DirectMessage.sender_id
+    filters = []
+
+    for key, value in parsed.modifiers:
+        lowered = value.lower()
+        if key == "from":
+            user_id = _user_id(db, value, current_user)
+            filters.append(author == user_id if user_id is not None else false())
+
+        elif key == "in":
+            if value.startswith("@"):
+                if is_channel:
+                    return None
+                partner_id = _user_id(db, value, current_user)
+                if partner_id is None:
+                    return None
+                filters.append(DirectMessage.conversation_key == conversation_key(current_user.id, partner_id))
+            else:
+                if not is_channel:
+                    return None
+                channel_id = db.query(Channel.id).filter(Channel.name == value.lstrip("#")).scalar()
+                if channel_id is None:
+                    return None
+                filters.append(Message.channel_id == channel_id)
+
+        elif key == "before":
+            day = _day(value, "before")
+            filters.append(model.timestamp < datetime.combine(day, datetime.min.time()))
+
+        elif key == "after":
+            day = _day(value, "after")
+            filters.append(model.timestamp >= datetime.combine(day + timedelta(days=1), datetime.min.time()))
+
+        elif key == "during":
+            start, end = _period(lowered)
+            filters.append(and_(model.timestamp >= start, model.timestamp < end))
+
+        elif key == "has":
+            if lowered not in HAS_VALUES:
+                _bad_query(f"Unknown has: value '{value}' (expected {', '.join(HAS_VALUES)})")
+            if lowered == "file":
+                if is_channel:
+                    filters.append(exists().where(Attachment.message_id == Message.id))
+                else:
+                    filters.append(exists().where(DirectMessageAttachment.direct_message_id == DirectMessage.id))
+            elif lowered == "link":
+                # Row-level check, applied only to rows the other predicates let through
+                filters.append(or_(
+                    model.content.ilike("%http://%"),
+                    model.content.ilike("%https://%"),
+                    model.formatted_content.ilike("%href=%")
+                ))
+            elif lowered == "reaction":
+                if not is_channel:
+                    return None
+                filters.append(exists().where(Reaction.message_id == Message.id))
+
+        elif key == "is":
+            if lowered not in IS_VALUES:
+                _bad_query(f"Unknown is: value '{value}' (expected {', '.join(IS_VALUES)})")
+            if not is_channel:
+                return None
+            filters.append(exists().where(Thread.parent_message_id == Message.id))
+
+    return filters
+
+
+# ----- keyset paging over ranked results -----
+
+class SearchCursor(NamedTuple):
+    """Sort key of the last row on a page"""
+    rank: float
+    timestamp: datetime
+    row_id: int
+    kind: int  # position of the row's table in the merged stream
+
+
+def encode_search_cursor(cursor: SearchCursor) -> str:
+    raw = json.dumps([cursor.rank, cursor.timestamp.isoformat(), cursor.row_id, cursor.kind])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_search_cursor(cursor: str) -> SearchCursor:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        rank, ts, row_id, kind = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        return SearchCursor(float(rank), datetime.fromisoformat(ts), int(row_id), int(kind))
+    except Exception:
+        _bad_query("Invalid cursor")
+
+
+class RankedHit(NamedTuple):
+    kind: int
+    row: object
+    rank: float
+    snippet: Optional[str]
+
+    @property
+    def cursor(self) -> SearchCursor:
+        return SearchCursor(self.rank, self.row.timestamp, self.row.id, self.kind)
+
+
+def _after_cursor(model, rank, kind: int, cursor: SearchCursor, sort: str):
+    """Rows of one table that come after ``cursor`` in the merged stream order"""
+    # Stream order: rank ascending (relevance only), then newest first, then
+    # higher kind first; kind is constant per table, so it only decides
+    # whether the cursor row's own (timestamp, id) is included
+    key = tuple_(model.timestamp, model.id)
+    position = (cursor.timestamp, cursor.row_id)
+    older = key <= position if kind < cursor.kind else key < position
+    if sort == SORT_RECENT:
+        return older
+    return or_(rank > cursor.rank, and_(rank == cursor.rank, older))
+
+
+class RankedRows(NamedTuple):
+    """One table's share of a page, plus its (capped) match count"""
+    hits: List[RankedHit]
+    total: int
+    total_is_estimate: bool
+
+
+def fetch_ranked(
+    kind: int,
+    query: Query,
+    model,
+    terms: List[Term],
+    sort: str,
+    limit: int,
+    cursor: Optional[str] = None
+) -> RankedRows:
+    """
+    Up to ``limit + 1`` full-text matches from one table, past ``cursor`` in
+    stream order. ``query`` has the modifier filters already applied; the
+    match count is capped at ``COUNT_LIMIT``.
+    """
+    after = decode_search_cursor(cursor) if cursor else None
+    matched = match_terms(query, model, terms)
+
+    counted = matched.query.with_entities(model.id).order_by(None).limit(COUNT_LIMIT + 1).subquery()
+    count = matched.query.session.query(func.count()).select_from(counted).scalar()
+
+    page_query = matched.query
+    if after is not None:
+        page_query = page_query.filter(_after_cursor(model, matched.rank, kind, after, sort))
+    order = [model.timestamp.desc(), model.id.desc()]
+    if sort == SORT_RELEVANCE:
+        order.insert(0, matched.rank)
+    rows = page_query.add_columns(
+        matched.rank.label("rank"),
+        matched.snippet.label("snippet")
+    ).order_by(*order).limit(limit + 1).all()
+
+    hits = [RankedHit(kind, row, float(rank or 0.0), snippet) for row, rank, snippet in rows]
+    return RankedRows(hits, min(count, COUNT_LIMIT), count > COUNT_LIMIT)
+
+
+def merge_ranked(parts: List[RankedRows], sort: str, limit: int) -> Tuple[List[RankedHit], Optional[str]]:
+    """Merge per-table rows into one page in stream order; returns ``(hits, next_cursor)``"""
+    hits = [hit for part in parts for hit in part.hits]
+    # Newest first (ties broken by kind), then stably by rank
+    hits.sort(key=lambda hit: (hit.row.timestamp, hit.row.id, hit.kind), reverse=True)
+    if sort == SORT_RELEVANCE:
+        hits.sort(key=lambda hit: hit.rank)
+
+    page = hits[:limit]
+    next_cursor = encode_search_cursor(page[-1].cursor) if len(hits) > limit else None
+    return page, next_cursor
@@ -0,0 +1,174 @@
+"""
+In-process cache of validated sessions.
+
+Resolving a session cookie costs a ``sessions`` lookup plus a ``users`` lookup.
+Both the auth middleware and ``get_current_user`` need the answer on every
+request, so the resolved session (and a snapshot of its user) is kept here in
+a TTL'd LRU keyed by session id. Entries never outlive the session itself and
+are dropped on logout and whenever the user's profile changes. Drops go
+through ``drop_session`` / ``drop_user_sessions``, which also publish them on
+the ``sessions`` event-bus topic so every worker forgets its copy - a logged
+out cookie must not keep working on the worker that happened to cache it.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .models import Session as SessionModel, User
+from .realtime import hub
+
+SESSIONS_TOPIC = "sessions"
+
+
+class CachedSession:
+    """A validated session and a snapshot of the user it belongs to"""
+
+    __slots__ = ("session_id", "user_id", "expires_at", "user", "cached_until")
+
+    def __init__(self, session_id: str, user_id: int, expires_at: datetime, user: dict, cached_until: float):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.expires_at = expires_at
+        self.user = user
+        self.cached_until = cached_until
+
+
+class SessionCache:
+    """Thread-safe LRU of CachedSession entries with a per-entry TTL"""
+
+    def __init__(self, max_size: int, ttl_seconds: int):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, CachedSession]" = OrderedDict()
+        self._by_user: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, session_id: str) -> Optional[CachedSession]:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.cached_until <= time.monotonic() or entry.expires_at < datetime.utcnow():
+                self._remove(session_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return entry
+
+    def put(self, session_id: str, user_id: int, expires_at: datetime, user: dict) -> CachedSession:
+        # Never cache past the session's own expiry
+        seconds_left = (expires_at - datetime.utcnow()).total_seconds()
+        ttl = max(0.0, min(self.ttl_seconds, seconds_left))
+        entry = CachedSession(session_id, user_id, expires_at, user, time.monotonic() + ttl)
+        with self._lock:
+            self._remove(session_id)
+            self._entries[session_id] = entry
+            self._by_user.setdefault(user_id, set()).add(session_id)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+        return entry
+
+    def invalidate(self, session_id: str):
+        with self._lock:
+            self._remove(session_id)
+
+    def invalidate_user(self, user_id: int):
+        """Drop every cached session of a user (e.g. after a profile update)"""
+        with self._lock:
+            for session_id in list(self._by_user.get(user_id, ())):
+                self._remove(session_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def _remove(self, session_id: str):
+        entry = self._entries.pop(session_id, None)
+        if entry is None:
+            return
+        sessions = self._by_user.get(entry.user_id)
+        if sessions is not None:
+            sessions.discard(session_id)
+            if not sessions:
+                del self._by_user[entry.user_id]
+
+
+session_cache = SessionCache(settings.SESSION_CACHE_SIZE, settings.SESSION_CACHE_TTL_SECONDS)
+
+
+def drop_session(session_id: str):
+    """Forget a session on this worker now and on every other worker via the bus"""
+    session_cache.invalidate(session_id)
+    hub.publish(SESSIONS_TOPIC, "session.invalidated", {"session_id": session_id})
+
+
+def drop_user_sessions(user_id: int):
+    """Forget every cached session of a user on every worker (e.g. after a profile update)"""
+    session_cache.invalidate_user(user_id)
+    hub.publish(SESSIONS_TOPIC, "session.invalidated", {"user_id": user_id})
+
+
+def _on_bus_event(text: str):
+    """Apply an invalidation made by any worker (including this one)"""
+    data = json.loads(text)["data"]
+    if data.get("session_id"):
+        session_cache.invalidate(data["session_id"])
+    if data.get("user_id") is not None:
+        session_cache.invalidate_user(data["user_id"])
+
+
+hub.add_listener(SESSIONS_TOPIC, _on_bus_event)
+
+
+def user_snapshot(user: User) -> dict:
+    """Fields of the authenticated user that are safe to keep in the cache"""
+    return {
+        "id": user.id,
+        "username": user.username,
+        "email": user.email,
+        "full_name": user.full_name,
+        "profile_picture": user.profile_picture,
+        "status": user.status
+    }
+
+
+def resolve_session(db: Session, session_id: Optional[str]) -> Optional[CachedSession]:
+    """
+    Resolve a session cookie to a CachedSession, or None if it is missing,
+    unknown or expired. Expired sessions are deleted. Hits cost no queries;
+    misses cost one joined query.
+    """
+    if not session_id:
+        return None
+
+    cached = session_cache.get(session_id)
+    if cached is not None:
+        return cached
+
+    row = db.query(SessionModel, User).join(
+        User, User.id == SessionModel.user_id
+    ).filter(
+        SessionModel.session_id == session_id
+    ).first()
+    if row is None:
+        return None
+
+    session, user = row
+    if session.expires_at < datetime.utcnow():
+        db.delete(session)
+        db.commit()
+        return None
+
+    return session_cache.put(session_id, user.id, session.expires_at, user_snapshot(user))
@@ -0,0 +1,341 @@
+"""
+In-memory typeahead index over users, user groups and channels.
+
+@-mention completion, #-channel links and the quick switcher query on every
+keystroke, so they are answered from memory instead of running
+``ilike('%q%')`` over the tables:
+
+- a prefix trie over every word of every entry's names (``sar`` finds
+  ``sarah.johnson`` and "Sarah Johnson"), and
+- a trigram index over the same fields, for matches in the middle of a word
+  and for substring filters such as ``GET /api/users?search=``.
+
+The index is built from the database at startup. After that it is updated
+incrementally from the ORM: inserts, renames and deletes of users, groups
+and channels are collected at flush time and applied once their transaction
+commits. The same change is published on the ``typeahead`` event-bus topic,
+so every other worker applies it too (applying an update twice is harmless).
+"""
+
+import json
+import threading
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal
+from .models import Channel, User, UserGroup
+from .realtime import hub
+
+TYPEAHEAD_TOPIC = "typeahead"
+
+USER = "user"
+CHANNEL = "channel"
+USER_GROUP = "user_group"
+KINDS = (USER, CHANNEL, USER_GROUP)
+
+# Columns whose change makes an entry stale
+_TRACKED = {
+    User: ("username", "name", "full_name", "email", "profile_picture"),
+    Channel: ("name", "description", "is_private"),
+    UserGroup: ("name", "handle"),
+}
+
+Key = Tuple[str, int]
+
+
+class Entry(NamedTuple):
+    """What the index knows about one user, channel or user group"""
+    kind: str
+    id: int
+    name: str                   # username, channel name or group handle
+    display_name: Optional[str]
+    fields: Tuple[str, ...]     # lowercased text searched for substrings
+    is_private: bool = False
+    profile_picture: Optional[str] = None
+
+    @property
+    def key(self) -> Key:
+        return (self.kind, self.id)
+
+
+def entry_for(obj) -> Optional[Entry]:
+    if isinstance(obj, User):
+        display = obj.full_name or obj.name
+        return Entry(USER, obj.id, obj.username, display, _fields(obj.username, display, obj.email),
+                     profile_picture=obj.profile_picture)
+    if isinstance(obj, Channel):
+        return Entry(CHANNEL, obj.id, obj.name, obj.description, _fields(obj.name, obj.description),
+                     is_private=bool(obj.is_private))
+    if isinstance(obj, UserGroup):
+        handle = (obj.handle or "").lstrip("@")
+        return Entry(USER_GROUP, obj.id, handle, obj.name, _fields(handle, obj.name))
+    return None
+
+
+def _fields(*values: Optional[str]) -> Tuple[str, ...]:
+    return tuple(value.lower() for value in values if value)
+
+
+def _words(entry: Entry) -> Set[str]:
+    """Trie tokens: each field whole, plus each of its words"""
+    words = set()
+    for field in entry.fields:
+        words.add(field)
+        for sep in ".-_@ ":
+            field = field.replace(sep, " ")
+        words.update(field.split())
+    return words
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class _TrieNode:
+    __slots__ = ("children", "keys")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.keys: Set[Key] = set()  # every entry with a word under this node
+
+
+class Match(NamedTuple):
+    entry: Entry
+    score: float
+
+
+class TypeaheadIndex:
+    """Thread-safe prefix trie and trigram index over Entry objects"""
+
+    def __init__(self):
+        self._entries: Dict[Key, Entry] = {}
+        self._root = _TrieNode()
+        self._trigrams: Dict[str, Set[Key]] = {}
+        self._lock = threading.RLock()
+        self.built = False
+
+    # ----- maintenance -----
+
+    def rebuild(self, db: Session):
+        """Replace the index contents with what is in the database"""
+        entries = [entry_for(obj) for model in (User, Channel, UserGroup) for obj in db.query(model).all()]
+        with self._lock:
+            self._entries.clear()
+            self._root = _TrieNode()
+            self._trigrams.clear()
+            for entry in entries:
+                self._add(entry)
+            self.built = True
+
+    def upsert(self, entry: Entry):
+        with self._lock:
+            self._remove(entry.key)
+            self._add(entry)
+
+    def remove(self, key: Key):
+        with self._lock:
+            self._remove(key)
+
+    def _add(self, entry: Entry):
+        self._entries[entry.key] = entry
+        for word in _words(entry):
+            node = self._root
+            for char in word:
+                node = node.children.setdefault(char, _TrieNode())
+                node.keys.add(entry.key)
+        for field in entry.fields:
+            for gram in _trigrams(field):
+                self._trigrams.setdefault(gram, set()).add(entry.key)
+
+    def _remove(self, key: Key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for word in _words(entry):
+            path = [self._root]
+            for char in word:
+                node = path[-1].children.get(char)
+                if node is None:
+                    break
+                node.keys.discard(key)
+                path.append(node)
+            # Prune branches no entry passes through any more
+            for depth in range(len(path) - 1, 0, -1):
+                if path[depth].keys:
+                    break
+                del path[depth - 1].children[word[depth - 1]]
+        for field in entry.fields:
+            for gram in _trigrams(field):
+                keys = self._trigrams.get(gram)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._trigrams[gram]
+
+    # ----- lookups -----
+
+    def _prefixed(self, prefix: str) -> Set[Key]:
+        node = self._root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return set()
+        return node.keys
+
+    def search(self, query: str, kinds: Iterable[str] = KINDS, accept: Optional[Callable[[Entry], bool]] = None,
+               limit: int = 10) -> List[Match]:
+        """
+        Ranked matches for a typed prefix: exact name, then name prefix, then
+        word prefix, then substring, then trigram similarity
+        """
+        query = query.strip().lower()
+        kinds = set(kinds)
+        with self._lock:
+            candidates = set(self._prefixed(query)) if query else set(self._entries)
+            grams = _trigrams(query)
+            if grams:
+                # Entries sharing at least half of the query's trigrams
+                shared: Dict[Key, int] = {}
+                for gram in grams:
+                    for key in self._trigrams.get(gram, ()):
+                        shared[key] = shared.get(key, 0) + 1
+                candidates.update(key for key, count in shared.items() if count * 2 >= len(grams))
+            entries = [self._entries[key] for key in candidates if key[0] in kinds]
+
+        matches = []
+        for entry in entries:
+            if accept is not None and not accept(entry):
+                continue
+            score = self._score(entry, query, grams)
+            if score > 0:
+                matches.append(Match(entry, score))
+        matches.sort(key=lambda m: (-m.score, len(m.entry.name), m.entry.name, m.entry.kind))
+        return matches[:limit]
+
+    @staticmethod
+    def _score(entry: Entry, query: str, grams: Set[str]) -> float:
+        name = entry.name.lower()
+        if not query or name == query:
+            return 1.0
+        if name.startswith(query):
+            return 0.9
+        if any(word.startswith(query) for word in _words(entry)):
+            return 0.75
+        if any(query in field for field in entry.fields):
+            return 0.6
+        if grams:
+            best = max((len(grams & _trigrams(field)) for field in entry.fields), default=0)
+            return 0.5 * best / len(grams)
+        return 0.0
+
+    def substring_ids(self, kind: str, query: str, fields: Optional[Callable[[Entry], Iterable[str]]] = None,
+                      accept: Optional[Callable[[Entry], bool]] = None, limit: Optional[int] = None) -> List[int]:
+        """
+        Ids of entries of ``kind`` with ``query`` anywhere in their fields
+        (case-insensitive) - the in-memory equivalent of ``ilike('%q%')`` -
+        best match first (same ranking as ``search``), at most ``limit``
+        """
+        query = query.lower()
+        fields = fields or (lambda entry: entry.fields)
+        with self._lock:
+            grams = _trigrams(query)
+            if grams:
+                # Every entry containing the query contains all of its trigrams
+                keys = set.intersection(*(self._trigrams.get(gram, set()) for gram in grams))
+            else:
+                keys = self._entries.keys()
+            entries = [self._entries[key] for key in keys if key[0] == kind]
+        entries = [entry for entry in entries
+                   if any(query in field for field in fields(entry)) and (accept is None or accept(entry))]
+        entries.sort(key=lambda entry: (-self._score(entry, query, grams), len(entry.name), entry.name, entry.id))
+        return [entry.id for entry in entries[:limit]]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "trigrams": len(self._trigrams),
+                "built": self.built
+            }
+
+
+typeahead_index = TypeaheadIndex()
+
+
+def in_rank_order(rows: list, ids: List[int]) -> list:
+    """Rows loaded with ``Model.id.in_(ids)`` put back in the order of ``ids``"""
+    position = {row_id: i for i, row_id in enumerate(ids)}
+    return sorted(rows, key=lambda row: position[row.id])
+
+
+# ----- incremental maintenance -----
+
+_PENDING_KEY = "typeahead_pending"
+
+
+_KIND_OF = {User: USER, Channel: CHANNEL, UserGroup: USER_GROUP}
+
+
+def _changed(obj) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in _TRACKED[type(obj)])
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_changes(session, flush_context):
+    changes: Dict[Key, Optional[Entry]] = {}
+    for obj in session.new:
+        if type(obj) in _TRACKED:
+            entry = entry_for(obj)
+            changes[entry.key] = entry
+    for obj in session.dirty:
+        if type(obj) in _TRACKED and _changed(obj):
+            entry = entry_for(obj)
+            changes[entry.key] = entry
+    for obj in session.deleted:
+        if type(obj) in _TRACKED:
+            changes[(_KIND_OF[type(obj)], obj.id)] = None
+    if changes:
+        session.info.setdefault(_PENDING_KEY, {}).update(changes)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _apply_changes(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    apply_changes(pending)
+    hub.publish(TYPEAHEAD_TOPIC, "typeahead.changed", {
+        "upserts": [entry._asdict() for entry in pending.values() if entry is not None],
+        "removals": [list(key) for key, entry in pending.items() if entry is None]
+    })
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_changes(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def apply_changes(pending: Dict[Key, Optional[Entry]]):
+    for key, entry in pending.items():
+        if entry is None:
+            typeahead_index.remove(key)
+        else:
+            typeahead_index.upsert(entry)
+
+
+def _on_bus_event(text: str):
+    """Apply a change committed by any worker (including this one)"""
+    data = json.loads(text)["data"]
+    pending: Dict[Key, Optional[Entry]] = {}
+    for fields in data.get("upserts", ()):
+        entry = Entry(**{**fields, "fields": tuple(fields["fields"])})
+        pending[entry.key] = entry
+    for kind, row_id in data.get("removals", ()):
+        pending[(kind, row_id)] = None
+    apply_changes(pending)
+
+
+hub.add_listener(TYPEAHEAD_TOPIC, _on_bus_event)
@@ -98,7 +98,7 @@ export default function IconNav() {
     setLoadingActivities(true)
     try {
       const res = await api.get('/api/activity/all')
-      setActivitiesList(res.data || [])
+      setActivitiesList(res.data?.activities || [])
     } catch (err) {
       console.debug('Failed to load activities', err)
     } finally {
@@ -16,6 +16,9 @@ export default function ActivityPage() {
   const [viewType, setViewType] = useState(null)
   const [activities, setActivities] = useState([])
   const [loading, setLoading] = useState(true)
+  // The feed is paged newest first: nextCursor fetches the next older page
+  const [nextCursor, setNextCursor] = useState(null)
+  const [loadingOlder, setLoadingOlder] = useState(false)
 
   const defaultWidth = 352
   const minWidth = 319.2
@@ -27,7 +30,8 @@ export default function ActivityPage() {
     api.get('/api/activity/all')
       .then(res => {
         console.log('Activities API response:', res.data)
-        const data = res.data || []
+        const data = res.data?.activities || []
+        setNextCursor(res.data?.has_more ? res.data.next_cursor : null)
         if (!data || data.length === 0) {
           // try public endpoint as fallback
           return api.get('/api/activity/public')
@@ -107,6 +111,20 @@ export default function ActivityPage() {
     }
   }, [activities]);
 
+  const loadOlderActivities = async () => {
+    if (!nextCursor || loadingOlder) return
+    setLoadingOlder(true)
+    try {
+      const res = await api.get('/api/activity/all', { params: { before: nextCursor } })
+      setActivities((prev) => [...prev, ...(res.data?.activities || [])])
+      setNextCursor(res.data?.has_more ? res.data.next_cursor : null)
+    } catch (err) {
+      console.error('Error loading older activities:', err)
+    } finally {
+      setLoadingOlder(false)
+    }
+  }
+
   const handleActivityClick = (activity) => {
     setSelectedActivity(activity)
     setViewType(activity.contentType)
@@ -178,6 +196,13 @@ export default function ActivityPage() {
                     </div>
                   ))
               )}
+              {!loading && nextCursor && (
+                <div style={{ padding: '12px 20px', textAlign: 'center' }}>
+                  <button className="filter-btn" onClick={loadOlderActivities} disabled={loadingOlder}>
+                    {loadingOlder ? 'Loading…' : 'Load older activity'}
+                  </button>
+                </div>
+              )}
             </div>
           </div>
         </div>
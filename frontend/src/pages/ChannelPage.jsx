@@ -40,18 +40,58 @@ export default function ChannelPage({ channelId }){
   const [searchQuery, setSearchQuery] = useState('')
   const [searchResults, setSearchResults] = useState([])
   const [openCanvasId, setOpenCanvasId] = useState(null)
+  // History is paged: olderCursor is the prev_cursor of the oldest page loaded so far
+  const [olderCursor, setOlderCursor] = useState(null)
+  const [loadingOlder, setLoadingOlder] = useState(false)
+  const olderLoadedRef = useRef(false)
+  const restoreScrollRef = useRef(null)
 
+  // Reload the newest page, keeping any older pages already scrolled back to
   const fetchMessages = async () => {
     if (channel?.id) {
       try {
         const res = await api.get(`/api/messages/channel/${channel.id}`)
-        setMessages(res.data)
+        const page = res.data.messages
+        setMessages(prev => {
+          const first = page.length ? page[0].id : null
+          const older = first === null ? [] : prev.filter(m => m.id < first)
+          return [...older, ...page]
+        })
+        if (!olderLoadedRef.current) {
+          setOlderCursor(res.data.has_more_before ? res.data.prev_cursor : null)
+        }
       } catch (err) {
         console.error('Error fetching messages:', err)
       }
     }
   }
 
+  // Prepend the page before the oldest message shown
+  const loadOlderMessages = async () => {
+    if (!channel?.id || !olderCursor || loadingOlder) return
+    setLoadingOlder(true)
+    try {
+      const res = await api.get(`/api/messages/channel/${channel.id}`, { params: { before: olderCursor } })
+      olderLoadedRef.current = true
+      restoreScrollRef.current = channelContentRef.current?.scrollHeight ?? null
+      setMessages(prev => {
+        const shown = new Set(prev.map(m => m.id))
+        return [...res.data.messages.filter(m => !shown.has(m.id)), ...prev]
+      })
+      setOlderCursor(res.data.has_more_before ? res.data.prev_cursor : null)
+    } catch (err) {
+      console.error('Error loading older messages:', err)
+    } finally {
+      setLoadingOlder(false)
+    }
+  }
+
+  const handleContentScroll = (e) => {
+    if (e.currentTarget.scrollTop < 80) {
+      loadOlderMessages()
+    }
+  }
+
   useEffect(()=>{
     if (channelName) {
       // Fetch channel details by name
@@ -78,6 +118,9 @@ export default function ChannelPage({ channelId }){
   // Fetch messages when channel is loaded
   useEffect(() => {
     if (channel?.id) {
+      setMessages([])
+      setOlderCursor(null)
+      olderLoadedRef.current = false
       fetchMessages()
     }
   }, [channel?.id])
@@ -206,10 +249,14 @@ export default function ChannelPage({ channelId }){
     }
   }
 
-  // Auto-scroll to bottom when messages change
+  // Auto-scroll to bottom when messages change; keep the view in place when older ones are prepended
   useEffect(() => {
     if (channelContentRef.current) {
-      channelContentRef.current.scrollTop = channelContentRef.current.scrollHeight
+      const previousHeight = restoreScrollRef.current
+      restoreScrollRef.current = null
+      channelContentRef.current.scrollTop = previousHeight !== null
+        ? channelContentRef.current.scrollHeight - previousHeight
+        : channelContentRef.current.scrollHeight
     }
   }, [messages])
 
@@ -337,7 +384,7 @@ export default function ChannelPage({ channelId }){
 
       {/* Channel Content */}
       {activeTab === 'messages' && (
-        <div className="channel-content" ref={channelContentRef}>
+        <div className="channel-content" ref={channelContentRef} onScroll={handleContentScroll}>
         
         {/* Optional: Welcome Section for templates */}
         <div className="welcome-section" style={{display: 'none'}}>
@@ -440,6 +487,14 @@ export default function ChannelPage({ channelId }){
             <button className="date-btn">Today <ChevronDownIcon size={14} /></button>
           </div>
 
+          {olderCursor && (
+            <div className="date-divider">
+              <button className="date-btn" onClick={loadOlderMessages} disabled={loadingOlder}>
+                {loadingOlder ? 'Loading…' : 'Load older messages'}
+              </button>
+            </div>
+          )}
+
           {messages.map(msg => (
       <div key={msg.id} className={`message ${msg.is_system_message ? 'system-message' : ''}`}
         style={{ position: 'relative' }}
@@ -24,18 +24,58 @@ export default function DMPage({ userId }){
   const [activeTab, setActiveTab] = useState('messages')
   const [isStarred, setIsStarred] = useState(false)
   const dmContentRef = useRef(null)
+  // History is paged: olderCursor is the prev_cursor of the oldest page loaded so far
+  const [olderCursor, setOlderCursor] = useState(null)
+  const [loadingOlder, setLoadingOlder] = useState(false)
+  const olderLoadedRef = useRef(false)
+  const restoreScrollRef = useRef(null)
 
+  // Reload the newest page, keeping any older pages already scrolled back to
   const fetchMessages = async () => {
     if (id) {
       try {
         const res = await api.get(`/api/direct-messages/conversation/${id}`)
-        setMessages(res.data)
+        const page = res.data.messages
+        setMessages(prev => {
+          const first = page.length ? page[0].id : null
+          const older = first === null ? [] : prev.filter(m => m.id < first)
+          return [...older, ...page]
+        })
+        if (!olderLoadedRef.current) {
+          setOlderCursor(res.data.has_more_before ? res.data.prev_cursor : null)
+        }
       } catch (err) {
         console.error('Error fetching messages:', err)
       }
     }
   }
 
+  // Prepend the page before the oldest message shown
+  const loadOlderMessages = async () => {
+    if (!id || !olderCursor || loadingOlder) return
+    setLoadingOlder(true)
+    try {
+      const res = await api.get(`/api/direct-messages/conversation/${id}`, { params: { before: olderCursor } })
+      olderLoadedRef.current = true
+      restoreScrollRef.current = dmContentRef.current?.scrollHeight ?? null
+      setMessages(prev => {
+        const shown = new Set(prev.map(m => m.id))
+        return [...res.data.messages.filter(m => !shown.has(m.id)), ...prev]
+      })
+      setOlderCursor(res.data.has_more_before ? res.data.prev_cursor : null)
+    } catch (err) {
+      console.error('Error loading older messages:', err)
+    } finally {
+      setLoadingOlder(false)
+    }
+  }
+
+  const handleContentScroll = (e) => {
+    if (e.currentTarget.scrollTop < 80) {
+      loadOlderMessages()
+    }
+  }
+
   useEffect(()=>{
     if (id) {
       // Fetch contact/user info
@@ -57,14 +97,21 @@ export default function DMPage({ userId }){
       })
 
       // Fetch direct messages conversation with this user
+      setMessages([])
+      setOlderCursor(null)
+      olderLoadedRef.current = false
       fetchMessages()
     }
   }, [id])
 
-  // Auto-scroll to bottom when messages change
+  // Auto-scroll to bottom when messages change; keep the view in place when older ones are prepended
   useEffect(() => {
     if (dmContentRef.current) {
-      dmContentRef.current.scrollTop = dmContentRef.current.scrollHeight
+      const previousHeight = restoreScrollRef.current
+      restoreScrollRef.current = null
+      dmContentRef.current.scrollTop = previousHeight !== null
+        ? dmContentRef.current.scrollHeight - previousHeight
+        : dmContentRef.current.scrollHeight
     }
   }, [messages])
 
@@ -140,7 +187,7 @@ export default function DMPage({ userId }){
 
       {/* DM Content */}
       {activeTab === 'messages' && (
-        <div className="dm-content" ref={dmContentRef}>
+        <div className="dm-content" ref={dmContentRef} onScroll={handleContentScroll}>
 
         {/* Message Feed */}
         <div className="message-feed">
@@ -202,6 +249,14 @@ export default function DMPage({ userId }){
             </div>
           </div>
 
+          {olderCursor && (
+            <div className="date-divider">
+              <button className="date-btn" onClick={loadOlderMessages} disabled={loadingOlder}>
+                {loadingOlder ? 'Loading…' : 'Load older messages'}
+              </button>
+            </div>
+          )}
+
           {messages.map(msg => (
             <div key={msg.id} className="message" style={{ position: 'relative' }}
                  onMouseEnter={() => setHoveredMessageId(msg.id)}
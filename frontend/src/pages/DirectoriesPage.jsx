@@ -311,7 +311,7 @@ const DirectoriesPage = () => {
                     <div>
                       <div style={{ fontSize: 16, fontWeight: 700, color: '#e6e7e8' }}># {ch.name}</div>
                       <div style={{ color: '#9ea4ac', fontSize: 13 }}>{ch.description || 'No description'}</div>
-                      <div style={{ color: '#9ea4ac', fontSize: 12, marginTop: 6 }}>{(ch.members && ch.members.length) || 0} members · {ch.is_private ? 'Private' : 'Public'}</div>
+                      <div style={{ color: '#9ea4ac', fontSize: 12, marginTop: 6 }}>{ch.member_count ?? ((ch.members && ch.members.length) || 0)} members · {ch.is_private ? 'Private' : 'Public'}</div>
                     </div>
                     <div style={{ display: 'flex', gap: 8 }}>
                       {isJoined ? (